@@ -1,30 +1,66 @@
 import calendar
+import hashlib
+import hmac
 import logging
-from datetime import date, datetime, time
+from contextlib import asynccontextmanager
+from datetime import UTC, date, datetime, time
+from email.utils import format_datetime
 
 from fastapi import (
     Depends,
     FastAPI,
     File,
     HTTPException,
+    Query,
     Request,
     Response,
     UploadFile,
     status,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from sqlalchemy import delete, select
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse
+from sqlalchemy import delete, func, literal, select, tuple_
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import Session
 
-from agendamento.database import get_session
-from agendamento.models import Agendamento, Pagamento, User
+from agendamento.async_routes import RotaAssincrona, fora_do_loop, no_limitador
+from agendamento.availability import (
+    INTERVALO_MAXIMO_DIAS,
+    indice_disponibilidade,
+    rotulos_livres,
+)
+from agendamento.database import (
+    engines,
+    engines_async,
+    get_session,
+    nova_sessao,
+    settings,
+)
+from agendamento.metrics import MiddlewareMetricas, metricas
+from agendamento.models import Agendamento, Comprovante, Pagamento, User
+from agendamento.pool import configurar_limitador, threads_para_pool
+from agendamento.query_log import registro_consultas
+from agendamento.receipts import (
+    ArmazemComprovantes,
+    get_armazem_comprovantes,
+)
 from agendamento.schemas import (
+    LIMITE_MAXIMO,
     AgendamentoAdminCriar,
     AgendamentoCriar,
+    AgendamentoList,
+    AgendamentoLoteCriar,
+    AgendamentoLoteResultado,
     AgendamentoPublico,
+    DiagnosticoConsultas,
+    FiltroAgendamentos,
+    FiltroPagina,
+    FiltroPeriodo,
+    FiltroUsuarios,
     HorariosDisponiveis,
+    ImportacaoResultado,
     Message,
+    PagamentoList,
     PagamentoPublico,
     PagamentoStatus,
     Token,
@@ -34,15 +70,91 @@ from agendamento.schemas import (
     UserSchema,
 )
 from agendamento.security import (
+    UsuarioAutenticado,
+    cache_principais,
     criar_token,
     get_current_admin,
+    get_current_admin_leitura,
     get_current_user,
+    get_current_user_leitura,
+)
+from agendamento.serialization import linhas_como_dicts, resposta_json
+from agendamento.services import (
+    alterar_status_pagamento,
+    cadastrar_usuario,
+    definir_pagamento_atual,
+    importar_usuarios,
+    ler_csv,
+    ler_ndjson,
+    registrar_alteracao,
+    registrar_comprovante,
+    reservar_horario,
+    reservar_horarios,
+    status_pelo_vencimento,
+    versao_global,
+    versao_usuario,
 )
+from agendamento.sweeper import VarredorPagamentos
+
+varredor = VarredorPagamentos(settings.VARREDURA_INTERVALO_SEGUNDOS)
+
+
+def _pre_carregar_indice() -> None:
+    # Índice de disponibilidade dos próximos dias
+    try:
+        with nova_sessao() as session:
+            indice_disponibilidade.ocupados(session, date.today())
+    except SQLAlchemyError:
+        logging.warning(
+            'Não foi possível pré-carregar o índice de disponibilidade; '
+            'ele será carregado sob demanda.'
+        )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Threads e vagas no banco do tamanho do pool: toda requisição admitida
+    # tem conexão, e a que segura uma sempre acha thread (pool.py)
+    configurar_limitador(
+        threads_para_pool(
+            settings.DB_POOL_SIZE,
+            settings.DB_MAX_OVERFLOW,
+            settings.THREADPOOL_TOKENS,
+        )
+    )
+    # As engines não são criadas na importação; criá-las aqui faz um erro
+    # de configuração do banco impedir a subida, e não a primeira requisição
+    engines()
+    if settings.DB_ASYNC:
+        engines_async()
+    if settings.WORKERS > 1:
+        # O índice é deste worker: as reservas feitas nos outros só chegam
+        # a ele relendo o banco
+        indice_disponibilidade.ttl = settings.DISPONIBILIDADE_TTL_SEGUNDOS
+        # Idem para o cache de usuários: uma remoção feita noutro worker
+        # só some daqui quando a entrada expira
+        cache_principais.ttl = min(
+            cache_principais.ttl, settings.AUTH_CACHE_TTL_WORKERS_SEGUNDOS
+        )
+    # Com get_session trocado (testes, benchmarks) as rotas usam outro
+    # banco: pré-carga e varredura no configurado o alterariam e encheriam
+    # o índice com dados que não são das rotas
+    if get_session not in app.dependency_overrides:
+        _pre_carregar_indice()
+        varredor.iniciar()
+    yield
+    varredor.parar()
+
 
-app = FastAPI(title='API de agendamentos')
+app = FastAPI(title='API de agendamentos', lifespan=lifespan)
+if settings.DB_ASYNC:
+    # Antes das rotas: todas passam a ser async def (async_routes.py)
+    app.router.route_class = RotaAssincrona
 
 dezembro = 12
 
+TIPOS_NDJSON = {'application/x-ndjson', 'application/jsonl', 'application/json'}
+
 
 def add_one_month(d: date) -> date:
     if d.month == dezembro:
@@ -107,11 +219,79 @@ async def catch_exceptions_middleware(request: Request, call_next):
         )
 
 
+# Por último: fica por fora dos demais e vê o status final de cada resposta
+app.add_middleware(MiddlewareMetricas)
+
+
+def _etag_corresponde(request: Request, etag: str) -> bool:
+    """Verifica se o If-None-Match da requisição contém a ETag atual."""
+    cabecalho = request.headers.get('if-none-match')
+    if not cabecalho:
+        return False
+    if cabecalho.strip() == '*':
+        return True
+    candidatas = (c.strip().removeprefix('W/') for c in cabecalho.split(','))
+    return etag.removeprefix('W/') in candidatas
+
+
+def _responder_condicional(request: Request, response: Response, etag: str):
+    """Encerra com 304 se o cliente já tem ``etag``; senão a anexa à resposta."""
+    cabecalhos = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if _etag_corresponde(request, etag):
+        raise HTTPException(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=cabecalhos
+        )
+    response.headers.update(cabecalhos)
+
+
+def condicional_usuario(
+    request: Request,
+    response: Response,
+    session: Session = Depends(get_session),
+    user: UsuarioAutenticado = Depends(get_current_user_leitura),
+):
+    """ETag das listagens do próprio usuário, pela versão dele em ``users``.
+
+    Custa uma busca pela chave primária antes de qualquer outra consulta.
+    """
+    versao = versao_usuario(session, user.id)
+    _responder_condicional(request, response, f'"u{user.id}-{versao}"')
+
+
+def condicional_global(
+    request: Request,
+    response: Response,
+    session: Session = Depends(get_session),
+    admin: UsuarioAutenticado = Depends(get_current_admin_leitura),
+):
+    """ETag das listagens do admin, pela versão global."""
+    versao = versao_global(session)
+    _responder_condicional(request, response, f'"g{versao}"')
+
+
 @app.get('/', status_code=status.HTTP_200_OK, response_model=Message)
 def read_root():
     return {'message': 'Olá Mundo!'}
 
 
+@app.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+def exportar_metricas(request: Request):
+    # Fechada por padrão: sem METRICAS_TOKEN configurado nenhum token serve
+    esperado = f'Bearer {settings.METRICAS_TOKEN}'
+    recebido = request.headers.get('authorization', '')
+    if not settings.METRICAS_TOKEN or not hmac.compare_digest(
+        recebido.encode(), esperado.encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Token de métricas inválido',
+        )
+    return PlainTextResponse(
+        metricas.renderizar(),
+        media_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
 # Rotas de cadastro e login
 @app.post(
     '/registrar',
@@ -121,31 +301,13 @@ def read_root():
 def registrar_usuario(
     usuario: UserSchema, session: Session = Depends(get_session)
 ):
-    db_user = session.scalar(select(User).where(User.email == usuario.email))
-    if db_user:
+    new_user = cadastrar_usuario(session, usuario)
+    if new_user is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Email já cadastrado',
         )
 
-    new_user = User(
-        nome=usuario.nome,
-        email=usuario.email,
-        senha=usuario.senha,
-    )
-    session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
-
-    # Criar primeiro pagamento
-    primeiro_pagamento = Pagamento(
-        id_usuario=new_user.id,
-        data_vencimento=date.today(),
-        status='Atrasado'
-    )
-    session.add(primeiro_pagamento)
-    session.commit()
-
     return new_user
 
 
@@ -161,6 +323,7 @@ def login(credenciais: UserLogin, session: Session = Depends(get_session)):
 
     token = criar_token({
         'user_id': user.id,
+        'nome': user.nome,
         'email': user.email,
         'is_admin': user.is_admin,
     })
@@ -169,36 +332,61 @@ def login(credenciais: UserLogin, session: Session = Depends(get_session)):
 
 
 # Rotas dos alunos
-@app.get('/horarios-disponiveis/{data}', response_model=HorariosDisponiveis)
-def horarios_disponiveis(
-    data: date,
+@app.get(
+    '/horarios-disponiveis',
+    response_model=list[HorariosDisponiveis],
+    responses={status.HTTP_304_NOT_MODIFIED: {}},
+)
+def horarios_disponiveis_periodo(
+    request: Request,
+    response: Response,
+    filtro: FiltroPeriodo = Query(),
     session: Session = Depends(get_session),
-    user: User = Depends(get_current_user),
+    user: UsuarioAutenticado = Depends(get_current_user_leitura),
 ):
-    todos_horarios = [
-        time(8, 0),
-        time(9, 0),
-        time(10, 0),
-        time(11, 0),
-        time(12, 0),
-        time(13, 0),
-        time(14, 0),
-        time(15, 0),
-        time(16, 0),
-        time(17, 0),
-    ]
+    dias = (filtro.fim - filtro.inicio).days + 1
+    if dias < 1:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Data final anterior à data inicial',
+        )
+    if dias > INTERVALO_MAXIMO_DIAS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Intervalo máximo de {INTERVALO_MAXIMO_DIAS} dias',
+        )
 
-    # verifica horários ocupados
-    agendamentos = session.scalars(
-        select(Agendamento).where(Agendamento.data == data)
-    ).all()
+    ocupados = indice_disponibilidade.ocupados_intervalo(
+        session, filtro.inicio, filtro.fim
+    )
+
+    # A ocupação do período identifica a resposta inteira
+    assinatura = ','.join(
+        f'{data.toordinal()}:{mascara}' for data, mascara in ocupados.items()
+    )
+    etag = f'"{hashlib.sha1(assinatura.encode()).hexdigest()}"'
+    cabecalhos = {'ETag': etag, 'Cache-Control': 'private, max-age=30'}
+    if _etag_corresponde(request, etag):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=cabecalhos
+        )
+
+    response.headers.update(cabecalhos)
+    return [
+        {'data': data, 'horarios_disponiveis': rotulos_livres(mascara)}
+        for data, mascara in ocupados.items()
+    ]
 
-    horarios_ocupados = [a.hora for a in agendamentos]
-    horarios_livres = [h for h in todos_horarios if h not in horarios_ocupados]
 
+@app.get('/horarios-disponiveis/{data}', response_model=HorariosDisponiveis)
+def horarios_disponiveis(
+    data: date,
+    session: Session = Depends(get_session),
+    user: UsuarioAutenticado = Depends(get_current_user_leitura),
+):
     return {
         'data': data,
-        'horarios_disponiveis': [h.strftime('%H:%M') for h in horarios_livres],
+        'horarios_disponiveis': indice_disponibilidade.livres(session, data),
     }
 
 
@@ -210,7 +398,7 @@ def horarios_disponiveis(
 def criar_agendamento(
     agendamento: AgendamentoCriar,
     session: Session = Depends(get_session),
-    user: User = Depends(get_current_user),
+    user: UsuarioAutenticado = Depends(get_current_user),
 ):
     # Verifica se o agendamento é no passado
     data_hora_agendamento = datetime.combine(
@@ -223,68 +411,71 @@ def criar_agendamento(
             detail='Não é possível criar agendamentos no passado',
         )
 
-    # Verifica horário disponível
-    existe = session.scalar(
-        select(Agendamento).where(
-            Agendamento.data == agendamento.data,
-            Agendamento.hora == agendamento.hora,
+    # cria agendamento; a restrição única (data, hora) decide a disputa
+    try:
+        novo_id = reservar_horario(
+            session, user.id, agendamento.data, agendamento.hora
         )
-    )
-
-    if existe:
+    except IntegrityError:
+        # O conflito de horário não chega aqui: só a chave estrangeira
+        # falha, com o usuário removido mas ainda no cache deste worker
+        session.rollback()
+        cache_principais.invalidar(user.id)
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Usuário não encontrado',
+        )
+    if novo_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
             detail='Horário indisponível',
         )
-
-    # cria agendamento
-    novo_agendamento = Agendamento(
-        id_usuario=user.id,
-        data=agendamento.data,
-        hora=agendamento.hora,
-    )
-    session.add(novo_agendamento)
     session.commit()
-    session.refresh(novo_agendamento)
+    indice_disponibilidade.marcar(agendamento.data, agendamento.hora)
 
     # mostra nome do aluno no agendamento
     return AgendamentoPublico(
-        id=novo_agendamento.id,
-        id_usuario=novo_agendamento.id_usuario,
-        data=novo_agendamento.data,
-        hora=novo_agendamento.hora,
+        id=novo_id,
+        id_usuario=user.id,
+        data=agendamento.data,
+        hora=agendamento.hora,
         nome_usuario=user.nome,
     )
 
 
-@app.get('/meus-agendamentos', response_model=list[AgendamentoPublico])
+@app.get(
+    '/meus-agendamentos',
+    response_model=list[AgendamentoPublico],
+    responses={status.HTTP_304_NOT_MODIFIED: {}},
+    dependencies=[Depends(condicional_usuario)],
+)
 def listar_meus_agendamentos(
+    response: Response,
     session: Session = Depends(get_session),
-    user: User = Depends(get_current_user),
+    user: UsuarioAutenticado = Depends(get_current_user_leitura),
 ):
-    agendamentos = session.scalars(
-        select(Agendamento)
+    linhas = session.execute(
+        select(
+            Agendamento.id,
+            Agendamento.id_usuario,
+            Agendamento.data,
+            Agendamento.hora,
+            literal(user.nome).label('nome_usuario'),
+        )
         .where(Agendamento.id_usuario == user.id)
         .order_by(Agendamento.data, Agendamento.hora)
     ).all()
 
-    return [
-        AgendamentoPublico(
-            id=a.id,
-            id_usuario=a.id_usuario,
-            data=a.data,
-            hora=a.hora,
-            nome_usuario=user.nome,
-        )
-        for a in agendamentos
-    ]
+    return resposta_json(
+        list[AgendamentoPublico], linhas_como_dicts(linhas), response
+    )
 
 
 @app.delete('/cancelar-agendamento/{agendamento_id}', response_model=Message)
 def cancelar_agendamento(
     agendamento_id: int,
     session: Session = Depends(get_session),
-    user: User = Depends(get_current_user),
+    user: UsuarioAutenticado = Depends(get_current_user),
 ):
     agendamento = session.scalar(
         select(Agendamento).where(
@@ -300,31 +491,36 @@ def cancelar_agendamento(
         )
 
     session.delete(agendamento)
+    registrar_alteracao(session, agendamento.id_usuario)
     session.commit()
+    indice_disponibilidade.liberar(agendamento.data, agendamento.hora)
 
     return {'message': 'Agendamento cancelado com sucesso'}
 
 
-@app.get('/pagamento/status', response_model=PagamentoStatus)
+@app.get(
+    '/pagamento/status',
+    response_model=PagamentoStatus,
+    responses={status.HTTP_304_NOT_MODIFIED: {}},
+    dependencies=[Depends(condicional_usuario)],
+)
 def status_pagamento(
     session: Session = Depends(get_session),
-    user: User = Depends(get_current_user),
+    user: UsuarioAutenticado = Depends(get_current_user_leitura),
 ):
-    pagamento = session.scalar(
-        select(Pagamento)
-        .where(Pagamento.id_usuario == user.id)
-        .order_by(Pagamento.data_vencimento.desc())
-    )
-    if not pagamento:
+    # Cópia do pagamento atual em users; o status já vem atualizado pela
+    # varredura (sweeper.py)
+    pagamento = session.execute(
+        select(User.pagamento_status, User.pagamento_vencimento).where(
+            User.id == user.id
+        )
+    ).first()
+    if not pagamento or pagamento.pagamento_status is None:
         return {'status': 'Em dia', 'data_proximo_vencimento': None}
 
-    status_atual = pagamento.status
-    if status_atual == 'Em dia' and date.today() > pagamento.data_vencimento:
-        status_atual = 'Atrasado'
-
     return {
-        'status': status_atual,
-        'data_proximo_vencimento': pagamento.data_vencimento
+        'status': pagamento.pagamento_status,
+        'data_proximo_vencimento': pagamento.pagamento_vencimento
     }
 
 
@@ -332,12 +528,13 @@ def status_pagamento(
 def enviar_comprovante(
     arquivo: UploadFile = File(...),
     session: Session = Depends(get_session),
-    user: User = Depends(get_current_user),
+    user: UsuarioAutenticado = Depends(get_current_user),
+    armazem: ArmazemComprovantes = Depends(get_armazem_comprovantes),
 ):
     pagamento = session.scalar(
         select(Pagamento)
-        .where(Pagamento.id_usuario == user.id)
-        .order_by(Pagamento.data_vencimento.desc())
+        .join(User, User.pagamento_atual_id == Pagamento.id)
+        .where(User.id == user.id)
     )
     if not pagamento:
         raise HTTPException(
@@ -345,43 +542,70 @@ def enviar_comprovante(
             detail="Pagamento não encontrado"
             )
 
-    arquivo_bytes = arquivo.file.read()
-    pagamento.comprovante = arquivo_bytes
-    pagamento.comprovante_mime = arquivo.content_type
-    pagamento.status = 'Aguardando confirmação'
+    # Grava em blocos no armazém; o conteúdo nunca fica inteiro em memória
+    sha256, tamanho = fora_do_loop(armazem.salvar, arquivo.file)
+    registrar_comprovante(
+        session,
+        sha256,
+        tamanho,
+        arquivo.content_type or 'application/octet-stream',
+    )
+    pagamento.comprovante_sha256 = sha256
+    alterar_status_pagamento(session, pagamento, 'Aguardando confirmação')
     session.commit()
 
     return {'message': 'Comprovante enviado com sucesso'}
 
 
 # Rotas para o Adm
-@app.get('/admin/usuarios', response_model=UserList)
+@app.get(
+    '/admin/usuarios',
+    response_model=UserList,
+    responses={status.HTTP_304_NOT_MODIFIED: {}},
+    dependencies=[Depends(condicional_global)],
+)
 def listar_usuarios(
+    response: Response,
+    filtro: FiltroUsuarios = Query(),
     session: Session = Depends(get_session),
-    admin: User = Depends(get_current_admin),
+    admin: UsuarioAutenticado = Depends(get_current_admin_leitura),
 ):
-    usuarios = session.scalars(select(User)).all()
-    resultado = []
-    for u in usuarios:
-        pagamento = session.scalar(
-            select(Pagamento)
-            .where(Pagamento.id_usuario == u.id)
-            .order_by(Pagamento.data_vencimento.desc())
-        )
-        status_pag = None
-        data_venc = None
-        if pagamento:
-            status_pag = pagamento.status
-            if status_pag == 'Em dia' and date.today() > pagamento.data_vencimento:
-                status_pag = 'Atrasado'
-            data_venc = pagamento.data_vencimento
-
-        u_obj = UserPublic.model_validate(u)
-        u_obj.status_pagamento = status_pag
-        u_obj.data_proximo_vencimento = data_venc
-        resultado.append(u_obj)
-
-    return {'users': resultado}
+    # Status e vencimento vêm da cópia do pagamento atual em users
+    consulta = (
+        select(
+            User.id,
+            User.nome,
+            User.email,
+            User.is_admin,
+            User.pagamento_status.label('status_pagamento'),
+            User.pagamento_vencimento.label('data_proximo_vencimento'),
+        )
+        .order_by(User.id)
+        .limit(filtro.limit + 1)
+    )
+    if filtro.after_id is not None:
+        consulta = consulta.where(User.id > filtro.after_id)
+    if filtro.status_pagamento is not None:
+        consulta = consulta.where(
+            User.pagamento_status == filtro.status_pagamento
+        )
+
+    linhas = session.execute(consulta).all()
+
+    # Busca um registro a mais só para saber se existe próxima página
+    proximo_after_id = None
+    if len(linhas) > filtro.limit:
+        linhas = linhas[:filtro.limit]
+        proximo_after_id = linhas[-1].id
+
+    return resposta_json(
+        UserList,
+        {
+            'users': linhas_como_dicts(linhas),
+            'proximo_after_id': proximo_after_id,
+        },
+        response,
+    )
 
 
 @app.post(
@@ -392,41 +616,44 @@ def listar_usuarios(
 def criar_usuario_admin(
     usuario: UserSchema,
     session: Session = Depends(get_session),
-    admin: User = Depends(get_current_admin),
+    admin: UsuarioAutenticado = Depends(get_current_admin),
 ):
-    db_user = session.scalar(select(User).where(User.email == usuario.email))
-    if db_user:
+    new_user = cadastrar_usuario(session, usuario)
+    if new_user is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='Email já cadastrado',
         )
 
-    new_user = User(
-        nome=usuario.nome,
-        email=usuario.email,
-        senha=usuario.senha,
-    )
-    session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    return new_user
 
-    # Criar primeiro pagamento
-    primeiro_pagamento = Pagamento(
-        id_usuario=new_user.id,
-        data_vencimento=date.today(),
-        status='Atrasado'
-    )
-    session.add(primeiro_pagamento)
-    session.commit()
 
-    return new_user
+@app.post(
+    '/admin/usuarios/importar',
+    response_model=ImportacaoResultado,
+)
+# Lê e valida o arquivo inteiro, linha a linha, entre os lotes gravados
+@no_limitador
+def importar_usuarios_admin(
+    arquivo: UploadFile = File(...),
+    session: Session = Depends(get_session),
+    admin: UsuarioAutenticado = Depends(get_current_admin),
+):
+    """Importa usuários de um CSV (nome,email,senha) ou NDJSON."""
+    nome = (arquivo.filename or '').lower()
+    if arquivo.content_type in TIPOS_NDJSON or nome.endswith(('.ndjson', '.jsonl')):
+        linhas = ler_ndjson(arquivo.file)
+    else:
+        linhas = ler_csv(arquivo.file)
+
+    return importar_usuarios(session, linhas)
 
 
 @app.delete('/admin/usuarios/{user_id}', response_model=Message)
 def remover_usuario_admin(
     user_id: int,
     session: Session = Depends(get_session),
-    admin: User = Depends(get_current_admin),
+    admin: UsuarioAutenticado = Depends(get_current_admin),
 ):
     if user_id == admin.id:
         raise HTTPException(
@@ -446,7 +673,11 @@ def remover_usuario_admin(
     session.execute(delete(Pagamento).where(Pagamento.id_usuario == user.id))
 
     session.delete(user)
+    registrar_alteracao(session)
     session.commit()
+    cache_principais.invalidar(user_id)
+    # Remoção rara: mais simples descartar o índice do que rastrear as datas
+    indice_disponibilidade.limpar()
 
     return {'message': 'Usuário removido com sucesso'}
 
@@ -459,7 +690,7 @@ def remover_usuario_admin(
 def criar_agendamento_admin(
     agendamento: AgendamentoAdminCriar,
     session: Session = Depends(get_session),
-    admin: User = Depends(get_current_admin),
+    admin: UsuarioAutenticado = Depends(get_current_admin),
 ):
     # Verifica se o usuário existe
     user = session.scalar(select(User).where(
@@ -482,69 +713,186 @@ def criar_agendamento_admin(
             detail='Não é possível criar agendamentos no passado',
         )
 
-    # Verifica horário disponível
-    existe = session.scalar(
-        select(Agendamento).where(
-            Agendamento.data == agendamento.data,
-            Agendamento.hora == agendamento.hora,
+    # cria agendamento; a restrição única (data, hora) decide a disputa
+    try:
+        novo_id = reservar_horario(
+            session, user.id, agendamento.data, agendamento.hora
         )
-    )
-
-    if existe:
+    except IntegrityError:
+        # O conflito de horário não chega aqui: só a chave estrangeira
+        # falha, com o aluno removido por outra requisição depois da
+        # consulta acima
+        session.rollback()
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Usuário não encontrado',
+        )
+    if novo_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
             detail='Horário indisponível',
         )
+    session.commit()
+    indice_disponibilidade.marcar(agendamento.data, agendamento.hora)
 
-    # cria agendamento
-    novo_agendamento = Agendamento(
+    return AgendamentoPublico(
+        id=novo_id,
         id_usuario=user.id,
         data=agendamento.data,
         hora=agendamento.hora,
+        nome_usuario=user.nome,
+    )
+
+
+@app.post(
+    '/admin/agendar/lote',
+    response_model=AgendamentoLoteResultado,
+    status_code=status.HTTP_201_CREATED,
+)
+def criar_agendamentos_lote(
+    lote: AgendamentoLoteCriar,
+    session: Session = Depends(get_session),
+    admin: UsuarioAutenticado = Depends(get_current_admin),
+):
+    nome_usuario = session.scalar(
+        select(User.nome).where(User.id == lote.id_usuario)
+    )
+    if nome_usuario is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Usuário não encontrado',
+        )
+
+    agora = datetime.now()
+    conflitos = []
+    candidatas = []
+    for data in lote.datas_do_lote():
+        if datetime.combine(data, lote.hora) < agora:
+            conflitos.append({
+                'data': data,
+                'hora': lote.hora,
+                'motivo': 'Não é possível criar agendamentos no passado',
+            })
+        else:
+            candidatas.append(data)
+
+    # Um INSERT para o lote inteiro e um único commit
+    criados = reservar_horarios(
+        session, lote.id_usuario, [(data, lote.hora) for data in candidatas]
     )
-    session.add(novo_agendamento)
     session.commit()
-    session.refresh(novo_agendamento)
 
-    return AgendamentoPublico(
-        id=novo_agendamento.id,
-        id_usuario=novo_agendamento.id_usuario,
-        data=novo_agendamento.data,
-        hora=novo_agendamento.hora,
-        nome_usuario=user.nome,
+    for data, hora in criados:
+        indice_disponibilidade.marcar(data, hora)
+
+    conflitos.extend(
+        {'data': data, 'hora': lote.hora, 'motivo': 'Horário indisponível'}
+        for data in candidatas
+        if (data, lote.hora) not in criados
     )
+    conflitos.sort(key=lambda conflito: conflito['data'])
 
+    return {
+        'criados': [
+            AgendamentoPublico(
+                id=id,
+                id_usuario=lote.id_usuario,
+                data=data,
+                hora=hora,
+                nome_usuario=nome_usuario,
+            )
+            for (data, hora), id in sorted(criados.items())
+        ],
+        'conflitos': conflitos,
+    }
 
-@app.get('/admin/agendamentos', response_model=list[AgendamentoPublico])
+
+def _codificar_cursor(*valores) -> str:
+    return ','.join(
+        v.isoformat() if isinstance(v, (date, time)) else str(v)
+        for v in valores
+    )
+
+
+def _decodificar_cursor(cursor: str, *conversores) -> tuple:
+    partes = cursor.split(',')
+    try:
+        if len(partes) != len(conversores):
+            raise ValueError
+        return tuple(converter(p) for converter, p in zip(conversores, partes))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Cursor inválido',
+        )
+
+
+@app.get(
+    '/admin/agendamentos',
+    response_model=AgendamentoList,
+    responses={status.HTTP_304_NOT_MODIFIED: {}},
+    dependencies=[Depends(condicional_global)],
+)
 def listar_todos_agendamentos(
+    response: Response,
+    filtro: FiltroAgendamentos = Query(),
     session: Session = Depends(get_session),
-    admin: User = Depends(get_current_admin),
+    admin: UsuarioAutenticado = Depends(get_current_admin_leitura),
 ):
-    agendamentos = session.scalars(
-        select(Agendamento).order_by(Agendamento.data, Agendamento.hora)
-    ).all()
+    if filtro.fim < filtro.inicio:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Data final anterior à data inicial',
+        )
 
-    result = []
-    for a in agendamentos:
-        user = session.scalar(select(User).where(User.id == a.id_usuario))
-        result.append(
-            AgendamentoPublico(
-                id=a.id,
-                id_usuario=a.id_usuario,
-                data=a.data,
-                hora=a.hora,
-                nome_usuario=user.nome if user else 'Desconhecido',
+    consulta = (
+        select(
+            Agendamento.id,
+            Agendamento.id_usuario,
+            Agendamento.data,
+            Agendamento.hora,
+            func.coalesce(User.nome, 'Desconhecido').label('nome_usuario'),
+        )
+        .outerjoin(User, User.id == Agendamento.id_usuario)
+        .where(
+            Agendamento.data >= filtro.inicio, Agendamento.data <= filtro.fim
+        )
+        .order_by(Agendamento.data, Agendamento.hora, Agendamento.id)
+        .limit(filtro.limit + 1)
+    )
+    if filtro.cursor is not None:
+        consulta = consulta.where(
+            tuple_(Agendamento.data, Agendamento.hora, Agendamento.id)
+            > tuple_(
+                *_decodificar_cursor(
+                    filtro.cursor, date.fromisoformat, time.fromisoformat, int
+                )
             )
         )
 
-    return result
+    linhas = session.execute(consulta).all()
+
+    proximo_cursor = None
+    if len(linhas) > filtro.limit:
+        linhas = linhas[:filtro.limit]
+        ultima = linhas[-1]
+        proximo_cursor = _codificar_cursor(ultima.data, ultima.hora, ultima.id)
+
+    return resposta_json(
+        AgendamentoList,
+        {
+            'agendamentos': linhas_como_dicts(linhas),
+            'proximo_cursor': proximo_cursor,
+        },
+        response,
+    )
 
 
 @app.delete('/admin/agendamentos/{agendamento_id}', response_model=Message)
 def remover_agendamento_admin(
     agendamento_id: int,
     session: Session = Depends(get_session),
-    admin: User = Depends(get_current_admin),
+    admin: UsuarioAutenticado = Depends(get_current_admin),
 ):
     agendamento = session.scalar(
         select(Agendamento).where(Agendamento.id == agendamento_id)
@@ -557,47 +905,140 @@ def remover_agendamento_admin(
         )
 
     session.delete(agendamento)
+    registrar_alteracao(session, agendamento.id_usuario)
     session.commit()
+    indice_disponibilidade.liberar(agendamento.data, agendamento.hora)
 
     return {'message': 'Agendamento removido com sucesso'}
 
 
-@app.get('/admin/usuarios/{user_id}/pagamentos',
-         response_model=list[PagamentoPublico])
+# Colunas de PagamentoPublico, lidas como linhas em vez de objetos ORM
+_COLUNAS_PAGAMENTO = (
+    Pagamento.id,
+    Pagamento.id_usuario,
+    Pagamento.data_vencimento,
+    Pagamento.status,
+)
+
+
+@app.get(
+    '/admin/usuarios/{user_id}/pagamentos',
+    response_model=list[PagamentoPublico],
+    responses={status.HTTP_304_NOT_MODIFIED: {}},
+    dependencies=[Depends(condicional_global)],
+)
 def listar_pagamentos_usuario(
     user_id: int,
+    response: Response,
     session: Session = Depends(get_session),
-    admin: User = Depends(get_current_admin),
+    admin: UsuarioAutenticado = Depends(get_current_admin_leitura),
 ):
-    pagamentos = session.scalars(
-        select(Pagamento)
+    linhas = session.execute(
+        select(*_COLUNAS_PAGAMENTO)
         .where(Pagamento.id_usuario == user_id)
         .order_by(Pagamento.data_vencimento.desc())
     ).all()
+    return resposta_json(
+        list[PagamentoPublico], linhas_como_dicts(linhas), response
+    )
 
-    for p in pagamentos:
-        if p.status == 'Em dia' and date.today() > p.data_vencimento:
-            p.status = 'Atrasado'
 
-    return pagamentos
+@app.get(
+    '/admin/pagamentos/atrasados',
+    response_model=PagamentoList,
+    responses={status.HTTP_304_NOT_MODIFIED: {}},
+    dependencies=[Depends(condicional_global)],
+)
+def listar_pagamentos_atrasados(
+    response: Response,
+    filtro: FiltroPagina = Query(),
+    session: Session = Depends(get_session),
+    admin: UsuarioAutenticado = Depends(get_current_admin_leitura),
+):
+    consulta = (
+        select(*_COLUNAS_PAGAMENTO)
+        .where(Pagamento.status == 'Atrasado')
+        .order_by(Pagamento.data_vencimento, Pagamento.id)
+        .limit(filtro.limit + 1)
+    )
+    if filtro.cursor is not None:
+        consulta = consulta.where(
+            tuple_(Pagamento.data_vencimento, Pagamento.id)
+            > tuple_(*_decodificar_cursor(filtro.cursor, date.fromisoformat, int))
+        )
+
+    pagamentos = session.execute(consulta).all()
+
+    proximo_cursor = None
+    if len(pagamentos) > filtro.limit:
+        pagamentos = pagamentos[:filtro.limit]
+        ultimo = pagamentos[-1]
+        proximo_cursor = _codificar_cursor(ultimo.data_vencimento, ultimo.id)
+
+    return resposta_json(
+        PagamentoList,
+        {
+            'pagamentos': linhas_como_dicts(pagamentos),
+            'proximo_cursor': proximo_cursor,
+        },
+        response,
+    )
 
 
-@app.get('/admin/pagamentos/{pagamento_id}/comprovante')
+@app.get(
+    '/admin/pagamentos/{pagamento_id}/comprovante',
+    responses={status.HTTP_304_NOT_MODIFIED: {}},
+)
 def ver_comprovante(
     pagamento_id: int,
+    request: Request,
     session: Session = Depends(get_session),
-    admin: User = Depends(get_current_admin),
+    admin: UsuarioAutenticado = Depends(get_current_admin),
+    armazem: ArmazemComprovantes = Depends(get_armazem_comprovantes),
 ):
-    pagamento = session.scalar(select(Pagamento).where(Pagamento.id == pagamento_id))
-    if not pagamento or not pagamento.comprovante:
+    comprovante = session.scalar(
+        select(Comprovante)
+        .join(Pagamento, Pagamento.comprovante_sha256 == Comprovante.sha256)
+        .where(Pagamento.id == pagamento_id)
+    )
+    if not comprovante:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Comprovante não encontrado"
             )
 
-    return Response(
-        content=pagamento.comprovante,
-        media_type=pagamento.comprovante_mime or 'application/octet-stream'
+    # O conteúdo é endereçado pelo hash, então ele serve de ETag forte
+    cabecalhos = {
+        'ETag': f'"{comprovante.sha256}"',
+        'Last-Modified': format_datetime(
+            comprovante.criado_em.replace(tzinfo=UTC), usegmt=True
+        ),
+        'Cache-Control': 'private, no-cache',
+    }
+    if _etag_corresponde(request, cabecalhos['ETag']):
+        return Response(
+            status_code=status.HTTP_304_NOT_MODIFIED, headers=cabecalhos
+        )
+
+    # Linha sem arquivo (volume perdido, restauração parcial): o
+    # FileResponse falharia só ao enviar, com erro 500
+    caminho = armazem.caminho(comprovante.sha256)
+    if not caminho.is_file():
+        logging.error(
+            'Comprovante %s do pagamento %d ausente do armazém',
+            comprovante.sha256,
+            pagamento_id,
+        )
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Comprovante não encontrado',
+        )
+
+    # FileResponse envia o arquivo em blocos e atende cabeçalhos Range
+    return FileResponse(
+        caminho,
+        media_type=comprovante.mime,
+        headers=cabecalhos,
         )
 
 
@@ -605,7 +1046,7 @@ def ver_comprovante(
 def aprovar_pagamento(
     pagamento_id: int,
     session: Session = Depends(get_session),
-    admin: User = Depends(get_current_admin),
+    admin: UsuarioAutenticado = Depends(get_current_admin),
 ):
     pagamento = session.scalar(
         select(Pagamento).where(Pagamento.id == pagamento_id)
@@ -616,20 +1057,22 @@ def aprovar_pagamento(
             detail="Pagamento não encontrado"
             )
 
-    pagamento.status = 'Aprovado'
+    alterar_status_pagamento(session, pagamento, 'Aprovado')
 
-    mais_recente = session.scalar(
-        select(Pagamento)
-        .where(Pagamento.id_usuario == pagamento.id_usuario)
-        .order_by(Pagamento.data_vencimento.desc())
+    pagamento_atual_id = session.scalar(
+        select(User.pagamento_atual_id).where(User.id == pagamento.id_usuario)
     )
-    if mais_recente and mais_recente.id == pagamento.id:
+    if pagamento_atual_id == pagamento.id:
+        # Com vários meses em atraso, o próximo vencimento também já passou
+        vencimento = add_one_month(pagamento.data_vencimento)
         novo_pag = Pagamento(
             id_usuario=pagamento.id_usuario,
-            data_vencimento=add_one_month(pagamento.data_vencimento),
-            status='Em dia'
+            data_vencimento=vencimento,
+            status=status_pelo_vencimento(vencimento),
         )
         session.add(novo_pag)
+        session.flush()
+        definir_pagamento_atual(session, novo_pag)
 
     session.commit()
     return {'message': 'Pagamento aprovado com sucesso'}
@@ -639,7 +1082,7 @@ def aprovar_pagamento(
 def recusar_pagamento(
     pagamento_id: int,
     session: Session = Depends(get_session),
-    admin: User = Depends(get_current_admin),
+    admin: UsuarioAutenticado = Depends(get_current_admin),
 ):
     pagamento = session.scalar(select(Pagamento).where(Pagamento.id == pagamento_id))
     if not pagamento:
@@ -648,6 +1091,18 @@ def recusar_pagamento(
             detail="Pagamento não encontrado"
             )
 
-    pagamento.status = 'Atrasado'
+    alterar_status_pagamento(session, pagamento, 'Atrasado')
     session.commit()
     return {'message': 'Pagamento recusado com sucesso'}
+
+
+@app.get('/admin/diagnostics/queries', response_model=DiagnosticoConsultas)
+def diagnostico_consultas(
+    limite: int = Query(default=20, ge=1, le=LIMITE_MAXIMO),
+    admin: UsuarioAutenticado = Depends(get_current_admin_leitura),
+):
+    return {
+        'ativo': registro_consultas.ativo,
+        'limite_lento_ms': registro_consultas.limite_ms,
+        'consultas': registro_consultas.mais_custosas(limite),
+    }
@@ -0,0 +1,146 @@
+"""Caminho assíncrono das rotas, ativado por ``DB_ASYNC``.
+
+Com a opção ligada, ``app.py`` registra as rotas com ``RotaAssincrona``:
+cada rota síncrona vira uma ``async def`` que roda o mesmo código no event
+loop, dentro de um greenlet (``greenlet_spawn``, o mesmo mecanismo do
+``AsyncSession`` do SQLAlchemy), sobre as engines de ``engines_async``. Cada
+espera pelo banco devolve o loop às outras requisições em vez de prender
+uma thread do limitador.
+
+As dependências de sessão e autenticação trocam pelas versões nativas
+(``DEPENDENCIAS_ASYNC``); as demais que dependem delas são convertidas do
+mesmo jeito que as rotas. As que não tocam no banco ficam como estão, e
+``dependency_overrides`` sobre elas continua valendo. Rotas marcadas com
+``no_limitador`` não são convertidas.
+"""
+
+import inspect
+from collections.abc import Callable
+from functools import cache, partial, wraps
+
+from anyio import to_thread
+from fastapi import params
+from fastapi.routing import APIRoute
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.util.concurrency import await_only, greenlet_spawn, in_greenlet
+
+from agendamento.database import get_session, get_session_async
+from agendamento.security import (
+    get_current_admin,
+    get_current_admin_async,
+    get_current_admin_leitura,
+    get_current_admin_leitura_async,
+    get_current_user,
+    get_current_user_async,
+    get_current_user_leitura,
+    get_current_user_leitura_async,
+)
+
+DEPENDENCIAS_ASYNC: dict[Callable, Callable] = {
+    get_session: get_session_async,
+    get_current_user: get_current_user_async,
+    get_current_admin: get_current_admin_async,
+    get_current_user_leitura: get_current_user_leitura_async,
+    get_current_admin_leitura: get_current_admin_leitura_async,
+}
+
+
+def _converter_depends(dependencia: params.Depends) -> params.Depends:
+    convertida = assincrona(dependencia.dependency)
+    if convertida is dependencia.dependency:
+        return dependencia
+    return params.Depends(convertida, use_cache=dependencia.use_cache)
+
+
+def _converter_parametro(parametro: inspect.Parameter) -> inspect.Parameter:
+    if isinstance(parametro.default, params.Depends) and parametro.default.dependency:
+        return parametro.replace(default=_converter_depends(parametro.default))
+    return parametro
+
+
+def _assinatura_convertida(funcao: Callable) -> inspect.Signature:
+    assinatura = inspect.signature(funcao)
+    return assinatura.replace(
+        parameters=[_converter_parametro(p) for p in assinatura.parameters.values()]
+    )
+
+
+def _sessoes_sincronas(valores: dict) -> dict:
+    return {
+        nome: valor.sync_session if isinstance(valor, AsyncSession) else valor
+        for nome, valor in valores.items()
+    }
+
+
+def _no_greenlet(funcao: Callable, assinatura: inspect.Signature) -> Callable:
+    @wraps(funcao)
+    async def envoltorio(**valores):
+        return await greenlet_spawn(funcao, **_sessoes_sincronas(valores))
+
+    envoltorio.__signature__ = assinatura
+    return envoltorio
+
+
+@cache
+def assincrona(dependencia: Callable) -> Callable:
+    """Versão de ``dependencia`` para o caminho assíncrono.
+
+    Devolve a própria função quando ela não depende do banco; o cache
+    garante o mesmo objeto em todas as rotas, e o FastAPI resolve cada
+    dependência uma vez por requisição.
+    """
+    if dependencia in DEPENDENCIAS_ASYNC:
+        return DEPENDENCIAS_ASYNC[dependencia]
+    if not inspect.isfunction(dependencia) or not _sincrona(dependencia):
+        return dependencia
+
+    convertida = _assinatura_convertida(dependencia)
+    if convertida == inspect.signature(dependencia):
+        return dependencia
+    return _no_greenlet(dependencia, convertida)
+
+
+def _sincrona(funcao: Callable) -> bool:
+    return not (
+        inspect.iscoroutinefunction(funcao)
+        or inspect.isgeneratorfunction(funcao)
+        or inspect.isasyncgenfunction(funcao)
+    )
+
+
+def no_limitador(endpoint: Callable) -> Callable:
+    """Mantém a rota no limitador de threads, com sessão síncrona, mesmo com
+    ``DB_ASYNC``.
+
+    Para rotas que passam boa parte do tempo em CPU ou E/S fora do banco:
+    no event loop, elas parariam todas as outras requisições enquanto isso.
+    """
+    endpoint._no_limitador = True
+    return endpoint
+
+
+class RotaAssincrona(APIRoute):
+    """``APIRoute`` que registra as rotas síncronas como ``async def``."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if getattr(endpoint, '_no_limitador', False):
+            super().__init__(path, endpoint, **kwargs)
+            return
+        if _sincrona(endpoint):
+            endpoint = _no_greenlet(endpoint, _assinatura_convertida(endpoint))
+        if kwargs.get('dependencies'):
+            kwargs['dependencies'] = [
+                _converter_depends(d) for d in kwargs['dependencies']
+            ]
+        super().__init__(path, endpoint, **kwargs)
+
+
+def fora_do_loop(funcao: Callable, *args):
+    """Chama ``funcao`` numa thread quando a rota roda no event loop.
+
+    Para E/S bloqueante fora do banco (arquivos) dentro das rotas: no
+    caminho síncrono a rota já está numa thread e a chamada é direta.
+    """
+    if in_greenlet():
+        return await_only(to_thread.run_sync(partial(funcao, *args)))
+    return funcao(*args)
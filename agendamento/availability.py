@@ -0,0 +1,152 @@
+"""Índice em memória dos horários ocupados de cada data.
+
+Cada data guarda um inteiro usado como máscara de bits sobre a grade de
+``HORARIOS``: o bit ``i`` ligado indica que ``HORARIOS[i]`` está ocupado.
+As rotas que criam ou removem agendamentos atualizam o índice depois do
+commit, então as leituras de disponibilidade não precisam ir ao banco.
+
+O índice é do processo: com vários workers (gunicorn.conf.py), as escritas
+de um não chegam aos outros, e cada data carregada vale por ``ttl``
+segundos antes de ser relida do banco.
+"""
+
+import threading
+from collections import OrderedDict
+from datetime import date, time, timedelta
+from time import monotonic
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from agendamento.models import Agendamento
+
+# Grade de horários oferecidos em cada dia
+HORARIOS = tuple(time(hora, 0) for hora in range(8, 18))
+ROTULOS = tuple(h.strftime('%H:%M') for h in HORARIOS)
+_BIT = {h: 1 << i for i, h in enumerate(HORARIOS)}
+
+CAPACIDADE_PADRAO = 366
+JANELA_PRE_CARGA = 14
+# Maior intervalo aceito numa consulta de disponibilidade por período
+INTERVALO_MAXIMO_DIAS = 62
+
+
+class IndiceDisponibilidade:
+    def __init__(
+        self,
+        capacidade: int = CAPACIDADE_PADRAO,
+        janela: int = JANELA_PRE_CARGA,
+        ttl: float | None = None,
+    ):
+        self.capacidade = capacidade
+        self.janela = janela
+        # Sem ttl, as datas só mudam pelas escritas do próprio processo
+        self.ttl = ttl
+        self._ocupados: OrderedDict[date, int] = OrderedDict()
+        self._expira: dict[date, float] = {}
+        self._lock = threading.Lock()
+        # Incrementado a cada escrita; cargas concorrentes com uma escrita
+        # não são guardadas para não sobrescrever o índice com dados velhos
+        self._geracao = 0
+
+    def ocupados(self, session: Session, data: date) -> int:
+        with self._lock:
+            mascara = self._valida(data)
+            if mascara is not None:
+                self._ocupados.move_to_end(data)
+                return mascara
+
+        # Falta no índice: carrega a data pedida e os próximos dias juntos
+        fim = data + timedelta(days=self.janela - 1)
+        return self.carregar(session, data, fim)[data]
+
+    def ocupados_intervalo(
+        self, session: Session, inicio: date, fim: date
+    ) -> dict[date, int]:
+        dias = [
+            inicio + timedelta(days=i) for i in range((fim - inicio).days + 1)
+        ]
+        with self._lock:
+            if all(self._valida(dia) is not None for dia in dias):
+                for dia in dias:
+                    self._ocupados.move_to_end(dia)
+                return {dia: self._ocupados[dia] for dia in dias}
+
+        # Basta um dia faltando para carregar o período inteiro numa consulta
+        return self.carregar(session, inicio, fim)
+
+    def livres(self, session: Session, data: date) -> list[str]:
+        return rotulos_livres(self.ocupados(session, data))
+
+    def carregar(
+        self, session: Session, inicio: date, fim: date
+    ) -> dict[date, int]:
+        with self._lock:
+            geracao = self._geracao
+
+        mascaras = {
+            inicio + timedelta(days=i): 0
+            for i in range((fim - inicio).days + 1)
+        }
+        linhas = session.execute(
+            select(Agendamento.data, Agendamento.hora).where(
+                Agendamento.data >= inicio, Agendamento.data <= fim
+            )
+        )
+        for data, hora in linhas:
+            mascaras[data] |= _BIT.get(hora, 0)
+
+        with self._lock:
+            if geracao == self._geracao:
+                for data, mascara in mascaras.items():
+                    self._guardar(data, mascara)
+
+        return mascaras
+
+    def marcar(self, data: date, hora: time) -> None:
+        with self._lock:
+            self._geracao += 1
+            if data in self._ocupados:
+                self._ocupados[data] |= _BIT.get(hora, 0)
+
+    def liberar(self, data: date, hora: time) -> None:
+        with self._lock:
+            self._geracao += 1
+            if data in self._ocupados:
+                self._ocupados[data] &= ~_BIT.get(hora, 0)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._geracao += 1
+            self._ocupados.clear()
+            self._expira.clear()
+
+    def _valida(self, data: date) -> int | None:
+        mascara = self._ocupados.get(data)
+        if (
+            mascara is not None
+            and self.ttl is not None
+            and monotonic() >= self._expira[data]
+        ):
+            return None
+        return mascara
+
+    def _guardar(self, data: date, mascara: int) -> None:
+        self._ocupados[data] = mascara
+        self._ocupados.move_to_end(data)
+        if self.ttl is not None:
+            self._expira[data] = monotonic() + self.ttl
+        while len(self._ocupados) > self.capacidade:
+            antiga, _ = self._ocupados.popitem(last=False)
+            self._expira.pop(antiga, None)
+
+
+def rotulos_livres(mascara: int) -> list[str]:
+    return [
+        rotulo
+        for rotulo, hora in zip(ROTULOS, HORARIOS)
+        if not mascara & _BIT[hora]
+    ]
+
+
+indice_disponibilidade = IndiceDisponibilidade()
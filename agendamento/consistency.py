@@ -0,0 +1,96 @@
+"""Verificação da cópia do pagamento atual guardada em ``users``.
+
+``users.pagamento_atual_id``, ``pagamento_status`` e ``pagamento_vencimento``
+devem refletir o pagamento de vencimento mais recente de cada usuário. As
+rotas mantêm isso na mesma transação; este módulo confere (e corrige) o
+banco inteiro::
+
+    python -m agendamento.consistency            # só lista divergências
+    python -m agendamento.consistency --corrigir  # recalcula as divergentes
+"""
+
+import sys
+
+from sqlalchemy import or_, select, true, update
+from sqlalchemy.orm import Session, aliased
+
+from agendamento.database import nova_sessao
+from agendamento.models import Pagamento, User
+from agendamento.services import registrar_alteracao
+
+
+def _pagamento_mais_recente():
+    """Subconsulta correlacionada com o id do pagamento atual de ``User``."""
+    return (
+        select(Pagamento.id)
+        .where(Pagamento.id_usuario == User.id)
+        .order_by(Pagamento.data_vencimento.desc(), Pagamento.id.desc())
+        .limit(1)
+        .correlate(User)
+        .scalar_subquery()
+    )
+
+
+def verificar_pagamento_atual(session: Session) -> list[int]:
+    """Devolve os ids dos usuários cuja cópia diverge de ``pagamentos``."""
+    esperado = aliased(Pagamento)
+    return list(
+        session.scalars(
+            select(User.id)
+            .outerjoin(esperado, esperado.id == _pagamento_mais_recente())
+            .where(
+                or_(
+                    User.pagamento_atual_id.is_distinct_from(esperado.id),
+                    User.pagamento_status.is_distinct_from(esperado.status),
+                    User.pagamento_vencimento.is_distinct_from(
+                        esperado.data_vencimento
+                    ),
+                )
+            )
+            .order_by(User.id)
+        )
+    )
+
+
+def corrigir_pagamento_atual(
+    session: Session, ids: list[int] | None = None
+) -> None:
+    """Recalcula a cópia dos usuários indicados (ou de todos) e faz commit."""
+    filtro = User.id.in_(ids) if ids is not None else true()
+    session.execute(
+        update(User)
+        .where(filtro)
+        .values(
+            pagamento_atual_id=_pagamento_mais_recente(),
+            versao=User.versao + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    session.execute(
+        update(User)
+        .where(filtro)
+        .values(
+            pagamento_status=select(Pagamento.status)
+            .where(Pagamento.id == User.pagamento_atual_id)
+            .scalar_subquery(),
+            pagamento_vencimento=select(Pagamento.data_vencimento)
+            .where(Pagamento.id == User.pagamento_atual_id)
+            .scalar_subquery(),
+        )
+        .execution_options(synchronize_session=False)
+    )
+    registrar_alteracao(session)
+    session.commit()
+
+
+if __name__ == '__main__':
+    with nova_sessao() as session:
+        divergentes = verificar_pagamento_atual(session)
+        print(f'{len(divergentes)} usuário(s) com pagamento atual divergente')
+        if divergentes:
+            print(', '.join(map(str, divergentes)))
+        if divergentes and '--corrigir' in sys.argv[1:]:
+            corrigir_pagamento_atual(session, divergentes)
+            print('Corrigido.')
+        elif divergentes:
+            sys.exit(1)
@@ -1,25 +1,223 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session
+from functools import cache, partial
 
+from fastapi import Depends
+from sqlalchemy import Engine, create_engine, event, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, SessionTransaction
+from sqlalchemy.sql.dml import UpdateBase
+
+from agendamento.metrics import instrumentar_engine, metricas
 from agendamento.models import table_registry
-from agendamento.settings import Settings
+from agendamento.pool import (
+    PoolMedido,
+    PoolMedidoAsync,
+    admitir_no_banco,
+    linhas_pool,
+)
+from agendamento.query_log import registro_consultas
+from agendamento.settings import get_settings
+
+settings = get_settings()
+
+
+# Valores de URL.database de um SQLite em memória
+_EM_MEMORIA = frozenset({None, '', ':memory:'})
+# Driver assíncrono de cada banco (DB_ASYNC)
+DRIVERS_ASYNC = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+
+def _pragmas_sqlite(conexao_dbapi, registro):
+    cursor = conexao_dbapi.cursor()
+    # WAL: leitores não bloqueiam o escritor nem são bloqueados por ele
+    cursor.execute('PRAGMA journal_mode=WAL')
+    # Com WAL, NORMAL só perde transações numa queda de energia, não do processo
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f'PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}')
+    cursor.execute(f'PRAGMA mmap_size={int(settings.SQLITE_MMAP_BYTES)}')
+    # Negativo: tamanho em KiB em vez de páginas
+    cursor.execute(f'PRAGMA cache_size={-int(settings.SQLITE_CACHE_KIB)}')
+    cursor.close()
+
+
+def _sem_transacao_implicita(conexao_dbapi, registro):
+    # O pysqlite abre transações DEFERRED por conta própria; assim quem abre
+    # é o evento begin abaixo
+    conexao_dbapi.isolation_level = None
+
+
+def _begin_immediate(conn):
+    # Reserva a escrita já no BEGIN: uma transação que leu e depois tenta
+    # escrever não cai em "database is locked" sem esperar o busy_timeout
+    conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+def url_async(url: str) -> str:
+    """``url`` com o driver assíncrono do banco (asyncpg / aiosqlite)."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    url = url.set(drivername=f'{backend}+{DRIVERS_ASYNC[backend]}')
+    return url.render_as_string(hide_password=False)
+
+
+def criar_engines(url: str, assincrono: bool = False):
+    """Engines de leitura e de escrita para ``url``.
+
+    Fora do SQLite em arquivo as duas são a mesma engine. No SQLite, o
+    banco aceita um escritor por vez: a engine de escrita tem uma única
+    conexão (o pool serializa as escritas do processo, em fila) e abre
+    transações com ``BEGIN IMMEDIATE``, que espera o ``busy_timeout`` por
+    escritores de outros processos; a de leitura é um pool comum. As duas
+    aplicam os PRAGMAs de produção a cada conexão.
+
+    Com ``assincrono`` devolve ``AsyncEngine``s do driver de ``url_async``.
+    """
+    engine_args = {}
+    if url.startswith('postgresql'):
+        engine_args = {
+            'pool_pre_ping': True,
+            'pool_recycle': 300,
+        }
+    url_banco = make_url(url)
+    em_memoria = url_banco.database in _EM_MEMORIA
+    # SQLite em memória precisa do pool de conexão única padrão
+    if not em_memoria:
+        engine_args |= {
+            'poolclass': PoolMedidoAsync if assincrono else PoolMedido,
+            'pool_size': settings.DB_POOL_SIZE,
+            'max_overflow': settings.DB_MAX_OVERFLOW,
+            'pool_timeout': settings.DB_POOL_TIMEOUT,
+        }
+    if assincrono:
+        criar, url = create_async_engine, url_async(url)
+    else:
+        criar = create_engine
+
+    engine = criar(url, **engine_args)
+    if em_memoria or url_banco.get_backend_name() != 'sqlite':
+        return engine, engine
+
+    escrita = criar(url, **(engine_args | {'pool_size': 1, 'max_overflow': 0}))
+    # Os eventos são da engine síncrona por trás das assíncronas
+    leitura_sync = getattr(engine, 'sync_engine', engine)
+    escrita_sync = getattr(escrita, 'sync_engine', escrita)
+    event.listen(leitura_sync, 'connect', _pragmas_sqlite)
+    event.listen(escrita_sync, 'connect', _pragmas_sqlite)
+    event.listen(escrita_sync, 'connect', _sem_transacao_implicita)
+    event.listen(escrita_sync, 'begin', _begin_immediate)
+    return engine, escrita
+
+
+class SessaoSQLite(Session):
+    """Sessão que lê pelo pool e escreve pela conexão única de escrita.
+
+    Até o primeiro INSERT/UPDATE/DELETE (ou flush) os comandos vão para a
+    engine de leitura; daí até o fim da transação, todos vão para a de
+    escrita, que assim só fica ocupada entre a primeira escrita e o commit
+    e enxerga o que a própria transação escreveu.
+    """
+
+    def __init__(self, leitura: Engine, escrita: Engine, **kwargs):
+        super().__init__(**kwargs)
+        self._leitura = leitura
+        self._escrita = escrita
+        self._escrevendo = False
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if not self._escrevendo and (
+            self._flushing or isinstance(clause, UpdateBase)
+        ):
+            self._escrevendo = True
+        return self._escrita if self._escrevendo else self._leitura
+
+
+@event.listens_for(SessaoSQLite, 'after_transaction_end')
+def _fim_da_escrita(session: SessaoSQLite, transacao: SessionTransaction):
+    if transacao.parent is None:
+        session._escrevendo = False
+
+
+# Pools expostos em /metrics, por rótulo
+pools: dict[str, Engine] = {}
+metricas.registrar_coletor(partial(linhas_pool, pools))
+
+
+def _instrumentar(nome: str, engine: Engine) -> None:
+    # Consultas e tempo de banco por requisição, expostos em /metrics
+    pools[nome] = engine
+    instrumentar_engine(engine)
+    if settings.CONSULTAS_LENTAS_ATIVO:
+        registro_consultas.instrumentar(engine)
+
+
+@cache
+def engines() -> tuple[Engine, Engine]:
+    """Engines de leitura e escrita do banco configurado, criadas no primeiro uso.
+
+    Importar a aplicação não abre o driver nem monta pools; o lifespan faz
+    o primeiro uso ao pré-carregar o índice de disponibilidade.
+    """
+    leitura, escrita = criar_engines(settings.DATABASE_URL)
+    _instrumentar('principal', leitura)
+    if escrita is not leitura:
+        _instrumentar('escrita', escrita)
+    return leitura, escrita
+
+
+def descartar_conexoes_herdadas() -> None:
+    """Troca os pools herdados do processo pai, sem fechar as conexões dele.
+
+    Chamada em cada worker logo após o fork (gunicorn.conf.py): as conexões
+    abertas no pai continuam só dele, e o worker abre as próprias.
+    """
+    for engine in pools.values():
+        engine.dispose(close=False)
+
+
+def nova_sessao() -> Session:
+    """Sessão do banco configurado; no SQLite, uma ``SessaoSQLite``."""
+    leitura, escrita = engines()
+    if escrita is leitura:
+        return Session(leitura)
+    return SessaoSQLite(leitura, escrita)
+
+
+def get_session(_vaga: None = Depends(admitir_no_banco)):
+    # A vaga (pool.py) é tomada antes da conexão e só volta depois dela
+    with nova_sessao() as session:
+        yield session
+
+
+@cache
+def engines_async() -> tuple[AsyncEngine, AsyncEngine]:
+    """Engines assíncronas de leitura e escrita, criadas no primeiro uso.
 
-settings = Settings()
+    Só existem com ``DB_ASYNC``; o driver (asyncpg ou aiosqlite) só é
+    importado aqui.
+    """
+    leitura, escrita = criar_engines(settings.DATABASE_URL, assincrono=True)
+    _instrumentar('async', leitura.sync_engine)
+    if escrita is not leitura:
+        _instrumentar('async_escrita', escrita.sync_engine)
+    return leitura, escrita
 
-engine_args = {}
-if settings.DATABASE_URL.startswith('postgresql'):
-    engine_args = {
-        'pool_pre_ping': True,
-        'pool_recycle': 300,
-    }
 
-engine = create_engine(settings.DATABASE_URL, **engine_args)
+def nova_sessao_async(leitura: AsyncEngine, escrita: AsyncEngine) -> AsyncSession:
+    # Sem expirar no commit: a resposta é serializada fora do greenlet das
+    # rotas (async_routes.py) e não pode disparar um SELECT de recarga
+    if escrita is leitura:
+        return AsyncSession(leitura, expire_on_commit=False)
+    return AsyncSession(
+        sync_session_class=SessaoSQLite,
+        leitura=leitura.sync_engine,
+        escrita=escrita.sync_engine,
+        expire_on_commit=False,
+    )
 
 
-def get_session():
-    with Session(engine) as session:
+async def get_session_async():
+    async with nova_sessao_async(*engines_async()) as session:
         yield session
 
 
 def create_tables():
-    table_registry.metadata.create_all(engine)
+    table_registry.metadata.create_all(engines()[1])
@@ -0,0 +1,276 @@
+"""Métricas da aplicação no formato texto do Prometheus.
+
+``MiddlewareMetricas`` mede cada requisição HTTP (latência e status, por
+rota) e abre uma ``MedicaoRequisicao`` num ``ContextVar``; os eventos de
+``instrumentar_engine`` somam nela as consultas e o tempo gasto no banco.
+O FastAPI copia o contexto para a thread que roda as rotas síncronas, então
+a medição chega aos eventos do SQLAlchemy sem passar por parâmetros.
+
+``metricas.renderizar()`` gera o texto servido em ``/metrics``. Nada aqui
+depende de bibliotecas externas.
+
+O registro é do processo: com vários workers (gunicorn.conf.py) cada um
+responde pelos seus contadores. Toda série leva o rótulo ``pid`` do worker,
+então cada raspagem cai numa série própria em vez de alternar históricos
+(o que o Prometheus leria como reinícios dos contadores); some por ``pid``
+nas consultas, por exemplo ``sum without (pid) (rate(...))``.
+"""
+
+import os
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from collections.abc import Callable, Iterable
+from contextvars import ContextVar
+from dataclasses import dataclass
+from time import perf_counter
+
+from sqlalchemy import Engine, event
+
+# Limites (em segundos) dos baldes de latência, como os padrões do Prometheus
+BALDES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Limites dos baldes de consultas por requisição
+BALDES_CONSULTAS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Rótulo das requisições que não casaram com nenhuma rota (evita um rótulo
+# por URL desconhecida)
+ROTA_DESCONHECIDA = '(nenhuma)'
+
+
+@dataclass(slots=True)
+class MedicaoRequisicao:
+    consultas: int = 0
+    tempo_db: float = 0.0
+    # Scope ASGI da requisição, de onde sai a rota (rota_atual)
+    escopo: dict | None = None
+
+
+_medicao_atual: ContextVar[MedicaoRequisicao | None] = ContextVar(
+    'medicao_atual', default=None
+)
+
+
+class Histograma:
+    __slots__ = ('contagens', 'limites', 'soma', 'total')
+
+    def __init__(self, limites: tuple[float, ...]):
+        self.limites = limites
+        # Uma posição por limite e a última para +Inf
+        self.contagens = [0] * (len(limites) + 1)
+        self.soma = 0.0
+        self.total = 0
+
+    def observar(self, valor: float) -> None:
+        self.contagens[bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+        self.total += 1
+
+
+def _rotulos(**rotulos: str) -> str:
+    pares = (
+        '{}="{}"'.format(
+            nome,
+            str(valor)
+            .replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n'),
+        )
+        for nome, valor in rotulos.items()
+    )
+    return '{' + ','.join(pares) + '}'
+
+
+def _com_pid(linha: str, pid: str) -> str:
+    # Comentários (# HELP / # TYPE) ficam como estão
+    if linha.startswith('#'):
+        return linha
+    nome, chave, resto = linha.partition('{')
+    if chave:
+        return f'{nome}{{{pid},{resto}'
+    nome, _, valor = linha.partition(' ')
+    return f'{nome}{{{pid}}} {valor}'
+
+
+def linhas_histograma(
+    nome: str, histograma: Histograma, **rotulos: str
+) -> Iterable[str]:
+    """Linhas ``_bucket``/``_sum``/``_count`` de um histograma."""
+    acumulado = 0
+    for limite, contagem in zip(
+        (*histograma.limites, '+Inf'), histograma.contagens
+    ):
+        acumulado += contagem
+        yield f'{nome}_bucket{_rotulos(**rotulos, le=limite)} {acumulado}'
+    sufixo = _rotulos(**rotulos) if rotulos else ''
+    yield f'{nome}_sum{sufixo} {histograma.soma}'
+    yield f'{nome}_count{sufixo} {histograma.total}'
+
+
+def _linhas_histograma(
+    nome: str, series: dict[tuple[str, str], Histograma]
+) -> Iterable[str]:
+    for (metodo, rota), histograma in sorted(series.items()):
+        yield from linhas_histograma(nome, histograma, method=metodo, route=rota)
+
+
+class RegistroMetricas:
+    """Acumula as métricas do processo; seguro para várias threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencia: dict[tuple[str, str], Histograma] = {}
+        self._consultas_por_requisicao: dict[tuple[str, str], Histograma] = {}
+        self._requisicoes: Counter[tuple[str, str, int]] = Counter()
+        self._consultas: Counter[tuple[str, str]] = Counter()
+        self._tempo_db: defaultdict[tuple[str, str], float] = defaultdict(float)
+        self._coletores: list[Callable[[], Iterable[str]]] = []
+
+    def observar_requisicao(
+        self,
+        metodo: str,
+        rota: str,
+        status: int,
+        duracao: float,
+        medicao: MedicaoRequisicao,
+    ) -> None:
+        chave = (metodo, rota)
+        with self._lock:
+            latencia = self._latencia.get(chave)
+            if latencia is None:
+                latencia = self._latencia[chave] = Histograma(BALDES_LATENCIA)
+                self._consultas_por_requisicao[chave] = Histograma(
+                    BALDES_CONSULTAS
+                )
+            latencia.observar(duracao)
+            self._consultas_por_requisicao[chave].observar(medicao.consultas)
+            self._requisicoes[metodo, rota, status] += 1
+            self._consultas[chave] += medicao.consultas
+            self._tempo_db[chave] += medicao.tempo_db
+
+    def registrar_coletor(self, coletor: Callable[[], Iterable[str]]) -> None:
+        """Acrescenta linhas geradas por ``coletor`` a cada ``renderizar``."""
+        self._coletores.append(coletor)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._latencia.clear()
+            self._consultas_por_requisicao.clear()
+            self._requisicoes.clear()
+            self._consultas.clear()
+            self._tempo_db.clear()
+
+    def renderizar(self) -> str:
+        with self._lock:
+            linhas = [
+                '# HELP http_requests_total Requisições HTTP por rota e status.',
+                '# TYPE http_requests_total counter',
+            ]
+            linhas.extend(
+                f'http_requests_total{_rotulos(method=m, route=r, status=s)} {n}'
+                for (m, r, s), n in sorted(self._requisicoes.items())
+            )
+            linhas += [
+                '# HELP http_request_duration_seconds Latência das requisições.',
+                '# TYPE http_request_duration_seconds histogram',
+            ]
+            linhas.extend(
+                _linhas_histograma('http_request_duration_seconds', self._latencia)
+            )
+            linhas += [
+                '# HELP http_request_db_queries Consultas ao banco por requisição.',
+                '# TYPE http_request_db_queries histogram',
+            ]
+            linhas.extend(
+                _linhas_histograma(
+                    'http_request_db_queries', self._consultas_por_requisicao
+                )
+            )
+            linhas += [
+                '# HELP db_queries_total Consultas ao banco feitas pelas rotas.',
+                '# TYPE db_queries_total counter',
+            ]
+            linhas.extend(
+                f'db_queries_total{_rotulos(method=m, route=r)} {n}'
+                for (m, r), n in sorted(self._consultas.items())
+            )
+            linhas += [
+                '# HELP db_query_duration_seconds_total Tempo gasto no banco.',
+                '# TYPE db_query_duration_seconds_total counter',
+            ]
+            linhas.extend(
+                f'db_query_duration_seconds_total{_rotulos(method=m, route=r)} {t}'
+                for (m, r), t in sorted(self._tempo_db.items())
+            )
+
+        for coletor in self._coletores:
+            linhas.extend(coletor())
+        # Lido a cada chamada: os workers nascem por fork depois da importação
+        pid = f'pid="{os.getpid()}"'
+        return '\n'.join(_com_pid(linha, pid) for linha in linhas) + '\n'
+
+
+metricas = RegistroMetricas()
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI que mede cada requisição HTTP em ``registro``."""
+
+    def __init__(self, app, registro: RegistroMetricas = metricas):
+        self.app = app
+        self.registro = registro
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        medicao = MedicaoRequisicao(escopo=scope)
+        token = _medicao_atual.set(medicao)
+        status = 500
+
+        async def enviar(mensagem):
+            nonlocal status
+            if mensagem['type'] == 'http.response.start':
+                status = mensagem['status']
+            await send(mensagem)
+
+        inicio = perf_counter()
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            duracao = perf_counter() - inicio
+            _medicao_atual.reset(token)
+            self.registro.observar_requisicao(
+                scope['method'], _rota(scope), status, duracao, medicao
+            )
+
+
+def _rota(scope: dict) -> str:
+    # O roteador do FastAPI guarda no scope a rota que atendeu
+    return getattr(scope.get('route'), 'path', ROTA_DESCONHECIDA)
+
+
+def rota_atual() -> str | None:
+    """Rota da requisição em andamento nesta thread/tarefa, se houver."""
+    medicao = _medicao_atual.get()
+    if medicao is None or medicao.escopo is None:
+        return None
+    return _rota(medicao.escopo)
+
+
+def _antes_da_consulta(conn, *args):
+    if _medicao_atual.get() is not None:
+        conn.info['metricas_inicio'] = perf_counter()
+
+
+def _depois_da_consulta(conn, *args):
+    inicio = conn.info.pop('metricas_inicio', None)
+    medicao = _medicao_atual.get()
+    if inicio is not None and medicao is not None:
+        medicao.consultas += 1
+        medicao.tempo_db += perf_counter() - inicio
+
+
+def instrumentar_engine(engine: Engine) -> None:
+    """Soma consultas e tempo de banco de ``engine`` na requisição atual."""
+    event.listen(engine, 'before_cursor_execute', _antes_da_consulta)
+    event.listen(engine, 'after_cursor_execute', _depois_da_consulta)
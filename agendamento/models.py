@@ -1,6 +1,14 @@
-from datetime import date, time
+from datetime import date, datetime, time
 
-from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy import (
+    DDL,
+    ForeignKey,
+    Index,
+    Sequence,
+    UniqueConstraint,
+    event,
+    func,
+)
 from sqlalchemy.orm import Mapped, mapped_column, registry
 
 table_registry = registry()
@@ -15,6 +23,22 @@ class User:
     email: Mapped[str] = mapped_column(unique=True)
     senha: Mapped[str]
     is_admin: Mapped[bool] = mapped_column(default=False)
+    # Pagamento atual (o de vencimento mais recente) desnormalizado, mantido
+    # na mesma transação que altera pagamentos (services.definir_pagamento_atual)
+    pagamento_atual_id: Mapped[int | None] = mapped_column(
+        ForeignKey(
+            'pagamentos.id',
+            ondelete='SET NULL',
+            use_alter=True,
+            name='fk_users_pagamento_atual_id',
+        ),
+        default=None,
+    )
+    pagamento_status: Mapped[str | None] = mapped_column(default=None)
+    pagamento_vencimento: Mapped[date | None] = mapped_column(default=None)
+    # Incrementada a cada escrita nos agendamentos ou pagamentos do usuário
+    # (services.registrar_alteracao); compõe o ETag das listagens dele
+    versao: Mapped[int] = mapped_column(default=0, server_default='0')
 
 
 @table_registry.mapped_as_dataclass
@@ -37,5 +61,62 @@ class Pagamento:
     data_vencimento: Mapped[date]
     status: Mapped[str]
     # Status: 'Em dia', 'Atrasado', 'Aguardando confirmação', 'Aprovado', 'Recusado'
-    comprovante: Mapped[bytes | None] = mapped_column(default=None)
-    comprovante_mime: Mapped[str | None] = mapped_column(default=None)
+    comprovante_sha256: Mapped[str | None] = mapped_column(
+        ForeignKey('comprovantes.sha256'), default=None
+    )
+
+
+# Índices das consultas mais frequentes (migração 20261018_indices_consultas):
+# último pagamento do usuário, agendamentos do usuário em ordem e a
+# varredura/listagem de pagamentos atrasados
+Index(
+    'ix_pagamentos_id_usuario_data_vencimento',
+    Pagamento.id_usuario,
+    Pagamento.data_vencimento.desc(),
+)
+Index(
+    'ix_agendamentos_id_usuario_data_hora',
+    Agendamento.id_usuario,
+    Agendamento.data,
+    Agendamento.hora,
+)
+Index(
+    'ix_pagamentos_status_data_vencimento',
+    Pagamento.status,
+    Pagamento.data_vencimento,
+)
+
+
+# Metadados do arquivo guardado no armazém de comprovantes (receipts.py)
+@table_registry.mapped_as_dataclass
+class Comprovante:
+    __tablename__ = 'comprovantes'
+
+    sha256: Mapped[str] = mapped_column(primary_key=True)
+    tamanho: Mapped[int]
+    mime: Mapped[str]
+    criado_em: Mapped[datetime] = mapped_column(
+        init=False, server_default=func.now()
+    )
+
+
+# Contadores de versão; a versão global muda a cada escrita em agendamentos,
+# pagamentos ou usuários e compõe o ETag das listagens do admin. No SQLite
+# ela é a linha 'global' (o único escritor já serializa as escritas)
+@table_registry.mapped_as_dataclass
+class Versao:
+    __tablename__ = 'versoes'
+
+    nome: Mapped[str] = mapped_column(primary_key=True)
+    valor: Mapped[int] = mapped_column(default=0)
+
+
+event.listen(
+    Versao.__table__,
+    'after_create',
+    DDL("INSERT INTO versoes (nome, valor) VALUES ('global', 0)"),
+)
+
+# Nos bancos com sequências (Postgres) a versão global é esta sequência,
+# avançada depois do commit: nenhuma linha travada entre os escritores
+versao_global_seq = Sequence('versao_global', metadata=table_registry.metadata)
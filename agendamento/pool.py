@@ -0,0 +1,189 @@
+"""Pool de conexões medido, limitador de threads e admissão no banco.
+
+As rotas são ``def`` síncronas: o FastAPI as roda no limitador de threads
+do AnyIO (40 por padrão). Uma requisição pega a conexão numa chamada ao
+limitador (a sessão da dependência ``get_session``, usada já pelas
+condicionais de ETag), devolve a thread e segue segurando a conexão até a
+rota, noutra chamada. Limitar só as threads não limita os checkouts: com
+N threads e N conexões, 2N requisições podem travar, as donas de conexão
+esperando thread e as donas de thread esperando conexão até
+``DB_POOL_TIMEOUT``.
+
+Por isso ``get_session`` passa antes por ``admitir_no_banco``, um semáforo
+assíncrono: só entram no banco ao mesmo tempo tantas requisições quantas
+threads o limitador tem, e cada uma segura a vaga até fechar a sessão. A
+espera pela vaga fica no event loop, sem thread nem conexão. O tamanho de
+ambos sai de ``threads_para_pool`` (a capacidade do pool,
+``DB_POOL_SIZE + DB_MAX_OVERFLOW``, ou menos com ``THREADPOOL_TOKENS``) e o
+lifespan os aplica com ``configurar_limitador``. Assim toda requisição
+admitida tem conexão e a que a segura sempre acha uma thread livre.
+
+``linhas_pool`` expõe em ``/metrics`` a espera no checkout, as conexões em
+uso de cada pool (o principal e, no SQLite, o de escrita) e a ocupação do
+limitador.
+"""
+
+import logging
+import threading
+from collections.abc import AsyncIterator, Iterable, Mapping
+from time import perf_counter
+
+from anyio import Semaphore, to_thread
+from sqlalchemy import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from agendamento.metrics import Histograma, linhas_histograma
+
+logger = logging.getLogger(__name__)
+
+# Limites (em segundos) dos baldes de espera no checkout; o normal é ficar
+# no primeiro, os demais só enchem com o pool esgotado
+BALDES_ESPERA = (
+    0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+    10.0, 30.0,
+)
+
+
+# Limitador em uso, guardado para as métricas (só pode ser obtido dentro
+# do event loop, e /metrics roda numa thread)
+_limitador = None
+# Vagas de requisições no banco (admitir_no_banco), do mesmo tamanho
+_admissao: Semaphore | None = None
+
+
+class _MedicaoCheckout:
+    """Mede quanto cada checkout do pool esperou."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock_metricas = threading.Lock()
+        self.espera = Histograma(BALDES_ESPERA)
+        self.esgotamentos = 0
+
+    def connect(self):
+        inicio = perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            with self._lock_metricas:
+                self.esgotamentos += 1
+            raise
+        finally:
+            with self._lock_metricas:
+                self.espera.observar(perf_counter() - inicio)
+
+
+class PoolMedido(_MedicaoCheckout, QueuePool):
+    """``QueuePool`` que mede quanto cada checkout esperou."""
+
+
+class PoolMedidoAsync(_MedicaoCheckout, AsyncAdaptedQueuePool):
+    """O mesmo, para as engines assíncronas (``DB_ASYNC``)."""
+
+
+def threads_para_pool(
+    tamanho: int, excedente: int, configurado: int | None = None
+) -> int:
+    """Tamanho do limitador de threads e da admissão no banco.
+
+    Sem ``configurado``, a capacidade do pool. Acima dela as requisições
+    admitidas a mais só esperariam conexão, então o valor é reduzido.
+    """
+    capacidade = tamanho + excedente
+    if configurado is None:
+        return capacidade
+    if configurado > capacidade:
+        logger.warning(
+            'THREADPOOL_TOKENS=%d excede o pool (%d conexões); usando %d.',
+            configurado,
+            capacidade,
+            capacidade,
+        )
+        return capacidade
+    return configurado
+
+
+def configurar_limitador(tokens: int) -> None:
+    """Ajusta o limitador padrão do AnyIO e as vagas de ``admitir_no_banco``.
+
+    Chamar dentro do event loop.
+    """
+    global _limitador, _admissao  # noqa: PLW0603
+    _limitador = to_thread.current_default_thread_limiter()
+    _limitador.total_tokens = tokens
+    _admissao = Semaphore(tokens)
+
+
+async def admitir_no_banco() -> AsyncIterator[None]:
+    """Dependência que segura uma vaga no banco enquanto a sessão existe."""
+    if _admissao is None:
+        # Fora do lifespan (scripts): não há limitador a proteger
+        yield
+        return
+    async with _admissao:
+        yield
+
+
+def _rotulo(nome: str) -> str:
+    return f'{{pool="{nome}"}}'
+
+
+def linhas_pool(engines: Mapping[str, Engine]) -> Iterable[str]:
+    """Coletor de ``metricas`` com o estado dos pools, rotulados pela chave."""
+    # Lidos a cada chamada: engine.dispose() troca o pool
+    pools = {
+        nome: engine.pool
+        for nome, engine in engines.items()
+        if isinstance(engine.pool, _MedicaoCheckout)
+    }
+    if pools:
+        linhas = [
+            '# HELP db_pool_checkout_wait_seconds Espera por uma conexão.',
+            '# TYPE db_pool_checkout_wait_seconds histogram',
+        ]
+        esgotamentos = {}
+        for nome, pool in pools.items():
+            with pool._lock_metricas:
+                linhas.extend(
+                    linhas_histograma(
+                        'db_pool_checkout_wait_seconds', pool.espera, pool=nome
+                    )
+                )
+                esgotamentos[nome] = pool.esgotamentos
+        linhas += [
+            '# HELP db_pool_checkout_timeouts_total Checkouts que estouraram'
+            ' DB_POOL_TIMEOUT.',
+            '# TYPE db_pool_checkout_timeouts_total counter',
+        ]
+        linhas.extend(
+            f'db_pool_checkout_timeouts_total{_rotulo(nome)} {n}'
+            for nome, n in esgotamentos.items()
+        )
+        linhas += [
+            '# HELP db_pool_connections_in_use Conexões emprestadas do pool.',
+            '# TYPE db_pool_connections_in_use gauge',
+        ]
+        linhas.extend(
+            f'db_pool_connections_in_use{_rotulo(nome)} {pool.checkedout()}'
+            for nome, pool in pools.items()
+        )
+        linhas += [
+            '# HELP db_pool_connections_max Conexões possíveis (size + overflow).',
+            '# TYPE db_pool_connections_max gauge',
+        ]
+        linhas.extend(
+            f'db_pool_connections_max{_rotulo(nome)}'
+            f' {pool.size() + pool._max_overflow}'
+            for nome, pool in pools.items()
+        )
+        yield from linhas
+    if _limitador is not None:
+        yield from (
+            '# HELP threadpool_tokens_total Threads do limitador das rotas.',
+            '# TYPE threadpool_tokens_total gauge',
+            f'threadpool_tokens_total {_limitador.total_tokens}',
+            '# HELP threadpool_tokens_in_use Threads ocupadas agora.',
+            '# TYPE threadpool_tokens_in_use gauge',
+            f'threadpool_tokens_in_use {_limitador.borrowed_tokens}',
+        )
@@ -0,0 +1,154 @@
+"""Registro de consultas lentas, agrupadas por impressão digital.
+
+Ativado por ``CONSULTAS_LENTAS_ATIVO``: os eventos do engine cronometram
+cada comando, o SQL é normalizado (literais, parâmetros e listas ``IN`` /
+``VALUES`` viram marcadores) e cada forma de consulta acumula contagem,
+tempo total, máximo e p95 das últimas execuções. Comandos acima de
+``CONSULTAS_LENTAS_LIMITE_MS`` vão para o log com a rota que os emitiu; só
+o SQL normalizado é registrado, nunca os valores dos parâmetros.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from functools import lru_cache
+from time import perf_counter
+
+from sqlalchemy import Engine, event
+
+from agendamento.metrics import rota_atual
+from agendamento.settings import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_LITERAL_TEXTO = re.compile(r"'(?:[^']|'')*'")
+_LITERAL_NUMERO = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMETRO = re.compile(r'%\(\w+\)s|%s|\$\d+|(?<!:):\w+')
+_LISTA = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_LISTAS_REPETIDAS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_ESPACOS = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=4096)
+def normalizar(sql: str) -> str:
+    """SQL com valores trocados por ``?`` e listas por ``(...)``."""
+    sql = _LITERAL_TEXTO.sub('?', sql)
+    sql = _PARAMETRO.sub('?', sql)
+    sql = _LITERAL_NUMERO.sub('?', sql)
+    sql = _LISTA.sub('(...)', sql)
+    sql = _LISTAS_REPETIDAS.sub('(...)', sql)
+    return _ESPACOS.sub(' ', sql).strip()
+
+
+def impressao_digital(sql_normalizado: str) -> str:
+    return hashlib.sha1(sql_normalizado.encode()).hexdigest()[:16]
+
+
+def _marcar_inicio(conn, *args):
+    conn.info['consulta_inicio'] = perf_counter()
+
+
+@dataclass(slots=True)
+class EstatisticaConsulta:
+    sql: str
+    janela: int
+    contagem: int = 0
+    total: float = 0.0
+    maximo: float = 0.0
+    recentes: deque = field(init=False)
+
+    def __post_init__(self):
+        self.recentes = deque(maxlen=self.janela)
+
+    def observar(self, duracao: float) -> None:
+        self.contagem += 1
+        self.total += duracao
+        self.maximo = max(self.maximo, duracao)
+        self.recentes.append(duracao)
+
+    def p95(self) -> float:
+        ordenados = sorted(self.recentes)
+        return ordenados[int(0.95 * (len(ordenados) - 1))] if ordenados else 0.0
+
+
+class RegistroConsultas:
+    """Agregados por impressão digital, em LRU de ``capacidade`` formas.
+
+    ``janela`` é quantas execuções recentes entram no p95 de cada forma.
+    """
+
+    def __init__(self, limite_ms: float, janela: int = 500, capacidade: int = 1000):
+        self.limite_ms = limite_ms
+        self.janela = janela
+        self.capacidade = capacidade
+        self.ativo = False
+        self._estatisticas: OrderedDict[str, EstatisticaConsulta] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def instrumentar(self, engine: Engine) -> None:
+        event.listen(engine, 'before_cursor_execute', _marcar_inicio)
+        event.listen(engine, 'after_cursor_execute', self._depois)
+        self.ativo = True
+
+    def _depois(self, conn, cursor, statement, *args):
+        inicio = conn.info.pop('consulta_inicio', None)
+        if inicio is not None:
+            self.observar(statement, perf_counter() - inicio)
+
+    def observar(self, sql: str, duracao: float) -> None:
+        normalizado = normalizar(sql)
+        chave = impressao_digital(normalizado)
+        with self._lock:
+            estatistica = self._estatisticas.get(chave)
+            if estatistica is None:
+                estatistica = EstatisticaConsulta(normalizado, self.janela)
+                self._estatisticas[chave] = estatistica
+                while len(self._estatisticas) > self.capacidade:
+                    self._estatisticas.popitem(last=False)
+            else:
+                self._estatisticas.move_to_end(chave)
+            estatistica.observar(duracao)
+
+        if duracao * 1000 >= self.limite_ms:
+            logger.warning(
+                'Consulta lenta (%.1f ms) em %s [%s]: %s',
+                duracao * 1000,
+                rota_atual() or '-',
+                chave,
+                normalizado,
+            )
+
+    def mais_custosas(self, limite: int) -> list[dict]:
+        """As ``limite`` formas de consulta com mais tempo total."""
+        with self._lock:
+            itens = sorted(
+                self._estatisticas.items(),
+                key=lambda item: item[1].total,
+                reverse=True,
+            )[:limite]
+            return [
+                {
+                    'fingerprint': chave,
+                    'sql': e.sql,
+                    'contagem': e.contagem,
+                    'total_ms': round(e.total * 1000, 3),
+                    'media_ms': round(e.total / e.contagem * 1000, 3),
+                    'max_ms': round(e.maximo * 1000, 3),
+                    'p95_ms': round(e.p95() * 1000, 3),
+                }
+                for chave, e in itens
+            ]
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._estatisticas.clear()
+
+
+registro_consultas = RegistroConsultas(
+    settings.CONSULTAS_LENTAS_LIMITE_MS,
+    janela=settings.CONSULTAS_LENTAS_JANELA,
+)
@@ -0,0 +1,65 @@
+"""Armazém de comprovantes de pagamento no sistema de arquivos.
+
+Os arquivos são endereçados pelo SHA-256 do conteúdo, então o mesmo
+comprovante enviado duas vezes ocupa espaço uma vez só. Os metadados
+(tamanho e tipo) ficam na tabela ``comprovantes``.
+"""
+
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import BinaryIO
+
+from agendamento.settings import get_settings
+
+settings = get_settings()
+
+TAMANHO_BLOCO = 64 * 1024
+
+
+class ArmazemComprovantes:
+    def __init__(self, raiz: str | Path):
+        self.raiz = Path(raiz)
+
+    def caminho(self, sha256: str) -> Path:
+        # Subdiretório pelo prefixo evita milhares de arquivos numa pasta só
+        return self.raiz / sha256[:2] / sha256
+
+    def salvar(self, origem: BinaryIO) -> tuple[str, int]:
+        """Grava o conteúdo em blocos e devolve (sha256, tamanho)."""
+        self.raiz.mkdir(parents=True, exist_ok=True)
+        resumo = hashlib.sha256()
+        tamanho = 0
+
+        temporario = tempfile.NamedTemporaryFile(
+            dir=self.raiz, prefix='.envio-', delete=False
+        )
+        try:
+            with temporario:
+                while bloco := origem.read(TAMANHO_BLOCO):
+                    resumo.update(bloco)
+                    temporario.write(bloco)
+                    tamanho += len(bloco)
+                temporario.flush()
+                os.fsync(temporario.fileno())
+
+            sha256 = resumo.hexdigest()
+            destino = self.caminho(sha256)
+            if destino.exists():
+                os.unlink(temporario.name)
+            else:
+                destino.parent.mkdir(exist_ok=True)
+                os.replace(temporario.name, destino)
+        except BaseException:
+            Path(temporario.name).unlink(missing_ok=True)
+            raise
+
+        return sha256, tamanho
+
+
+armazem_comprovantes = ArmazemComprovantes(settings.COMPROVANTES_DIR)
+
+
+def get_armazem_comprovantes():
+    return armazem_comprovantes
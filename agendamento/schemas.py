@@ -1,6 +1,13 @@
-from datetime import date, time
+from datetime import date, time, timedelta
+from typing import Self
 
-from pydantic import BaseModel, ConfigDict, EmailStr
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, model_validator
+
+# Paginação das listagens administrativas
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 500
+# Maior quantidade de horários num agendamento em lote
+LOTE_MAXIMO = 366
 
 
 # Schemas = Contratos
@@ -29,6 +36,21 @@ class UserPublic(BaseModel):
 
 class UserList(BaseModel):
     users: list[UserPublic]
+    # Cursor para a próxima página (None quando não há mais registros)
+    proximo_after_id: int | None = None
+
+
+class ErroImportacao(BaseModel):
+    linha: int
+    email: str | None = None
+    erro: str
+
+
+class ImportacaoResultado(BaseModel):
+    criados: int
+    erros: list[ErroImportacao]
+    # Erros além do limite relatado, apenas contados
+    erros_omitidos: int = 0
 
 
 class UserLogin(BaseModel):
@@ -64,6 +86,87 @@ class AgendamentoPublico(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+# Admin agenda vários horários de uma vez: ou uma regra semanal
+# (dia_semana 0 = segunda ... 6 = domingo, entre inicio e fim) ou uma
+# lista explícita de datas, sempre no mesmo horário
+class AgendamentoLoteCriar(BaseModel):
+    id_usuario: int
+    hora: time
+    dia_semana: int | None = Field(default=None, ge=0, le=6)
+    inicio: date | None = None
+    fim: date | None = None
+    datas: list[date] | None = Field(default=None, max_length=LOTE_MAXIMO)
+
+    @model_validator(mode='after')
+    def validar_regra(self) -> Self:
+        regra = (self.dia_semana, self.inicio, self.fim)
+        if self.datas is None:
+            if None in regra:
+                raise ValueError(
+                    'Informe dia_semana, inicio e fim, ou a lista de datas'
+                )
+            if self.fim < self.inicio:
+                raise ValueError('Data final anterior à data inicial')
+            if (self.fim - self.inicio).days > LOTE_MAXIMO:
+                raise ValueError(f'Intervalo máximo de {LOTE_MAXIMO} dias')
+        elif any(campo is not None for campo in regra):
+            raise ValueError('Use a regra semanal ou a lista de datas, não ambas')
+        return self
+
+    def datas_do_lote(self) -> list[date]:
+        if self.datas is not None:
+            return sorted(set(self.datas))
+        primeira = self.inicio + timedelta(
+            days=(self.dia_semana - self.inicio.weekday()) % 7
+        )
+        semanas = (self.fim - primeira).days // 7 + 1
+        return [primeira + timedelta(weeks=i) for i in range(max(semanas, 0))]
+
+
+class ConflitoAgendamento(BaseModel):
+    data: date
+    hora: time
+    motivo: str
+
+
+class AgendamentoLoteResultado(BaseModel):
+    criados: list[AgendamentoPublico]
+    conflitos: list[ConflitoAgendamento]
+
+
+# Parâmetros de paginação por cursor
+class FiltroPagina(BaseModel):
+    cursor: str | None = None
+    limit: int = Field(default=LIMITE_PADRAO, ge=1, le=LIMITE_MAXIMO)
+
+
+# Parâmetros de consulta da listagem de usuários do admin
+class FiltroUsuarios(BaseModel):
+    after_id: int | None = None
+    limit: int = Field(default=LIMITE_PADRAO, ge=1, le=LIMITE_MAXIMO)
+    status_pagamento: str | None = None
+
+
+# Parâmetros de consulta da listagem de agendamentos do admin
+class FiltroAgendamentos(BaseModel):
+    inicio: date
+    fim: date
+    cursor: str | None = None
+    limit: int = Field(default=LIMITE_PADRAO, ge=1, le=LIMITE_MAXIMO)
+
+
+# Parâmetros de consulta de disponibilidade por período
+class FiltroPeriodo(BaseModel):
+    inicio: date
+    fim: date
+
+
+class AgendamentoList(BaseModel):
+    agendamentos: list[AgendamentoPublico]
+    # Cursor opaco (data, hora, id) para a próxima página
+    proximo_cursor: str | None = None
+
+
 class HorariosDisponiveis(BaseModel):
     data: date
     horarios_disponiveis: list[str]
@@ -78,6 +181,29 @@ class PagamentoPublico(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class PagamentoList(BaseModel):
+    pagamentos: list[PagamentoPublico]
+    # Cursor opaco (data_vencimento, id) para a próxima página
+    proximo_cursor: str | None = None
+
+
 class PagamentoStatus(BaseModel):
     status: str
     data_proximo_vencimento: date | None = None
+
+
+# Diagnóstico das consultas (query_log.py), por impressão digital
+class DiagnosticoConsulta(BaseModel):
+    fingerprint: str
+    sql: str
+    contagem: int
+    total_ms: float
+    media_ms: float
+    max_ms: float
+    p95_ms: float
+
+
+class DiagnosticoConsultas(BaseModel):
+    ativo: bool
+    limite_lento_ms: float
+    consultas: list[DiagnosticoConsulta]
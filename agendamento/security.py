@@ -1,19 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Iterable
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 
 import jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from agendamento.database import get_session
+from agendamento.database import get_session, get_session_async
+from agendamento.metrics import metricas
 from agendamento.models import User
-from agendamento.settings import Settings
+from agendamento.settings import get_settings
 
-settings = Settings()
+settings = get_settings()
 security = HTTPBearer()
 
 
+# Dados do usuário autenticado que as rotas usam; não depende de sessão
+@dataclass(frozen=True, slots=True)
+class UsuarioAutenticado:
+    id: int
+    nome: str
+    email: str
+    is_admin: bool
+
+
+class CachePrincipais:
+    """Cache LRU com expiração dos usuários autenticados, por id.
+
+    Evita o SELECT em ``users`` a cada requisição autenticada. Quem remove
+    um usuário ou altera ``is_admin`` deve chamar ``invalidar``.
+
+    O cache é do processo: com vários workers (gunicorn.conf.py),
+    ``invalidar`` só limpa o do worker que atendeu a alteração, e os outros
+    seguem com a entrada até ela expirar. Por isso o lifespan encurta o
+    ``ttl`` quando ``WORKERS > 1``.
+    """
+
+    def __init__(self, capacidade: int, ttl: float):
+        self.capacidade = capacidade
+        self.ttl = ttl
+        self.acertos = 0
+        self.falhas = 0
+        self._itens: OrderedDict[int, tuple[float, UsuarioAutenticado]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def obter(self, user_id: int) -> UsuarioAutenticado | None:
+        with self._lock:
+            item = self._itens.get(user_id)
+            if item is None or item[0] < time.monotonic():
+                self._itens.pop(user_id, None)
+                self.falhas += 1
+                return None
+            self._itens.move_to_end(user_id)
+            self.acertos += 1
+            return item[1]
+
+    def guardar(self, usuario: UsuarioAutenticado) -> None:
+        with self._lock:
+            self._itens[usuario.id] = (time.monotonic() + self.ttl, usuario)
+            self._itens.move_to_end(usuario.id)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+
+    def invalidar(self, user_id: int) -> None:
+        with self._lock:
+            self._itens.pop(user_id, None)
+
+    def limpar(self) -> None:
+        with self._lock:
+            self._itens.clear()
+            self.acertos = 0
+            self.falhas = 0
+
+    def estatisticas(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'tamanho': len(self._itens),
+            }
+
+    def linhas_metricas(self) -> Iterable[str]:
+        """Coletor de ``metricas`` com os acertos e as falhas do cache."""
+        estatisticas = self.estatisticas()
+        return [
+            '# HELP auth_cache_hits_total Usuários autenticados achados no cache.',
+            '# TYPE auth_cache_hits_total counter',
+            f'auth_cache_hits_total {estatisticas["acertos"]}',
+            '# HELP auth_cache_misses_total Usuários autenticados lidos do banco.',
+            '# TYPE auth_cache_misses_total counter',
+            f'auth_cache_misses_total {estatisticas["falhas"]}',
+        ]
+
+
+cache_principais = CachePrincipais(
+    capacidade=settings.AUTH_CACHE_CAPACIDADE,
+    ttl=settings.AUTH_CACHE_TTL_SEGUNDOS,
+)
+metricas.registrar_coletor(cache_principais.linhas_metricas)
+
+
 def criar_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(
@@ -44,28 +138,116 @@ def verificar_token(token: str) -> dict:
         )
 
 
+def _principal(user: User | None) -> UsuarioAutenticado:
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail='Usuário não encontrado',
+        )
+
+    usuario = UsuarioAutenticado(
+        id=user.id, nome=user.nome, email=user.email, is_admin=user.is_admin
+    )
+    cache_principais.guardar(usuario)
+    return usuario
+
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     session: Session = Depends(get_session),
-):
+) -> UsuarioAutenticado:
     token = credentials.credentials
     payload = verificar_token(token)
 
-    user = session.scalar(select(User).where(User.id == payload['user_id']))
+    usuario = cache_principais.obter(payload['user_id'])
+    if usuario:
+        return usuario
 
-    if not user:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail='Usuário não encontrado',
-        )
-
-    return user
+    user = session.scalar(select(User).where(User.id == payload['user_id']))
+    return _principal(user)
 
 
-def get_current_admin(user: User = Depends(get_current_user)):
+def get_current_admin(
+    user: UsuarioAutenticado = Depends(get_current_user),
+) -> UsuarioAutenticado:
     if not user.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Acesso negado.',
         )
     return user
+
+
+# Rotas somente leitura podem confiar nas claims assinadas do token
+# (AUTH_CONFIAR_CLAIMS), sem consultar o banco nem o cache
+CLAIMS_USUARIO = ('user_id', 'nome', 'email', 'is_admin')
+
+
+def _usuario_das_claims(
+    credentials: HTTPAuthorizationCredentials,
+) -> UsuarioAutenticado | None:
+    if not settings.AUTH_CONFIAR_CLAIMS:
+        return None
+
+    payload = verificar_token(credentials.credentials)
+    if not all(claim in payload for claim in CLAIMS_USUARIO):
+        # Tokens emitidos antes da claim 'nome' seguem o caminho normal
+        return None
+
+    return UsuarioAutenticado(
+        id=payload['user_id'],
+        nome=payload['nome'],
+        email=payload['email'],
+        is_admin=payload['is_admin'],
+    )
+
+
+def get_current_user_leitura(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: Session = Depends(get_session),
+) -> UsuarioAutenticado:
+    return _usuario_das_claims(credentials) or get_current_user(
+        credentials, session
+    )
+
+
+def get_current_admin_leitura(
+    user: UsuarioAutenticado = Depends(get_current_user_leitura),
+) -> UsuarioAutenticado:
+    return get_current_admin(user)
+
+
+# Versões assíncronas, usadas pelas rotas com DB_ASYNC (async_routes.py)
+async def get_current_user_async(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: AsyncSession = Depends(get_session_async),
+) -> UsuarioAutenticado:
+    payload = verificar_token(credentials.credentials)
+
+    usuario = cache_principais.obter(payload['user_id'])
+    if usuario:
+        return usuario
+
+    user = await session.scalar(select(User).where(User.id == payload['user_id']))
+    return _principal(user)
+
+
+async def get_current_admin_async(
+    user: UsuarioAutenticado = Depends(get_current_user_async),
+) -> UsuarioAutenticado:
+    return get_current_admin(user)
+
+
+async def get_current_user_leitura_async(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    session: AsyncSession = Depends(get_session_async),
+) -> UsuarioAutenticado:
+    return _usuario_das_claims(credentials) or await get_current_user_async(
+        credentials, session
+    )
+
+
+async def get_current_admin_leitura_async(
+    user: UsuarioAutenticado = Depends(get_current_user_leitura_async),
+) -> UsuarioAutenticado:
+    return get_current_admin(user)
@@ -0,0 +1,68 @@
+"""Serialização direta das listagens.
+
+As rotas de listagem devolvem uma ``Response`` pronta, montada a partir das
+linhas do banco sem passar pela validação do pydantic: os valores já vêm
+tipados pelo SQLAlchemy (e foram validados na entrada). O JSON sai do
+serializador em Rust do pydantic-core, via um ``TypeAdapter`` em cache de um
+``TypedDict`` espelho do schema de resposta. O ``response_model`` continua
+declarado nas rotas para o OpenAPI, mas o FastAPI não valida de novo uma
+``Response``.
+"""
+
+from collections.abc import Sequence
+from functools import cache
+from typing import Any, get_args, get_origin
+
+from fastapi import Response
+from pydantic import BaseModel, TypeAdapter
+from sqlalchemy import Row
+from typing_extensions import TypedDict
+
+
+def _espelho(tipo: Any) -> Any:
+    """Troca os modelos de ``tipo`` por ``TypedDict`` com os mesmos campos.
+
+    O serializador de um ``TypedDict`` aceita dicts comuns, e só serializa:
+    validadores caros como o de ``EmailStr`` não rodam.
+    """
+    if isinstance(tipo, type) and issubclass(tipo, BaseModel):
+        return TypedDict(
+            tipo.__name__,
+            {
+                nome: _espelho(campo.annotation)
+                for nome, campo in tipo.model_fields.items()
+            },
+        )
+    if get_origin(tipo) is list:
+        return list[_espelho(get_args(tipo)[0])]
+    return tipo
+
+
+@cache
+def adaptador(tipo: Any) -> TypeAdapter:
+    """``TypeAdapter`` do espelho de ``tipo``, construído uma vez por processo."""
+    return TypeAdapter(_espelho(tipo))
+
+
+def linhas_como_dicts(linhas: Sequence[Row]) -> list[dict]:
+    if not linhas:
+        return []
+    chaves = linhas[0]._fields
+    return [dict(zip(chaves, linha)) for linha in linhas]
+
+
+def resposta_json(
+    tipo: Any, dados: Any, response: Response | None = None
+) -> Response:
+    """Serializa ``dados`` (dicts no formato de ``tipo``) numa ``Response``.
+
+    ``response`` é a resposta injetada pelo FastAPI na rota: os cabeçalhos
+    definidos nela (por exemplo o ETag das dependências) são repassados,
+    já que o FastAPI os ignora quando a rota devolve a própria ``Response``.
+    """
+    resposta = Response(
+        adaptador(tipo).dump_json(dados), media_type='application/json'
+    )
+    if response is not None:
+        resposta.raw_headers.extend(response.raw_headers)
+    return resposta
@@ -0,0 +1,474 @@
+"""Operações de escrita compartilhadas pelas rotas."""
+
+import csv
+import io
+import json
+import logging
+from collections.abc import Callable, Iterable, Iterator
+from datetime import date, time
+from importlib import import_module
+from typing import BinaryIO
+
+from pydantic import ValidationError
+from sqlalchemy import Connection, event, insert, select, text, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from agendamento.models import (
+    Agendamento,
+    Comprovante,
+    Pagamento,
+    User,
+    Versao,
+    versao_global_seq,
+)
+from agendamento.schemas import (
+    ErroImportacao,
+    ImportacaoResultado,
+    UserPublic,
+    UserSchema,
+)
+
+# Linhas processadas por transação na importação de usuários
+LOTE_IMPORTACAO = 500
+# Erros detalhados na resposta da importação; os demais são só contados
+ERROS_RELATADOS = 1000
+logger = logging.getLogger(__name__)
+
+# Marca, em session.info, a versão global a avançar depois do commit; no
+# before_commit a marca passa a guardar a conexão da própria sessão
+_VERSAO_GLOBAL_PENDENTE = 'versao_global_pendente'
+
+# Dialetos com INSERT ... ON CONFLICT DO NOTHING. O insert de cada um vem
+# de sqlalchemy.dialects.<nome>, já importado pela engine quando é usado
+_INSERT_COM_CONFLITO = frozenset({'postgresql', 'sqlite'})
+
+
+def registrar_alteracao(session: Session, *ids_usuario: int) -> None:
+    """Incrementa a versão dos usuários indicados e a versão global.
+
+    A dos usuários muda na mesma transação da escrita, para o ETag nunca
+    ficar à frente ou atrás dos dados. A global também, no SQLite; com
+    sequências (Postgres) ela só avança depois do commit, fora da
+    transação, e os escritores não disputam uma linha: um leitor pode ver
+    os dados novos ainda com a versão anterior por um instante, nunca a
+    versão nova com os dados antigos.
+    """
+    if ids_usuario:
+        session.execute(
+            update(User)
+            .where(User.id.in_(ids_usuario))
+            .values(versao=User.versao + 1)
+            .execution_options(synchronize_session=False)
+        )
+    if session.get_bind().dialect.supports_sequences:
+        session.info[_VERSAO_GLOBAL_PENDENTE] = True
+        return
+    session.execute(
+        update(Versao)
+        .where(Versao.nome == 'global')
+        .values(valor=Versao.valor + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _avancar_sequencia(conexao: Connection) -> None:
+    # nextval não é transacional nem trava nada
+    conexao.execute(select(versao_global_seq.next_value()))
+
+
+@event.listens_for(Session, 'before_commit')
+def _reservar_conexao_versao_global(session: Session) -> None:
+    # Depois do commit a sessão ainda segura esta conexão, até fechar a
+    # transação: o nextval usa ela, sem pedir uma segunda ao pool
+    if session.info.get(_VERSAO_GLOBAL_PENDENTE) is True:
+        session.info[_VERSAO_GLOBAL_PENDENTE] = session.connection()
+
+
+@event.listens_for(Session, 'after_commit')
+def _avancar_versao_global(session: Session) -> None:
+    conexao = session.info.pop(_VERSAO_GLOBAL_PENDENTE, None)
+    if not isinstance(conexao, Connection):
+        return
+    try:
+        _avancar_sequencia(conexao)
+    except Exception:
+        # A escrita já foi gravada: a falha não pode virar erro da
+        # requisição. O ETag global só fica para trás até a próxima escrita
+        logger.exception('Falha ao avançar a versão global')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_versao_global(session: Session) -> None:
+    session.info.pop(_VERSAO_GLOBAL_PENDENTE, None)
+
+
+def versao_usuario(session: Session, id_usuario: int) -> int:
+    """Versão atual do usuário (busca pela chave primária)."""
+    return session.scalar(select(User.versao).where(User.id == id_usuario)) or 0
+
+
+def versao_global(session: Session) -> int:
+    if session.get_bind().dialect.supports_sequences:
+        # Antes do primeiro nextval, last_value já é o valor inicial
+        # (is_called falso): a versão é a anterior a ele
+        ultimo, chamado = session.execute(
+            text(f'SELECT last_value, is_called FROM {versao_global_seq.name}')
+        ).one()
+        return ultimo if chamado else ultimo - 1
+    return (
+        session.scalar(select(Versao.valor).where(Versao.nome == 'global'))
+        or 0
+    )
+
+
+def reservar_horario(
+    session: Session, id_usuario: int, data: date, hora: time
+) -> int | None:
+    """Insere o agendamento e devolve o id, ou None se o horário já existe.
+
+    Quem decide a disputa pelo horário é a restrição única (data, hora):
+    não há SELECT prévio, então duas requisições simultâneas não passam
+    as duas pela verificação. O commit fica a cargo de quem chama.
+    """
+    return reservar_horarios(session, id_usuario, [(data, hora)]).get(
+        (data, hora)
+    )
+
+
+def reservar_horarios(
+    session: Session, id_usuario: int, horarios: Iterable[tuple[date, time]]
+) -> dict[tuple[date, time], int]:
+    """Insere vários agendamentos num único INSERT.
+
+    Devolve ``{(data, hora): id}`` dos que foram criados; os horários que
+    ficaram de fora já estavam ocupados.
+    """
+    horarios = list(dict.fromkeys(horarios))
+    if not horarios:
+        return {}
+
+    dialeto = session.get_bind().dialect
+    if dialeto.name in _INSERT_COM_CONFLITO and dialeto.insert_returning:
+        insert_do_dialeto = import_module(f'sqlalchemy.dialects.{dialeto.name}').insert
+        linhas = session.execute(
+            insert_do_dialeto(Agendamento)
+            .values([
+                {'id_usuario': id_usuario, 'data': data, 'hora': hora}
+                for data, hora in horarios
+            ])
+            .on_conflict_do_nothing(index_elements=['data', 'hora'])
+            .returning(Agendamento.id, Agendamento.data, Agendamento.hora)
+        )
+        criados = {(linha.data, linha.hora): linha.id for linha in linhas}
+        if criados:
+            registrar_alteracao(session, id_usuario)
+        return criados
+
+    # Sem ON CONFLICT: descarta os ocupados numa consulta e insere o resto
+    # num savepoint. Se o INSERT falhar, consulta de novo: horários que outra
+    # transação ocupou no meio saem e o resto é tentado outra vez; se nenhum
+    # passou a estar ocupado, o erro não é de disputa (ex.: usuário
+    # removido) e sobe, como no caminho com ON CONFLICT
+    pendentes = horarios
+    erro: IntegrityError | None = None
+    while True:
+        ocupados = set(
+            session.execute(
+                select(Agendamento.data, Agendamento.hora).where(
+                    tuple_(Agendamento.data, Agendamento.hora).in_(pendentes)
+                )
+            ).all()
+        )
+        if erro is not None and not ocupados:
+            raise erro
+        pendentes = [horario for horario in pendentes if horario not in ocupados]
+        novos = [
+            Agendamento(id_usuario=id_usuario, data=data, hora=hora)
+            for data, hora in pendentes
+        ]
+        try:
+            with session.begin_nested():
+                session.add_all(novos)
+        except IntegrityError as exc:
+            erro = exc
+        else:
+            break
+    if novos:
+        registrar_alteracao(session, id_usuario)
+    return {(a.data, a.hora): a.id for a in novos}
+
+
+def cadastrar_usuario(session: Session, usuario: UserSchema) -> UserPublic | None:
+    """Cria o usuário e o primeiro pagamento numa única transação.
+
+    O flush obtém o id do usuário (via RETURNING onde o dialeto suporta)
+    para o pagamento entrar no mesmo commit. Devolve None se o email já
+    estiver cadastrado, detectado pela restrição única de ``users.email``.
+    """
+    primeiro_vencimento = date.today()
+    novo_usuario = User(
+        nome=usuario.nome,
+        email=usuario.email,
+        senha=usuario.senha,
+        pagamento_status='Atrasado',
+        pagamento_vencimento=primeiro_vencimento,
+    )
+    session.add(novo_usuario)
+    try:
+        session.flush()
+    except IntegrityError:
+        session.rollback()
+        return None
+
+    primeiro_pagamento = Pagamento(
+        id_usuario=novo_usuario.id,
+        data_vencimento=primeiro_vencimento,
+        status='Atrasado',
+    )
+    session.add(primeiro_pagamento)
+    session.flush()
+    novo_usuario.pagamento_atual_id = primeiro_pagamento.id
+    registrar_alteracao(session)
+
+    # Monta a resposta antes do commit para não recarregar o usuário depois
+    resposta = UserPublic(
+        id=novo_usuario.id,
+        nome=novo_usuario.nome,
+        email=novo_usuario.email,
+        is_admin=novo_usuario.is_admin,
+        status_pagamento=novo_usuario.pagamento_status,
+        data_proximo_vencimento=novo_usuario.pagamento_vencimento,
+    )
+    session.commit()
+    return resposta
+
+
+def registrar_comprovante(
+    session: Session, sha256: str, tamanho: int, mime: str
+) -> None:
+    """Grava os dados do comprovante, se o conteúdo ainda não existir.
+
+    Dois envios simultâneos do mesmo arquivo disputam a chave primária:
+    com ON CONFLICT DO NOTHING o segundo não insere nada; nos demais
+    dialetos o INSERT vai num savepoint e a violação é descartada. O
+    commit fica a cargo de quem chama.
+    """
+    valores = {'sha256': sha256, 'tamanho': tamanho, 'mime': mime}
+    dialeto = session.get_bind().dialect
+    if dialeto.name in _INSERT_COM_CONFLITO:
+        insert_do_dialeto = import_module(f'sqlalchemy.dialects.{dialeto.name}').insert
+        session.execute(
+            insert_do_dialeto(Comprovante)
+            .values(valores)
+            .on_conflict_do_nothing(index_elements=['sha256'])
+        )
+        return
+    try:
+        with session.begin_nested():
+            session.execute(insert(Comprovante).values(valores))
+    except IntegrityError:
+        pass
+
+
+def status_pelo_vencimento(data_vencimento: date) -> str:
+    """Status de um pagamento em aberto: a mesma regra da varredura."""
+    return 'Atrasado' if data_vencimento < date.today() else 'Em dia'
+
+
+def definir_pagamento_atual(session: Session, pagamento: Pagamento) -> None:
+    """Torna ``pagamento`` o pagamento atual do usuário (campos em ``users``).
+
+    O pagamento precisa ter id, ou seja, já ter passado por um flush. Um
+    'Em dia' já vencido é gravado como 'Atrasado', sem esperar a varredura.
+    """
+    if pagamento.status == 'Em dia':
+        pagamento.status = status_pelo_vencimento(pagamento.data_vencimento)
+    session.execute(
+        update(User)
+        .where(User.id == pagamento.id_usuario)
+        .values(
+            pagamento_atual_id=pagamento.id,
+            pagamento_status=pagamento.status,
+            pagamento_vencimento=pagamento.data_vencimento,
+        )
+    )
+    registrar_alteracao(session, pagamento.id_usuario)
+
+
+def alterar_status_pagamento(
+    session: Session, pagamento: Pagamento, novo_status: str
+) -> None:
+    """Altera o status e, se for o pagamento atual, a cópia em ``users``."""
+    pagamento.status = novo_status
+    session.execute(
+        update(User)
+        .where(User.pagamento_atual_id == pagamento.id)
+        .values(pagamento_status=novo_status)
+    )
+    registrar_alteracao(session, pagamento.id_usuario)
+
+
+def ler_csv(arquivo: BinaryIO) -> Iterator[tuple[int, dict]]:
+    """Lê o CSV (com cabeçalho) linha a linha, devolvendo (linha, dados)."""
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    leitor = csv.DictReader(texto)
+    for dados in leitor:
+        yield leitor.line_num, dados
+
+
+def ler_ndjson(arquivo: BinaryIO) -> Iterator[tuple[int, dict]]:
+    """Lê um objeto JSON por linha, devolvendo (linha, dados)."""
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig')
+    for numero, conteudo in enumerate(texto, start=1):
+        if not conteudo.strip():
+            continue
+        try:
+            dados = json.loads(conteudo)
+        except json.JSONDecodeError:
+            dados = None
+        yield numero, dados if isinstance(dados, dict) else None
+
+
+def importar_usuarios(
+    session: Session, linhas: Iterable[tuple[int, dict | None]]
+) -> ImportacaoResultado:
+    """Cadastra usuários em lotes, cada um com o primeiro pagamento.
+
+    Cada lote de ``LOTE_IMPORTACAO`` linhas custa uma consulta ``IN`` pelos
+    emails já existentes, um INSERT de usuários, um de pagamentos e um
+    commit; a memória usada não depende do tamanho do arquivo.
+    """
+    resultado = ImportacaoResultado(criados=0, erros=[], erros_omitidos=0)
+
+    def registrar_erro(linha: int, email: str | None, erro: str) -> None:
+        if len(resultado.erros) < ERROS_RELATADOS:
+            resultado.erros.append(
+                ErroImportacao(linha=linha, email=email, erro=erro)
+            )
+        else:
+            resultado.erros_omitidos += 1
+
+    linhas = iter(linhas)
+    ultima_lida = 0
+    while True:
+        bloco, erro_leitura = _proximo_bloco(linhas)
+        if bloco:
+            ultima_lida = bloco[-1][0]
+            resultado.criados += _importar_bloco(session, bloco, registrar_erro)
+        if erro_leitura is not None:
+            # A leitura para aqui; as linhas lidas antes já foram gravadas
+            registrar_erro(ultima_lida + 1, None, f'Arquivo inválido: {erro_leitura}')
+            break
+        if len(bloco) < LOTE_IMPORTACAO:
+            break
+
+    resultado.erros.sort(key=lambda erro: erro.linha)
+    return resultado
+
+
+def _proximo_bloco(
+    linhas: Iterator[tuple[int, dict | None]],
+) -> tuple[list[tuple[int, dict | None]], Exception | None]:
+    """Até ``LOTE_IMPORTACAO`` linhas, lidas uma a uma.
+
+    Um erro de leitura do arquivo encerra o bloco e é devolvido junto com
+    as linhas lidas antes dele, que continuam sendo importadas.
+    """
+    bloco = []
+    try:
+        for linha in linhas:
+            bloco.append(linha)
+            if len(bloco) == LOTE_IMPORTACAO:
+                break
+    except (csv.Error, UnicodeDecodeError) as erro:
+        return bloco, erro
+    return bloco, None
+
+
+def _importar_bloco(
+    session: Session,
+    bloco: list[tuple[int, dict | None]],
+    registrar_erro: Callable[[int, str | None, str], None],
+) -> int:
+    validos: dict[str, tuple[int, UserSchema]] = {}
+    for numero, dados in bloco:
+        try:
+            usuario = UserSchema.model_validate(dados)
+        except ValidationError as erro:
+            campos = ', '.join(
+                str(e['loc'][0]) if e['loc'] else 'linha'
+                for e in erro.errors()
+            )
+            registrar_erro(numero, None, f'Dados inválidos: {campos}')
+            continue
+        if usuario.email in validos:
+            registrar_erro(numero, usuario.email, 'Email repetido no arquivo')
+            continue
+        validos[usuario.email] = (numero, usuario)
+
+    existentes = set(
+        session.scalars(select(User.email).where(User.email.in_(validos)))
+    )
+    for email in existentes:
+        registrar_erro(validos.pop(email)[0], email, 'Email já cadastrado')
+
+    return _inserir_lote_usuarios(session, list(validos.values()), registrar_erro)
+
+
+def _inserir_lote_usuarios(
+    session: Session,
+    usuarios: list[tuple[int, UserSchema]],
+    registrar_erro: Callable[[int, str | None, str], None],
+) -> int:
+    if not usuarios:
+        return 0
+    primeiro_vencimento = date.today()
+    try:
+        ids = session.scalars(
+            insert(User).returning(User.id),
+            [
+                {
+                    'nome': u.nome,
+                    'email': u.email,
+                    'senha': u.senha,
+                    'is_admin': False,
+                    'pagamento_status': 'Atrasado',
+                    'pagamento_vencimento': primeiro_vencimento,
+                }
+                for _, u in usuarios
+            ],
+        ).all()
+        pagamentos = session.execute(
+            insert(Pagamento).returning(Pagamento.id, Pagamento.id_usuario),
+            [
+                {
+                    'id_usuario': id_usuario,
+                    'data_vencimento': primeiro_vencimento,
+                    'status': 'Atrasado',
+                }
+                for id_usuario in ids
+            ],
+        ).all()
+        # UPDATE em lote pela chave primária com o ponteiro de cada usuário
+        session.execute(
+            update(User),
+            [
+                {'id': id_usuario, 'pagamento_atual_id': id_pagamento}
+                for id_pagamento, id_usuario in pagamentos
+            ],
+        )
+        registrar_alteracao(session)
+        session.commit()
+        return len(ids)
+    except IntegrityError:
+        # Alguém cadastrou um dos emails no meio do caminho: refaz o lote
+        # um a um para salvar os demais
+        session.rollback()
+        criados = 0
+        for numero, usuario in usuarios:
+            if cadastrar_usuario(session, usuario) is None:
+                registrar_erro(numero, usuario.email, 'Email já cadastrado')
+            else:
+                criados += 1
+        return criados
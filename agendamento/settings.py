@@ -1,3 +1,5 @@
+from functools import cache
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -10,3 +12,60 @@ class Settings(BaseSettings):
     SECRET_KEY: str
     ALGORITHM: str
     ACCESS_TOKEN_EXPIRE_HOURS: int
+
+    # Pool de conexões (ignorado no SQLite em memória). O limitador de
+    # threads das rotas e as vagas de requisições no banco seguem
+    # DB_POOL_SIZE + DB_MAX_OVERFLOW (pool.py); THREADPOOL_TOKENS só pode
+    # reduzi-los
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30
+    THREADPOOL_TOKENS: int | None = None
+
+    # Processos do servidor (gunicorn.conf.py). Cada worker tem seus pools,
+    # então o banco recebe até WORKERS * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    # conexões
+    WORKERS: int = 1
+    # Com WORKERS > 1, por quanto tempo cada worker confia no seu índice de
+    # disponibilidade (availability.py) antes de reler a data do banco
+    DISPONIBILIDADE_TTL_SEGUNDOS: float = 10
+
+    # Rotas async def sobre create_async_engine (asyncpg / aiosqlite), em vez
+    # de rotas síncronas no limitador de threads (async_routes.py)
+    DB_ASYNC: bool = False
+
+    # SQLite em arquivo (database.py): PRAGMAs aplicados a cada conexão
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_MMAP_BYTES: int = 256 * 1024 * 1024
+    SQLITE_CACHE_KIB: int = 64 * 1024
+
+    # Diretório do armazém de comprovantes de pagamento
+    COMPROVANTES_DIR: str = 'comprovantes'
+
+    # Cache dos usuários autenticados (security.py)
+    AUTH_CACHE_TTL_SEGUNDOS: float = 60
+    # Com WORKERS > 1 o cache é de cada worker e a remoção de um usuário só
+    # o invalida no worker que a atendeu; nos outros a entrada dura até isto
+    AUTH_CACHE_TTL_WORKERS_SEGUNDOS: float = 5
+    AUTH_CACHE_CAPACIDADE: int = 10_000
+    # Rotas somente leitura usam as claims do JWT sem consultar o banco
+    AUTH_CONFIAR_CLAIMS: bool = False
+
+    # Intervalo da varredura de pagamentos atrasados (0 desativa)
+    VARREDURA_INTERVALO_SEGUNDOS: float = 3600
+
+    # Token exigido em /metrics (Authorization: Bearer); sem ele a rota
+    # recusa toda requisição
+    METRICAS_TOKEN: str | None = None
+
+    # Registro de consultas lentas (query_log.py) e /admin/diagnostics/queries
+    CONSULTAS_LENTAS_ATIVO: bool = False
+    CONSULTAS_LENTAS_LIMITE_MS: float = 200
+    # Execuções recentes de cada consulta consideradas no p95
+    CONSULTAS_LENTAS_JANELA: int = 500
+
+
+@cache
+def get_settings() -> Settings:
+    """Settings do processo, lidas do ambiente e do ``.env`` uma vez só."""
+    return Settings()
@@ -0,0 +1,111 @@
+"""Varredura dos pagamentos vencidos.
+
+Os pagamentos 'Em dia' cujo vencimento já passou viram 'Atrasado' com um
+único UPDATE, apoiado no índice de ``pagamentos.data_vencimento``. As
+rotas de leitura só leem o status gravado.
+
+Roda em segundo plano dentro da aplicação (``VARREDURA_INTERVALO_SEGUNDOS``)
+e também pela linha de comando::
+
+    python -m agendamento.sweeper
+"""
+
+import logging
+import threading
+from collections.abc import Callable
+from datetime import date
+
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from agendamento.database import nova_sessao
+from agendamento.models import Pagamento, User
+from agendamento.services import registrar_alteracao
+
+logger = logging.getLogger(__name__)
+
+
+def varrer_pagamentos_atrasados(
+    session: Session, hoje: date | None = None
+) -> int:
+    """Marca como 'Atrasado' os pagamentos vencidos e devolve quantos."""
+    hoje = hoje or date.today()
+    vencidos = (Pagamento.status == 'Em dia', Pagamento.data_vencimento < hoje)
+    # Versão dos donos antes do UPDATE, enquanto o filtro ainda os encontra
+    session.execute(
+        update(User)
+        .where(User.id.in_(select(Pagamento.id_usuario).where(*vencidos)))
+        .values(versao=User.versao + 1)
+        .execution_options(synchronize_session=False)
+    )
+    resultado = session.execute(
+        update(Pagamento)
+        .where(*vencidos)
+        .values(status='Atrasado')
+        .execution_options(synchronize_session=False)
+    )
+    # Mantém a cópia do pagamento atual em users na mesma transação
+    session.execute(
+        update(User)
+        .where(
+            User.pagamento_status == 'Em dia', User.pagamento_vencimento < hoje
+        )
+        .values(pagamento_status='Atrasado')
+        .execution_options(synchronize_session=False)
+    )
+    if resultado.rowcount:
+        registrar_alteracao(session)
+    session.commit()
+    return resultado.rowcount
+
+
+class VarredorPagamentos:
+    """Executa a varredura a cada ``intervalo`` segundos numa thread.
+
+    As sessões vêm de ``fabrica_sessao``; por padrão, do banco configurado.
+    """
+
+    def __init__(
+        self,
+        intervalo: float,
+        fabrica_sessao: Callable[[], Session] = nova_sessao,
+    ):
+        self.intervalo = intervalo
+        self.fabrica_sessao = fabrica_sessao
+        self._parar = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def iniciar(self) -> None:
+        if self.intervalo <= 0 or self._thread is not None:
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(
+            target=self._executar, name='varredor-pagamentos', daemon=True
+        )
+        self._thread.start()
+
+    def parar(self) -> None:
+        self._parar.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _executar(self) -> None:
+        # A primeira varredura é imediata: cobre o tempo em que a
+        # aplicação ficou fora do ar
+        while True:
+            try:
+                with self.fabrica_sessao() as session:
+                    atualizados = varrer_pagamentos_atrasados(session)
+                if atualizados:
+                    logger.info('%d pagamento(s) marcados como atrasados', atualizados)
+            except SQLAlchemyError:
+                logger.warning('Falha na varredura de pagamentos atrasados')
+            if self._parar.wait(self.intervalo):
+                return
+
+
+if __name__ == '__main__':
+    with nova_sessao() as session:
+        print(f'{varrer_pagamentos_atrasados(session)} pagamento(s) atualizados')
@@ -0,0 +1,633 @@
+"""Benchmark de todas as rotas de ``app.py`` sobre um banco populado.
+
+Sobe a aplicação em processo com ``TestClient`` (como ``tests/conftest.py``,
+trocando ``get_session`` e o armazém de comprovantes), popula o banco com
+``--volume`` usuários, agendamentos e pagamentos e chama cada rota
+``--requisicoes`` vezes. O relatório em JSON traz, por rota, p50/p95/p99,
+média, requisições por segundo, consultas ao banco por requisição e os
+status recebidos::
+
+    python -m benchmarks.endpoints --volume 10000 --saida base.json
+    python -m benchmarks.endpoints --volume 10000 --comparar base.json
+
+Para comparar o caminho assíncrono, rode de novo com ``DB_ASYNC=true`` no
+ambiente e ``--comparar`` contra o relatório síncrono.
+
+Sem ``--database-url`` usa um SQLite temporário. Com uma URL (por exemplo
+um Postgres local) as tabelas são apagadas e recriadas: use um banco
+descartável. ``--comparar`` sai com código 1 se alguma rota piorou o p95
+além da ``--tolerancia`` ou passou a fazer mais consultas.
+"""
+
+import argparse
+import io
+import json
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from datetime import time as hora_do_dia
+from itertools import islice
+from pathlib import Path
+from typing import Any
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlalchemy import Engine, create_engine, event, insert, select
+from sqlalchemy.orm import Session
+
+from agendamento.app import app
+from agendamento.consistency import corrigir_pagamento_atual
+from agendamento.database import (
+    criar_engines,
+    get_session,
+    get_session_async,
+    nova_sessao_async,
+    settings,
+)
+from agendamento.models import (
+    Agendamento,
+    Comprovante,
+    Pagamento,
+    User,
+    table_registry,
+)
+from agendamento.receipts import ArmazemComprovantes, get_armazem_comprovantes
+from agendamento.security import criar_token
+
+# Linhas por INSERT ao popular o banco
+LOTE_CARGA = 10_000
+# Horários por dia na grade de availability.HORARIOS
+HORARIOS_POR_DIA = 10
+TOLERANCIA_PADRAO = 0.2
+
+
+@dataclass
+class Contexto:
+    client: TestClient
+    engine: Engine
+    volume: int
+    admin: dict[str, str]
+    aluno: dict[str, str]
+    metricas: dict[str, str]
+    aluno_id: int
+    pagamentos: list[int]
+    pagamento_com_comprovante: int
+    # Próximo dia livre para agendamentos criados pelo benchmark
+    _dia: date = field(default_factory=date.today)
+    _hora: int = 0
+
+    def proximo_horario(self) -> tuple[str, str]:
+        if self._hora == HORARIOS_POR_DIA:
+            self._dia += timedelta(days=1)
+            self._hora = 0
+        horario = hora_do_dia(8 + self._hora)
+        self._hora += 1
+        return self._dia.isoformat(), horario.isoformat()
+
+    def proximos_dias(self, quantidade: int) -> list[str]:
+        inicio = self._dia + timedelta(days=1)
+        self._dia = inicio + timedelta(days=quantidade)
+        self._hora = 0
+        return [
+            (inicio + timedelta(days=i)).isoformat() for i in range(quantidade)
+        ]
+
+    def inserir_usuario(self, email: str) -> int:
+        with Session(self.engine) as session:
+            usuario = User(nome='Temporário', email=email, senha='x')
+            session.add(usuario)
+            session.commit()
+            return usuario.id
+
+
+@dataclass
+class Cenario:
+    metodo: str
+    caminho: str
+    executar: Callable[[Contexto, Any], Any]
+    # Roda fora da medição e devolve o que ``executar`` recebe
+    preparar: Callable[[Contexto, int], Any] = lambda ctx, i: i
+
+
+CENARIOS: list[Cenario] = []
+
+
+def cenario(metodo: str, caminho: str, preparar=None):
+    def registrar(executar):
+        CENARIOS.append(
+            Cenario(metodo, caminho, executar, preparar or Cenario.preparar)
+        )
+        return executar
+
+    return registrar
+
+
+def _agendar_aluno(ctx: Contexto, i: int) -> int:
+    data, hora = ctx.proximo_horario()
+    return ctx.client.post(
+        '/agendar', headers=ctx.aluno, json={'data': data, 'hora': hora}
+    ).json()['id']
+
+
+@cenario('GET', '/')
+def _raiz(ctx, i):
+    return ctx.client.get('/')
+
+
+@cenario('GET', '/metrics')
+def _metricas(ctx, i):
+    return ctx.client.get('/metrics', headers=ctx.metricas)
+
+
+@cenario('POST', '/registrar')
+def _registrar(ctx, i):
+    return ctx.client.post(
+        '/registrar',
+        json={'nome': 'Novo', 'email': f'novo{i}@bench.example.com', 'senha': 'x'},
+    )
+
+
+@cenario('POST', '/login')
+def _login(ctx, i):
+    return ctx.client.post(
+        '/login', json={'email': 'aluno@bench.example.com', 'senha': 'senha'}
+    )
+
+
+@cenario('GET', '/horarios-disponiveis')
+def _horarios_periodo(ctx, i):
+    inicio = date.today() + timedelta(days=i % 30)
+    fim = inicio + timedelta(days=30)
+    return ctx.client.get(
+        f'/horarios-disponiveis?inicio={inicio}&fim={fim}', headers=ctx.aluno
+    )
+
+
+@cenario('GET', '/horarios-disponiveis/{data}')
+def _horarios_dia(ctx, i):
+    data = date.today() + timedelta(days=i % 60)
+    return ctx.client.get(f'/horarios-disponiveis/{data}', headers=ctx.aluno)
+
+
+@cenario('POST', '/agendar', preparar=lambda ctx, i: ctx.proximo_horario())
+def _agendar(ctx, horario):
+    data, hora = horario
+    return ctx.client.post(
+        '/agendar', headers=ctx.aluno, json={'data': data, 'hora': hora}
+    )
+
+
+@cenario('GET', '/meus-agendamentos')
+def _meus_agendamentos(ctx, i):
+    return ctx.client.get('/meus-agendamentos', headers=ctx.aluno)
+
+
+@cenario(
+    'DELETE', '/cancelar-agendamento/{agendamento_id}', preparar=_agendar_aluno
+)
+def _cancelar(ctx, agendamento_id):
+    return ctx.client.delete(
+        f'/cancelar-agendamento/{agendamento_id}', headers=ctx.aluno
+    )
+
+
+@cenario('GET', '/pagamento/status')
+def _status_pagamento(ctx, i):
+    return ctx.client.get('/pagamento/status', headers=ctx.aluno)
+
+
+@cenario('POST', '/pagamento/comprovante')
+def _enviar_comprovante(ctx, i):
+    conteudo = b'%PDF-1.4 ' + str(i).encode() * 1024
+    return ctx.client.post(
+        '/pagamento/comprovante',
+        headers=ctx.aluno,
+        files={'arquivo': ('comprovante.pdf', conteudo, 'application/pdf')},
+    )
+
+
+@cenario('GET', '/admin/usuarios')
+def _listar_usuarios(ctx, i):
+    after_id = i * 37 % ctx.volume
+    return ctx.client.get(
+        f'/admin/usuarios?after_id={after_id}&limit=100', headers=ctx.admin
+    )
+
+
+@cenario('POST', '/admin/usuarios')
+def _criar_usuario(ctx, i):
+    return ctx.client.post(
+        '/admin/usuarios',
+        headers=ctx.admin,
+        json={'nome': 'Novo', 'email': f'admin-novo{i}@bench.example.com', 'senha': 'x'},
+    )
+
+
+@cenario('POST', '/admin/usuarios/importar')
+def _importar_usuarios(ctx, i):
+    linhas = ''.join(
+        f'Importado,importado{i}-{j}@bench.example.com,x\n' for j in range(10)
+    )
+    return ctx.client.post(
+        '/admin/usuarios/importar',
+        headers=ctx.admin,
+        files={'arquivo': ('usuarios.csv', f'nome,email,senha\n{linhas}', 'text/csv')},
+    )
+
+
+@cenario(
+    'POST',
+    '/admin/agendar',
+    preparar=lambda ctx, i: ctx.proximo_horario(),
+)
+def _agendar_admin(ctx, horario):
+    data, hora = horario
+    return ctx.client.post(
+        '/admin/agendar',
+        headers=ctx.admin,
+        json={'id_usuario': ctx.aluno_id, 'data': data, 'hora': hora},
+    )
+
+
+@cenario(
+    'POST', '/admin/agendar/lote', preparar=lambda ctx, i: ctx.proximos_dias(8)
+)
+def _agendar_lote(ctx, datas):
+    return ctx.client.post(
+        '/admin/agendar/lote',
+        headers=ctx.admin,
+        json={'id_usuario': ctx.aluno_id, 'hora': '09:00:00', 'datas': datas},
+    )
+
+
+@cenario('GET', '/admin/agendamentos')
+def _listar_agendamentos(ctx, i):
+    inicio = date.today() - timedelta(days=i % 30)
+    fim = inicio + timedelta(days=30)
+    return ctx.client.get(
+        f'/admin/agendamentos?inicio={inicio}&fim={fim}', headers=ctx.admin
+    )
+
+
+@cenario(
+    'DELETE', '/admin/agendamentos/{agendamento_id}', preparar=_agendar_aluno
+)
+def _remover_agendamento(ctx, agendamento_id):
+    return ctx.client.delete(
+        f'/admin/agendamentos/{agendamento_id}', headers=ctx.admin
+    )
+
+
+@cenario('GET', '/admin/usuarios/{user_id}/pagamentos')
+def _pagamentos_usuario(ctx, i):
+    return ctx.client.get(
+        f'/admin/usuarios/{i % ctx.volume + 3}/pagamentos', headers=ctx.admin
+    )
+
+
+@cenario('GET', '/admin/pagamentos/atrasados')
+def _pagamentos_atrasados(ctx, i):
+    return ctx.client.get('/admin/pagamentos/atrasados', headers=ctx.admin)
+
+
+@cenario('GET', '/admin/pagamentos/{pagamento_id}/comprovante')
+def _ver_comprovante(ctx, i):
+    return ctx.client.get(
+        f'/admin/pagamentos/{ctx.pagamento_com_comprovante}/comprovante',
+        headers=ctx.admin,
+    )
+
+
+@cenario(
+    'PATCH',
+    '/admin/pagamentos/{pagamento_id}/aprovar',
+    preparar=lambda ctx, i: ctx.pagamentos[i % len(ctx.pagamentos)],
+)
+def _aprovar(ctx, pagamento_id):
+    return ctx.client.patch(
+        f'/admin/pagamentos/{pagamento_id}/aprovar', headers=ctx.admin
+    )
+
+
+@cenario(
+    'PATCH',
+    '/admin/pagamentos/{pagamento_id}/recusar',
+    preparar=lambda ctx, i: ctx.pagamentos[-(i % len(ctx.pagamentos)) - 1],
+)
+def _recusar(ctx, pagamento_id):
+    return ctx.client.patch(
+        f'/admin/pagamentos/{pagamento_id}/recusar', headers=ctx.admin
+    )
+
+
+@cenario('GET', '/admin/diagnostics/queries')
+def _diagnostico_consultas(ctx, i):
+    return ctx.client.get('/admin/diagnostics/queries', headers=ctx.admin)
+
+
+# Por último: a remoção de usuário descarta o índice de disponibilidade
+@cenario(
+    'DELETE',
+    '/admin/usuarios/{user_id}',
+    preparar=lambda ctx, i: ctx.inserir_usuario(f'remover{i}@bench.example.com'),
+)
+def _remover_usuario(ctx, user_id):
+    return ctx.client.delete(f'/admin/usuarios/{user_id}', headers=ctx.admin)
+
+
+def rotas_sem_cenario() -> list[str]:
+    """Rotas de ``app`` que nenhum cenário chama."""
+    cobertas = {(c.metodo, c.caminho) for c in CENARIOS}
+    return [
+        f'{metodo} {rota.path}'
+        for rota in app.routes
+        if isinstance(rota, APIRoute)
+        for metodo in sorted(rota.methods)
+        if (metodo, rota.path) not in cobertas
+    ]
+
+
+def _em_lotes(linhas):
+    linhas = iter(linhas)
+    while lote := list(islice(linhas, LOTE_CARGA)):
+        yield lote
+
+
+def popular(
+    engine: Engine, volume: int, armazem: ArmazemComprovantes
+) -> dict[str, Any]:
+    """Cria admin, aluno e ``volume`` usuários, agendamentos e pagamentos."""
+    hoje = date.today()
+    sha256, tamanho = armazem.salvar(io.BytesIO(b'%PDF-1.4 benchmark'))
+    with Session(engine) as session:
+        session.add_all([
+            User(
+                nome='Admin',
+                email='admin@bench.example.com',
+                senha='senha',
+                is_admin=True,
+            ),
+            User(nome='Aluno', email='aluno@bench.example.com', senha='senha'),
+        ])
+        session.add(Comprovante(sha256=sha256, tamanho=tamanho, mime='application/pdf'))
+        session.commit()
+
+        for lote in _em_lotes(
+            {
+                'nome': f'Usuário {i}',
+                'email': f'usuario{i}@bench.example.com',
+                'senha': 'x',
+            }
+            for i in range(volume)
+        ):
+            session.execute(insert(User), lote)
+
+        # Um pagamento por usuário: um terço atrasado, um terço em dia e um
+        # terço aguardando confirmação (com comprovante)
+        status = ('Atrasado', 'Em dia', 'Aguardando confirmação')
+        for lote in _em_lotes(
+            {
+                'id_usuario': id_usuario,
+                'data_vencimento': hoje + timedelta(days=id_usuario % 60 - 30),
+                'status': status[id_usuario % 3],
+                'comprovante_sha256': sha256
+                if status[id_usuario % 3] == 'Aguardando confirmação'
+                else None,
+            }
+            for id_usuario in range(2, volume + 3)
+        ):
+            session.execute(insert(Pagamento), lote)
+
+        # Agendamentos distribuídos em volta de hoje, um por horário; o
+        # aluno fica com um em cada cem
+        dias_ocupados = volume // HORARIOS_POR_DIA + 1
+        primeiro_dia = hoje - timedelta(days=dias_ocupados // 2)
+        for lote in _em_lotes(
+            {
+                'id_usuario': 2 if i % 100 == 0 else i % volume + 3,
+                'data': primeiro_dia + timedelta(days=i // HORARIOS_POR_DIA),
+                'hora': hora_do_dia(8 + i % HORARIOS_POR_DIA),
+            }
+            for i in range(volume)
+        ):
+            session.execute(insert(Agendamento), lote)
+        session.commit()
+        corrigir_pagamento_atual(session)
+
+        pagamentos = list(
+            session.scalars(select(Pagamento.id).order_by(Pagamento.id).limit(1000))
+        )
+        com_comprovante = session.scalar(
+            select(Pagamento.id)
+            .where(Pagamento.comprovante_sha256.is_not(None))
+            .limit(1)
+        )
+
+    return {
+        'pagamentos': pagamentos,
+        'pagamento_com_comprovante': com_comprovante,
+        'primeiro_dia_livre': primeiro_dia + timedelta(days=dias_ocupados + 1),
+    }
+
+
+class ContadorConsultas:
+    """Conta os comandos enviados ao banco pelos ``engines``."""
+
+    def __init__(self, *engines: Engine):
+        self.total = 0
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._contar)
+
+    def _contar(self, *args) -> None:
+        self.total += 1
+
+
+def _medir(
+    ctx: Contexto,
+    contador: ContadorConsultas,
+    c: Cenario,
+    requisicoes: int,
+    aquecimento: int,
+) -> dict[str, Any]:
+    amostras, status, consultas = [], Counter(), 0
+    for i in range(aquecimento + requisicoes):
+        dado = c.preparar(ctx, i)
+        antes = contador.total
+        inicio = time.perf_counter()
+        resposta = c.executar(ctx, dado)
+        duracao = time.perf_counter() - inicio
+        if i < aquecimento:
+            continue
+        amostras.append(duracao)
+        consultas += contador.total - antes
+        status[resposta.status_code] += 1
+    return {
+        **_percentis(amostras),
+        'req_por_s': round(len(amostras) / sum(amostras), 1),
+        'consultas_por_req': round(consultas / len(amostras), 2),
+        'status': {str(k): v for k, v in sorted(status.items())},
+    }
+
+
+def _percentis(amostras: list[float]) -> dict[str, float]:
+    if len(amostras) > 1:
+        cortes = statistics.quantiles(amostras, n=100, method='inclusive')
+        p50, p95, p99 = cortes[49], cortes[94], cortes[98]
+    else:
+        p50 = p95 = p99 = amostras[0]
+    return {
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'p99_ms': round(p99 * 1000, 3),
+        'media_ms': round(statistics.fmean(amostras) * 1000, 3),
+    }
+
+
+def executar(
+    database_url: str | None,
+    volume: int,
+    requisicoes: int,
+    aquecimento: int = 3,
+) -> dict[str, Any]:
+    """Popula o banco, mede todas as rotas e devolve o relatório."""
+    with tempfile.TemporaryDirectory() as tmp:
+        url = database_url or f'sqlite:///{Path(tmp) / "benchmark.db"}'
+        engine = create_engine(
+            url,
+            connect_args={'check_same_thread': False}
+            if url.startswith('sqlite')
+            else {},
+        )
+        table_registry.metadata.drop_all(engine)
+        table_registry.metadata.create_all(engine)
+
+        # Com DB_ASYNC as rotas usam get_session_async (async_routes.py)
+        engines_async = criar_engines(url, assincrono=True) if settings.DB_ASYNC else ()
+        contador = ContadorConsultas(
+            engine, *dict.fromkeys(e.sync_engine for e in engines_async)
+        )
+        armazem = ArmazemComprovantes(Path(tmp) / 'comprovantes')
+        carga = popular(engine, volume, armazem)
+
+        def get_session_benchmark():
+            with Session(engine) as session:
+                yield session
+
+        async def get_session_async_benchmark():
+            async with nova_sessao_async(*engines_async) as session:
+                yield session
+
+        app.dependency_overrides[get_session] = get_session_benchmark
+        app.dependency_overrides[get_session_async] = get_session_async_benchmark
+        app.dependency_overrides[get_armazem_comprovantes] = lambda: armazem
+        # /metrics exige o token; sem um configurado, usa um só desta execução
+        token_metricas = settings.METRICAS_TOKEN
+        settings.METRICAS_TOKEN = token_metricas or 'benchmark'
+        rotas = {}
+        try:
+            with TestClient(app) as client:
+                ctx = Contexto(
+                    client=client,
+                    engine=engine,
+                    volume=volume,
+                    admin={'Authorization': f'Bearer {_token(1, True)}'},
+                    aluno={'Authorization': f'Bearer {_token(2, False)}'},
+                    metricas={
+                        'Authorization': f'Bearer {settings.METRICAS_TOKEN}'
+                    },
+                    aluno_id=2,
+                    pagamentos=carga['pagamentos'],
+                    pagamento_com_comprovante=carga['pagamento_com_comprovante'],
+                    _dia=carga['primeiro_dia_livre'],
+                )
+                for c in CENARIOS:
+                    rotas[f'{c.metodo} {c.caminho}'] = _medir(
+                        ctx, contador, c, requisicoes, aquecimento
+                    )
+                # No mesmo event loop que abriu as conexões
+                for engine_async in dict.fromkeys(engines_async):
+                    client.portal.call(engine_async.dispose)
+        finally:
+            app.dependency_overrides.clear()
+            settings.METRICAS_TOKEN = token_metricas
+            table_registry.metadata.drop_all(engine)
+            engine.dispose()
+
+    return {
+        'meta': {
+            'banco': engine.dialect.name,
+            'async': settings.DB_ASYNC,
+            'volume': volume,
+            'requisicoes': requisicoes,
+        },
+        'rotas': rotas,
+        'rotas_sem_cenario': rotas_sem_cenario(),
+    }
+
+
+def _token(user_id: int, is_admin: bool) -> str:
+    return criar_token({
+        'user_id': user_id,
+        'email': 'admin@bench.example.com' if is_admin else 'aluno@bench.example.com',
+        'is_admin': is_admin,
+    })
+
+
+def comparar(
+    atual: dict, base: dict, tolerancia: float = TOLERANCIA_PADRAO
+) -> list[str]:
+    """Regressões de ``atual`` em relação a ``base``, uma por linha."""
+    regressoes = []
+    for rota, medidas in atual['rotas'].items():
+        anterior = base['rotas'].get(rota)
+        if anterior is None:
+            continue
+        if medidas['p95_ms'] > anterior['p95_ms'] * (1 + tolerancia):
+            regressoes.append(
+                f'{rota}: p95 {anterior["p95_ms"]} -> {medidas["p95_ms"]} ms'
+            )
+        if medidas['consultas_por_req'] > anterior['consultas_por_req']:
+            regressoes.append(
+                f'{rota}: consultas {anterior["consultas_por_req"]}'
+                f' -> {medidas["consultas_por_req"]}'
+            )
+    return regressoes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url')
+    parser.add_argument('--volume', type=int, default=1000)
+    parser.add_argument('--requisicoes', type=int, default=200)
+    parser.add_argument('--saida', type=Path, help='grava o relatório JSON')
+    parser.add_argument('--comparar', type=Path, help='relatório base')
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA_PADRAO)
+    args = parser.parse_args()
+
+    relatorio = executar(args.database_url, args.volume, args.requisicoes)
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        args.saida.write_text(texto, encoding='utf-8')
+    print(texto)
+
+    if relatorio['rotas_sem_cenario']:
+        print(
+            'Rotas sem cenário: ' + ', '.join(relatorio['rotas_sem_cenario']),
+            file=sys.stderr,
+        )
+    if args.comparar:
+        base = json.loads(args.comparar.read_text(encoding='utf-8'))
+        regressoes = comparar(relatorio, base, args.tolerancia)
+        for regressao in regressoes:
+            print(f'REGRESSÃO {regressao}', file=sys.stderr)
+        if regressoes:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Custo por linha da serialização das listagens, antes e depois.
+
+Compara, sobre as mesmas linhas lidas de um SQLite em memória:
+
+- ``antes``: a rota monta os schemas em Python e o FastAPI valida e
+  serializa de novo pelo ``response_model`` (``serialize_response`` +
+  ``JSONResponse``), como as listagens faziam;
+- ``depois``: ``serialization.resposta_json`` direto das linhas, sem
+  validação.
+
+Uso::
+
+    python -m benchmarks.serializacao [--linhas 5000] [--repeticoes 20]
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from datetime import date, timedelta
+from datetime import time as hora
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import Session
+
+from agendamento.app import app
+from agendamento.models import Agendamento, User, table_registry
+from agendamento.schemas import AgendamentoList, AgendamentoPublico, UserList, UserPublic
+from agendamento.serialization import linhas_como_dicts, resposta_json
+
+
+def _popular(session: Session, linhas: int) -> None:
+    session.execute(
+        insert(User),
+        [
+            {
+                'nome': f'Usuário {i}',
+                'email': f'usuario{i}@example.com',
+                'senha': 'x',
+                'pagamento_status': 'Em dia',
+                'pagamento_vencimento': date(2030, 1, 1),
+            }
+            for i in range(linhas)
+        ],
+    )
+    inicio = date(2030, 1, 1)
+    session.execute(
+        insert(Agendamento),
+        [
+            {
+                'id_usuario': i % linhas + 1,
+                'data': inicio + timedelta(days=i // 10),
+                'hora': hora(8 + i % 10),
+            }
+            for i in range(linhas)
+        ],
+    )
+    session.commit()
+
+
+def _campo_resposta(caminho: str):
+    return next(r.response_field for r in app.routes if r.path == caminho)
+
+
+def _antes_agendamentos(linhas):
+    conteudo = {
+        'agendamentos': [AgendamentoPublico(**linha._mapping) for linha in linhas],
+        'proximo_cursor': None,
+    }
+    campo = _campo_resposta('/admin/agendamentos')
+    return JSONResponse(
+        asyncio.run(serialize_response(field=campo, response_content=conteudo))
+    ).body
+
+
+def _antes_usuarios(linhas):
+    conteudo = {
+        'users': [UserPublic(**linha._mapping) for linha in linhas],
+        'proximo_after_id': None,
+    }
+    campo = _campo_resposta('/admin/usuarios')
+    return JSONResponse(
+        asyncio.run(serialize_response(field=campo, response_content=conteudo))
+    ).body
+
+
+def _depois_agendamentos(linhas):
+    return resposta_json(
+        AgendamentoList,
+        {'agendamentos': linhas_como_dicts(linhas), 'proximo_cursor': None},
+    ).body
+
+
+def _depois_usuarios(linhas):
+    return resposta_json(
+        UserList, {'users': linhas_como_dicts(linhas), 'proximo_after_id': None}
+    ).body
+
+
+def _medir(funcao, linhas, repeticoes: int) -> float:
+    """Melhor tempo por linha, em microssegundos."""
+    funcao(linhas)  # aquece caches (TypeAdapter, campos do FastAPI)
+    melhor = float('inf')
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(linhas)
+        melhor = min(melhor, time.perf_counter() - inicio)
+    return melhor / len(linhas) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--linhas', type=int, default=5000)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    args = parser.parse_args()
+
+    engine = create_engine('sqlite://')
+    table_registry.metadata.create_all(engine)
+    with Session(engine) as session:
+        _popular(session, args.linhas)
+        agendamentos = session.execute(
+            select(
+                Agendamento.id,
+                Agendamento.id_usuario,
+                Agendamento.data,
+                Agendamento.hora,
+                func.coalesce(User.nome, 'Desconhecido').label('nome_usuario'),
+            ).outerjoin(User, User.id == Agendamento.id_usuario)
+        ).all()
+        usuarios = session.execute(
+            select(
+                User.id,
+                User.nome,
+                User.email,
+                User.is_admin,
+                User.pagamento_status.label('status_pagamento'),
+                User.pagamento_vencimento.label('data_proximo_vencimento'),
+            )
+        ).all()
+
+    casos = {
+        'agendamentos': (agendamentos, _antes_agendamentos, _depois_agendamentos),
+        'usuarios': (usuarios, _antes_usuarios, _depois_usuarios),
+    }
+    resultado = {}
+    for nome, (linhas, antes, depois) in casos.items():
+        # Os dois caminhos precisam produzir o mesmo documento
+        assert json.loads(antes(linhas)) == json.loads(depois(linhas))
+        us_antes = _medir(antes, linhas, args.repeticoes)
+        us_depois = _medir(depois, linhas, args.repeticoes)
+        resultado[nome] = {
+            'linhas': len(linhas),
+            'antes_us_por_linha': round(us_antes, 3),
+            'depois_us_por_linha': round(us_depois, 3),
+            'ganho': round(us_antes / us_depois, 2),
+        }
+    print(json.dumps(resultado, indent=2))
+
+
+if __name__ == '__main__':
+    main()
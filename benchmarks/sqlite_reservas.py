@@ -0,0 +1,218 @@
+"""Vazão de reservas concorrentes no SQLite, antes e depois do perfil de produção.
+
+``antes`` é uma engine criada só com a URL, como ``database.py`` fazia: journal
+em modo rollback, ``synchronous=FULL`` e transações DEFERRED. ``depois`` usa
+``criar_engines`` e ``SessaoSQLite``: WAL, PRAGMAs de produção, uma conexão
+de escrita com ``BEGIN IMMEDIATE`` e um pool de leitura. Em cada perfil, ``--escritores``
+threads fazem ``--reservas`` reservas cada (consultando a agenda e lendo o
+usuário antes, como o aluno e a rota) enquanto ``--leitores`` threads
+consultam a agenda sem parar. Com ``--processos N`` cada processo roda esse
+conjunto de threads sobre o mesmo arquivo, como vários workers do servidor::
+
+    python -m benchmarks.sqlite_reservas --escritores 16 --reservas 50
+    python -m benchmarks.sqlite_reservas --escritores 4 --processos 4
+
+O relatório traz reservas e leituras por segundo, p95 das reservas e os
+erros do banco (``database is locked``) por perfil.
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, timedelta
+from datetime import time as hora_do_dia
+from functools import partial
+from pathlib import Path
+
+from sqlalchemy import Engine, create_engine, func, insert, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+
+from agendamento.database import SessaoSQLite, criar_engines
+from agendamento.models import Agendamento, User, table_registry
+from agendamento.services import reservar_horario
+
+PRIMEIRO_DIA = date(2030, 1, 1)
+
+
+def _perfil_antes(url: str) -> tuple[list[Engine], Callable[[], Session]]:
+    engine = create_engine(url)
+    return [engine], partial(Session, engine)
+
+
+def _perfil_depois(url: str) -> tuple[list[Engine], Callable[[], Session]]:
+    leitura, escrita = criar_engines(url)
+    return [leitura, escrita], partial(SessaoSQLite, leitura, escrita)
+
+
+PERFIS = {'antes': _perfil_antes, 'depois': _perfil_depois}
+
+
+class Carga:
+    """Estado compartilhado pelas threads de um perfil."""
+
+    def __init__(self, nova_sessao: Callable[[], Session]):
+        self.nova_sessao = nova_sessao
+        self.lock = threading.Lock()
+        self.duracoes: list[float] = []
+        self.leituras = 0
+        self.erros: Counter[str] = Counter()
+        self.terminou = threading.Event()
+
+    def erro(self, erro: OperationalError | PoolTimeoutError) -> None:
+        motivo = str(getattr(erro, 'orig', None) or 'timeout no pool')
+        with self.lock:
+            self.erros[motivo] += 1
+
+    def _consultar_agenda(self) -> None:
+        with self.nova_sessao() as session:
+            session.scalar(
+                select(func.count(Agendamento.id)).where(
+                    Agendamento.data >= PRIMEIRO_DIA
+                )
+            )
+
+    def escrever(self, id_usuario: int, dias: range) -> None:
+        for dia in dias:
+            inicio = time.perf_counter()
+            try:
+                # Como o aluno: consulta a agenda e então reserva
+                self._consultar_agenda()
+                with self.nova_sessao() as session:
+                    session.get(User, id_usuario)
+                    reservar_horario(
+                        session,
+                        id_usuario,
+                        PRIMEIRO_DIA + timedelta(days=dia),
+                        hora_do_dia(10),
+                    )
+                    session.commit()
+            except (OperationalError, PoolTimeoutError) as erro:
+                self.erro(erro)
+                continue
+            with self.lock:
+                self.duracoes.append(time.perf_counter() - inicio)
+
+    def ler(self) -> None:
+        while not self.terminou.is_set():
+            try:
+                self._consultar_agenda()
+            except OperationalError as erro:
+                self.erro(erro)
+                continue
+            with self.lock:
+                self.leituras += 1
+
+
+@dataclass(frozen=True)
+class Rodada:
+    perfil: str
+    url: str
+    escritores: int
+    reservas: int
+    leitores: int
+
+
+def _rodar(
+    rodada: Rodada, processo: int
+) -> tuple[list[float], int, Counter[str]]:
+    """Roda as threads de um processo; devolve durações, leituras e erros."""
+    engines, nova_sessao = PERFIS[rodada.perfil](rodada.url)
+    carga = Carga(nova_sessao)
+    threads_leitura = [
+        threading.Thread(target=carga.ler) for _ in range(rodada.leitores)
+    ]
+    threads_escrita = []
+    escritores, reservas = rodada.escritores, rodada.reservas
+    for i in range(processo * escritores, (processo + 1) * escritores):
+        dias = range(i * reservas, (i + 1) * reservas)
+        threads_escrita.append(
+            threading.Thread(target=carga.escrever, args=(i + 1, dias))
+        )
+    for thread in threads_leitura + threads_escrita:
+        thread.start()
+    for thread in threads_escrita:
+        thread.join()
+    carga.terminou.set()
+    for thread in threads_leitura:
+        thread.join()
+    for engine in engines:
+        engine.dispose()
+    return carga.duracoes, carga.leituras, carga.erros
+
+
+def medir(
+    perfil: str, escritores: int, reservas: int, leitores: int, processos: int = 1
+) -> dict:
+    """Mede um perfil com ``escritores`` e ``leitores`` threads por processo."""
+    with tempfile.TemporaryDirectory() as pasta:
+        url = f'sqlite:///{Path(pasta) / "reservas.db"}'
+        engines, nova_sessao = PERFIS[perfil](url)
+        table_registry.metadata.create_all(engines[-1])
+        with nova_sessao() as session:
+            session.execute(
+                insert(User),
+                [
+                    {
+                        'nome': f'Aluno {i}',
+                        'email': f'aluno{i}@bench.example.com',
+                        'senha': 'x',
+                    }
+                    for i in range(escritores * processos)
+                ],
+            )
+            session.commit()
+        for engine in engines:
+            engine.dispose()
+
+        rodada = Rodada(perfil, url, escritores, reservas, leitores)
+        inicio = time.perf_counter()
+        if processos == 1:
+            resultados = [_rodar(rodada, 0)]
+        else:
+            with ProcessPoolExecutor(processos) as executor:
+                resultados = list(
+                    executor.map(_rodar, [rodada] * processos, range(processos))
+                )
+        duracao = time.perf_counter() - inicio
+
+    duracoes = sorted(d for r in resultados for d in r[0])
+    erros = sum((r[2] for r in resultados), Counter())
+    return {
+        'reservas': len(duracoes),
+        'reservas_por_segundo': round(len(duracoes) / duracao, 1),
+        'leituras_por_segundo': round(sum(r[1] for r in resultados) / duracao, 1),
+        'p95_reserva_ms': round(statistics.quantiles(duracoes, n=20)[-1] * 1000, 2)
+        if len(duracoes) > 1
+        else None,
+        'erros': dict(erros),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--escritores', type=int, default=16)
+    parser.add_argument('--reservas', type=int, default=50)
+    parser.add_argument('--leitores', type=int, default=4)
+    parser.add_argument('--processos', type=int, default=1)
+    args = parser.parse_args()
+
+    resultado = {
+        perfil: medir(
+            perfil, args.escritores, args.reservas, args.leitores, args.processos
+        )
+        for perfil in PERFIS
+    }
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
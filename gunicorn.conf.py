@@ -0,0 +1,35 @@
+"""Servidor de produção: gunicorn com ``WORKERS`` processos do uvicorn.
+
+    gunicorn agendamento.app:app
+
+O gunicorn lê este arquivo da pasta atual. A aplicação é importada uma vez
+no processo mestre (``preload_app``), com settings, modelos e mapeamentos
+prontos, e os workers nascem dela por fork. As engines só são criadas no
+lifespan de cada worker; se o mestre tiver criado alguma, o worker descarta
+os pools herdados logo após o fork e abre as próprias conexões.
+"""
+
+import gc
+import os
+
+from sqlalchemy.orm import configure_mappers
+
+from agendamento.database import descartar_conexoes_herdadas
+from agendamento.settings import get_settings
+
+bind = f'0.0.0.0:{os.environ.get("PORT", "8000")}'
+workers = get_settings().WORKERS
+worker_class = 'uvicorn_worker.UvicornWorker'
+preload_app = True
+
+
+def when_ready(server):
+    # Já com a aplicação importada, antes do primeiro fork
+    configure_mappers()
+    # Tira do coletor os objetos do mestre: o GC não os toca nos workers,
+    # que assim continuam compartilhando essas páginas de memória
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    descartar_conexoes_herdadas()
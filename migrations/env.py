@@ -6,12 +6,12 @@ from sqlalchemy import pool
 from alembic import context
 
 from agendamento.models import table_registry
-from agendamento.settings import Settings
+from agendamento.settings import get_settings
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
-config.set_main_option('sqlalchemy.url', Settings().DATABASE_URL)
+config.set_main_option('sqlalchemy.url', get_settings().DATABASE_URL)
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
@@ -0,0 +1,166 @@
+"""move payment receipts to the content-addressed store
+
+Revision ID: 20261018_comprovantes_armazem
+Revises: 20260323_add_ondelete_cascade
+Create Date: 2026-10-18 09:00:00.000000
+
+Receipts used to live in ``pagamentos.comprovante`` and were loaded by every
+``SELECT`` on the table. This migration:
+
+- creates the ``comprovantes`` metadata table (sha256, tamanho, mime);
+- adds ``pagamentos.comprovante_sha256`` pointing to it;
+- writes every existing blob to the store in ``COMPROVANTES_DIR`` (one row
+  at a time, so memory stays bounded) and fills the pointer;
+- drops ``comprovante`` and ``comprovante_mime`` from ``pagamentos``.
+
+Identical files end up as a single file and a single metadata row. The
+store layout (``<dir>/<sha256[:2]>/<sha256>``) is copied here rather than
+imported from ``agendamento.receipts``, so later changes to the application
+code can't alter what this revision does.
+"""
+import hashlib
+import os
+from pathlib import Path
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from agendamento.settings import get_settings
+
+
+# revision identifiers, used by Alembic.
+revision: str = '20261018_comprovantes_armazem'
+down_revision: Union[str, Sequence[str], None] = '20260323_add_ondelete_cascade'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_column(inspector, table_name: str, column_name: str) -> bool:
+    return column_name in [c['name'] for c in inspector.get_columns(table_name)]
+
+
+def _store_dir() -> Path:
+    # Same cached settings env.py reads DATABASE_URL from (environment or .env)
+    return Path(get_settings().COMPROVANTES_DIR)
+
+
+def _store_path(store: Path, sha256: str) -> Path:
+    return store / sha256[:2] / sha256
+
+
+def _store_save(store: Path, content: bytes) -> tuple[str, int]:
+    sha256 = hashlib.sha256(content).hexdigest()
+    target = _store_path(store, sha256)
+    if not target.exists():
+        target.parent.mkdir(parents=True, exist_ok=True)
+        partial = target.with_name(f'.envio-{sha256}')
+        partial.write_bytes(content)
+        os.replace(partial, target)
+    return sha256, len(content)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    inspector = sa.inspect(conn)
+    store = _store_dir()
+
+    if 'comprovantes' not in inspector.get_table_names():
+        op.create_table(
+            'comprovantes',
+            sa.Column('sha256', sa.String(), primary_key=True, nullable=False),
+            sa.Column('tamanho', sa.Integer(), nullable=False),
+            sa.Column('mime', sa.String(), nullable=False),
+            sa.Column('criado_em', sa.DateTime(), nullable=False, server_default=sa.func.now()),
+        )
+
+    if not _has_column(inspector, 'pagamentos', 'comprovante_sha256'):
+        with op.batch_alter_table('pagamentos') as batch:
+            batch.add_column(sa.Column('comprovante_sha256', sa.String(), nullable=True))
+            batch.create_foreign_key(
+                'fk_pagamentos_comprovante_sha256', 'comprovantes',
+                ['comprovante_sha256'], ['sha256'],
+            )
+
+    if not _has_column(inspector, 'pagamentos', 'comprovante'):
+        return
+
+    tem_mime = _has_column(inspector, 'pagamentos', 'comprovante_mime')
+    ids = conn.execute(
+        sa.text('SELECT id FROM pagamentos WHERE comprovante IS NOT NULL')
+    ).scalars().all()
+
+    for pagamento_id in ids:
+        linha = conn.execute(
+            sa.text(
+                'SELECT comprovante'
+                + (', comprovante_mime' if tem_mime else ', NULL')
+                + ' FROM pagamentos WHERE id = :id'
+            ),
+            {'id': pagamento_id},
+        ).one()
+        conteudo, mime = linha
+        if isinstance(conteudo, str):
+            # the first revisions declared the column as String
+            conteudo = conteudo.encode()
+
+        sha256, tamanho = _store_save(store, conteudo)
+        existe = conn.execute(
+            sa.text('SELECT 1 FROM comprovantes WHERE sha256 = :sha256'),
+            {'sha256': sha256},
+        ).first()
+        if not existe:
+            conn.execute(
+                sa.text(
+                    'INSERT INTO comprovantes (sha256, tamanho, mime) '
+                    'VALUES (:sha256, :tamanho, :mime)'
+                ),
+                {
+                    'sha256': sha256,
+                    'tamanho': tamanho,
+                    'mime': mime or 'application/octet-stream',
+                },
+            )
+        conn.execute(
+            sa.text('UPDATE pagamentos SET comprovante_sha256 = :sha256 WHERE id = :id'),
+            {'sha256': sha256, 'id': pagamento_id},
+        )
+
+    with op.batch_alter_table('pagamentos') as batch:
+        batch.drop_column('comprovante')
+        if tem_mime:
+            batch.drop_column('comprovante_mime')
+
+
+def downgrade() -> None:
+    conn = op.get_bind()
+    store = _store_dir()
+
+    with op.batch_alter_table('pagamentos') as batch:
+        batch.add_column(sa.Column('comprovante', sa.LargeBinary(), nullable=True))
+        batch.add_column(sa.Column('comprovante_mime', sa.String(), nullable=True))
+
+    linhas = conn.execute(
+        sa.text(
+            'SELECT p.id, c.sha256, c.mime FROM pagamentos p '
+            'JOIN comprovantes c ON c.sha256 = p.comprovante_sha256'
+        )
+    ).all()
+    for pagamento_id, sha256, mime in linhas:
+        conn.execute(
+            sa.text(
+                'UPDATE pagamentos SET comprovante = :conteudo, '
+                'comprovante_mime = :mime WHERE id = :id'
+            ),
+            {
+                'conteudo': _store_path(store, sha256).read_bytes(),
+                'mime': mime,
+                'id': pagamento_id,
+            },
+        )
+
+    with op.batch_alter_table('pagamentos') as batch:
+        batch.drop_constraint('fk_pagamentos_comprovante_sha256', type_='foreignkey')
+        batch.drop_column('comprovante_sha256')
+
+    op.drop_table('comprovantes')
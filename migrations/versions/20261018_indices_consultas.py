@@ -0,0 +1,65 @@
+"""composite indexes for the hot query shapes
+
+Revision ID: 20261018_indices_consultas
+Revises: 20261018_pagamentos_vencimento_idx
+Create Date: 2026-10-18 11:00:00.000000
+
+- ``pagamentos(id_usuario, data_vencimento DESC)``: latest payment of a user
+  (``WHERE id_usuario = ? ORDER BY data_vencimento DESC LIMIT 1``);
+- ``agendamentos(id_usuario, data, hora)``: a user's bookings in order.
+
+``pagamentos(status, data_vencimento)``, for the overdue sweeper, comes from
+the previous revision.
+
+On PostgreSQL the indexes are built with ``CREATE INDEX CONCURRENTLY``
+outside the migration transaction, so the tables stay writable.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '20261018_indices_consultas'
+down_revision: Union[str, Sequence[str], None] = '20261018_pagamentos_vencimento_idx'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    ('ix_pagamentos_id_usuario_data_vencimento', 'pagamentos',
+     ['id_usuario', 'data_vencimento DESC']),
+    ('ix_agendamentos_id_usuario_data_hora', 'agendamentos',
+     ['id_usuario', 'data', 'hora']),
+]
+
+
+def _concurrently() -> bool:
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def _create(name: str, table: str, columns: list[str]) -> None:
+    op.create_index(
+        name, table, [sa.text(c) for c in columns],
+        if_not_exists=True, postgresql_concurrently=_concurrently(),
+    )
+
+
+def _drop(name: str, table: str) -> None:
+    op.drop_index(
+        name, table_name=table,
+        if_exists=True, postgresql_concurrently=_concurrently(),
+    )
+
+
+def upgrade() -> None:
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            _create(name, table, columns)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            _drop(name, table)
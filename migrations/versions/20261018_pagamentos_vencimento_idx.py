@@ -0,0 +1,48 @@
+"""index pagamentos(status, data_vencimento) for the overdue sweeper
+
+Revision ID: 20261018_pagamentos_vencimento_idx
+Revises: 20261018_comprovantes_armazem
+Create Date: 2026-10-18 10:00:00.000000
+
+The overdue-payment sweeper (agendamento/sweeper.py) runs
+``UPDATE pagamentos SET status = 'Atrasado' WHERE status = 'Em dia' AND
+data_vencimento < :hoje`` and ``/admin/pagamentos/atrasados`` orders by
+``data_vencimento``; both use this index instead of scanning the table.
+
+On PostgreSQL it is built with ``CREATE INDEX CONCURRENTLY`` outside the
+migration transaction, so the table stays writable.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '20261018_pagamentos_vencimento_idx'
+down_revision: Union[str, Sequence[str], None] = '20261018_comprovantes_armazem'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEX_NAME = 'ix_pagamentos_status_data_vencimento'
+
+
+def _concurrently() -> bool:
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade() -> None:
+    # CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        op.create_index(
+            INDEX_NAME, 'pagamentos', ['status', 'data_vencimento'],
+            if_not_exists=True, postgresql_concurrently=_concurrently(),
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            INDEX_NAME, table_name='pagamentos',
+            if_exists=True, postgresql_concurrently=_concurrently(),
+        )
@@ -0,0 +1,63 @@
+"""denormalize the current payment onto users
+
+Revision ID: 20261018_users_pagamento_atual
+Revises: 20261018_indices_consultas
+Create Date: 2026-10-18 12:00:00.000000
+
+Adds ``users.pagamento_atual_id`` (FK to ``pagamentos``, SET NULL on delete),
+``users.pagamento_status`` and ``users.pagamento_vencimento`` and backfills
+them from each user's payment with the latest ``data_vencimento``. After
+deploying, ``python -m agendamento.consistency`` should report no
+divergences.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '20261018_users_pagamento_atual'
+down_revision: Union[str, Sequence[str], None] = '20261018_indices_consultas'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+FK_NAME = 'fk_users_pagamento_atual_id'
+
+
+def _has_column(inspector, table_name: str, column_name: str) -> bool:
+    return column_name in [c['name'] for c in inspector.get_columns(table_name)]
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if not _has_column(inspector, 'users', 'pagamento_atual_id'):
+        with op.batch_alter_table('users') as batch:
+            batch.add_column(sa.Column('pagamento_atual_id', sa.Integer(), nullable=True))
+            batch.add_column(sa.Column('pagamento_status', sa.String(), nullable=True))
+            batch.add_column(sa.Column('pagamento_vencimento', sa.Date(), nullable=True))
+            batch.create_foreign_key(
+                FK_NAME, 'pagamentos', ['pagamento_atual_id'], ['id'],
+                ondelete='SET NULL',
+            )
+
+    op.execute(
+        'UPDATE users SET pagamento_atual_id = ('
+        ' SELECT p.id FROM pagamentos p WHERE p.id_usuario = users.id'
+        ' ORDER BY p.data_vencimento DESC, p.id DESC LIMIT 1)'
+    )
+    op.execute(
+        'UPDATE users SET'
+        ' pagamento_status = (SELECT p.status FROM pagamentos p'
+        '  WHERE p.id = users.pagamento_atual_id),'
+        ' pagamento_vencimento = (SELECT p.data_vencimento FROM pagamentos p'
+        '  WHERE p.id = users.pagamento_atual_id)'
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch:
+        batch.drop_constraint(FK_NAME, type_='foreignkey')
+        batch.drop_column('pagamento_vencimento')
+        batch.drop_column('pagamento_status')
+        batch.drop_column('pagamento_atual_id')
@@ -0,0 +1,41 @@
+"""global version as a sequence
+
+Revision ID: 20261018_versao_global_sequencia
+Revises: 20261018_versoes_etag
+Create Date: 2026-10-18 15:00:00.000000
+
+On databases with sequences (Postgres) the global version becomes the
+``versao_global`` sequence, advanced after each write commits, so writers
+no longer queue on the ``versoes.global`` row. It starts one past the row's
+current value: until the first ``nextval`` (``is_called`` false) the version
+reads as the row's value, so ETags already handed out stay valid until the
+next write. SQLite keeps the row.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '20261018_versao_global_sequencia'
+down_revision: Union[str, Sequence[str], None] = '20261018_versoes_etag'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    if not bind.dialect.supports_sequences:
+        return
+    atual = bind.scalar(
+        sa.text("SELECT valor FROM versoes WHERE nome = 'global'")
+    ) or 0
+    op.execute(sa.schema.CreateSequence(
+        sa.Sequence('versao_global', start=atual + 1)
+    ))
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.supports_sequences:
+        op.execute(sa.schema.DropSequence(sa.Sequence('versao_global')))
@@ -0,0 +1,48 @@
+"""version counters for conditional GETs
+
+Revision ID: 20261018_versoes_etag
+Revises: 20261018_users_pagamento_atual
+Create Date: 2026-10-18 13:00:00.000000
+
+Adds ``users.versao`` (bumped on every write to the user's bookings or
+payments) and the ``versoes`` table with the ``global`` row used by the
+admin listings. Both feed the ETags checked against ``If-None-Match``.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '20261018_versoes_etag'
+down_revision: Union[str, Sequence[str], None] = '20261018_users_pagamento_atual'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_column(inspector, table_name: str, column_name: str) -> bool:
+    return column_name in [c['name'] for c in inspector.get_columns(table_name)]
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if not _has_column(inspector, 'users', 'versao'):
+        with op.batch_alter_table('users') as batch:
+            batch.add_column(
+                sa.Column('versao', sa.Integer(), nullable=False, server_default='0')
+            )
+
+    if 'versoes' not in inspector.get_table_names():
+        op.create_table(
+            'versoes',
+            sa.Column('nome', sa.String(), primary_key=True, nullable=False),
+            sa.Column('valor', sa.Integer(), nullable=False),
+        )
+        op.execute("INSERT INTO versoes (nome, valor) VALUES ('global', 0)")
+
+
+def downgrade() -> None:
+    op.drop_table('versoes')
+    with op.batch_alter_table('users') as batch:
+        batch.drop_column('versao')
@@ -1,27 +1,38 @@
 import warnings
+from contextlib import contextmanager
 
 import pytest
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import Session
 from sqlalchemy.pool import StaticPool
 
 from agendamento.app import app
+from agendamento.availability import indice_disponibilidade
 from agendamento.database import get_session
+from agendamento.metrics import metricas
 from agendamento.models import User, table_registry
-from agendamento.security import criar_token
+from agendamento.query_log import registro_consultas
+from agendamento.receipts import (
+    ArmazemComprovantes,
+    get_armazem_comprovantes,
+)
+from agendamento.security import cache_principais, criar_token
 
 
 # O TestClient do FastAPI é uma classe para testar API
 # que simula requisições HTTP sem a necessidade de iniciar o servidor
 # Fixture, bloco de teste reutilizável
 @pytest.fixture
-def client(session):
+def client(session, armazem):
     def get_session_override():
         return session
 
+    # Antes de subir: o lifespan não pré-carrega nem varre o banco
+    # configurado quando get_session está trocado
+    app.dependency_overrides[get_session] = get_session_override
+    app.dependency_overrides[get_armazem_comprovantes] = lambda: armazem
     with TestClient(app) as client:
-        app.dependency_overrides[get_session] = get_session_override
         yield client
 
     app.dependency_overrides.clear()
@@ -43,6 +54,11 @@ def session():
     table_registry.metadata.drop_all(engine)
 
 
+@pytest.fixture
+def armazem(tmp_path):
+    return ArmazemComprovantes(tmp_path / 'comprovantes')
+
+
 @pytest.fixture
 def user(session):
     user = User(
@@ -93,3 +109,58 @@ def admin_token(admin_user):
 @pytest.fixture(autouse=True)
 def suppress_resource_warnings():
     warnings.simplefilter('ignore', ResourceWarning)
+
+
+@pytest.fixture(autouse=True)
+def limpar_caches():
+    # Os caches são globais ao processo; cada teste começa com eles vazios
+    indice_disponibilidade.limpar()
+    cache_principais.limpar()
+    metricas.limpar()
+    registro_consultas.limpar()
+    yield
+    indice_disponibilidade.limpar()
+    cache_principais.limpar()
+    metricas.limpar()
+    registro_consultas.limpar()
+
+
+class ContadorConsultas:
+    """Guarda os comandos SQL enviados pelo engine da fixture ``session``."""
+
+    def __init__(self):
+        self.comandos: list[str] = []
+
+    def registrar(self, conn, cursor, statement, *args):
+        self.comandos.append(statement)
+
+    @contextmanager
+    def medir(self):
+        """Coleta na lista devolvida os comandos executados dentro do bloco."""
+        inicio = len(self.comandos)
+        medidos: list[str] = []
+        yield medidos
+        medidos.extend(self.comandos[inicio:])
+
+    @contextmanager
+    def orcamento(self, maximo: int):
+        """Falha, listando os comandos, se o bloco passar de ``maximo``."""
+        with self.medir() as comandos:
+            yield comandos
+        if len(comandos) > maximo:
+            listagem = '\n'.join(
+                f'  {i}. {comando}' for i, comando in enumerate(comandos, 1)
+            )
+            pytest.fail(
+                f'{len(comandos)} consultas, orçamento de {maximo}:\n{listagem}',
+                pytrace=False,
+            )
+
+
+@pytest.fixture
+def consultas(session):
+    contador = ContadorConsultas()
+    engine = session.get_bind()
+    event.listen(engine, 'before_cursor_execute', contador.registrar)
+    yield contador
+    event.remove(engine, 'before_cursor_execute', contador.registrar)
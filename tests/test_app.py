@@ -1,7 +1,83 @@
-from datetime import date, time
+import hashlib
+import inspect
+import json
+import os
+import runpy
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time, timedelta
 from http import HTTPStatus
 
-from agendamento.models import Agendamento
+import pytest
+from fastapi import Depends
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, delete, event, func, insert, select, text
+from sqlalchemy import exc as sqlalchemy_exc
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+from agendamento import database, security, services
+from agendamento.app import (
+    app,
+    condicional_usuario,
+    importar_usuarios_admin,
+    varredor,
+)
+from agendamento.async_routes import RotaAssincrona, assincrona
+from agendamento.availability import IndiceDisponibilidade, indice_disponibilidade
+from agendamento.consistency import (
+    corrigir_pagamento_atual,
+    verificar_pagamento_atual,
+)
+from agendamento.database import (
+    SessaoSQLite,
+    criar_engines,
+    descartar_conexoes_herdadas,
+    get_session,
+    get_session_async,
+    settings,
+)
+from agendamento.metrics import instrumentar_engine
+from agendamento.models import (
+    Agendamento,
+    Comprovante,
+    Pagamento,
+    User,
+    Versao,
+    table_registry,
+)
+from agendamento.pool import (
+    PoolMedido,
+    admitir_no_banco,
+    linhas_pool,
+    threads_para_pool,
+)
+from agendamento.query_log import normalizar, registro_consultas
+from agendamento.receipts import get_armazem_comprovantes
+from agendamento.schemas import UserList
+from agendamento.security import (
+    cache_principais,
+    criar_token,
+    get_current_user,
+    get_current_user_async,
+    get_current_user_leitura_async,
+)
+from agendamento.serialization import adaptador, linhas_como_dicts
+from agendamento.services import (
+    importar_usuarios,
+    registrar_alteracao,
+    reservar_horario,
+    reservar_horarios,
+    versao_global,
+)
+from agendamento.sweeper import VarredorPagamentos, varrer_pagamentos_atrasados
+from benchmarks.endpoints import comparar, executar
+
+# Rótulo do processo em toda série de /metrics; o TestClient roda a
+# aplicação neste processo
+PID = f'pid="{os.getpid()}"'
 
 
 def test_root_deve_retornar_ok_e_ola_mundo(client):
@@ -122,3 +198,1463 @@ def test_listar_meus_agendamentos(client, token, session, user):
         headers={'Authorization': f'Bearer {token}'},
     )
     assert response.status_code == HTTPStatus.OK
+
+
+def test_listar_usuarios_le_status_gravado_pela_varredura(
+    client, admin_token, session, user
+):
+    session.add_all([
+        Pagamento(
+            id_usuario=user.id,
+            data_vencimento=date(2020, 1, 10),
+            status='Aprovado',
+        ),
+        Pagamento(
+            id_usuario=user.id,
+            data_vencimento=date(2020, 2, 10),
+            status='Em dia',
+        ),
+    ])
+    session.commit()
+    corrigir_pagamento_atual(session)
+    assert varrer_pagamentos_atrasados(session) == 1
+
+    response = client.get(
+        '/admin/usuarios',
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+    assert response.status_code == HTTPStatus.OK
+    usuarios = {u['id']: u for u in response.json()['users']}
+    assert usuarios[user.id]['status_pagamento'] == 'Atrasado'
+    assert usuarios[user.id]['data_proximo_vencimento'] == '2020-02-10'
+
+
+def test_listar_usuarios_paginacao_e_filtro(client, admin_token, session, user):
+    session.add(
+        Pagamento(
+            id_usuario=user.id,
+            data_vencimento=date(2099, 1, 10),
+            status='Em dia',
+        )
+    )
+    session.commit()
+    corrigir_pagamento_atual(session)
+    headers = {'Authorization': f'Bearer {admin_token}'}
+
+    primeira = client.get('/admin/usuarios?limit=1', headers=headers).json()
+    assert len(primeira['users']) == 1
+    assert primeira['proximo_after_id'] == primeira['users'][0]['id']
+
+    segunda = client.get(
+        f'/admin/usuarios?limit=1&after_id={primeira["proximo_after_id"]}',
+        headers=headers,
+    ).json()
+    assert len(segunda['users']) == 1
+    assert segunda['proximo_after_id'] is None
+
+    filtrados = client.get(
+        '/admin/usuarios?status_pagamento=Em dia', headers=headers
+    ).json()
+    assert [u['id'] for u in filtrados['users']] == [user.id]
+
+
+def test_listar_todos_agendamentos_intervalo_e_cursor(
+    client, admin_token, session, user
+):
+    session.add_all([
+        Agendamento(id_usuario=user.id, data=date(2029, 11, 1), hora=time(9, 0)),
+        Agendamento(id_usuario=user.id, data=date(2029, 11, 1), hora=time(10, 0)),
+        Agendamento(id_usuario=user.id, data=date(2029, 11, 2), hora=time(8, 0)),
+        Agendamento(id_usuario=user.id, data=date(2029, 12, 1), hora=time(8, 0)),
+    ])
+    session.commit()
+    headers = {'Authorization': f'Bearer {admin_token}'}
+    url = '/admin/agendamentos?inicio=2029-11-01&fim=2029-11-30&limit=2'
+
+    primeira = client.get(url, headers=headers).json()
+    assert [(a['data'], a['hora']) for a in primeira['agendamentos']] == [
+        ('2029-11-01', '09:00:00'),
+        ('2029-11-01', '10:00:00'),
+    ]
+    assert primeira['agendamentos'][0]['nome_usuario'] == user.nome
+
+    segunda = client.get(
+        f'{url}&cursor={primeira["proximo_cursor"]}', headers=headers
+    ).json()
+    assert [(a['data'], a['hora']) for a in segunda['agendamentos']] == [
+        ('2029-11-02', '08:00:00'),
+    ]
+    assert segunda['proximo_cursor'] is None
+
+
+def test_listar_todos_agendamentos_exige_intervalo(client, admin_token):
+    response = client.get(
+        '/admin/agendamentos',
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_horarios_disponiveis_reflete_agendar_e_cancelar(client, token):
+    headers = {'Authorization': f'Bearer {token}'}
+
+    livres = client.get('/horarios-disponiveis/2029-11-01', headers=headers)
+    assert livres.status_code == HTTPStatus.OK
+    assert '10:00' in livres.json()['horarios_disponiveis']
+
+    criado = client.post(
+        '/agendar',
+        json={'data': '2029-11-01', 'hora': '10:00:00'},
+        headers=headers,
+    ).json()
+    livres = client.get('/horarios-disponiveis/2029-11-01', headers=headers)
+    assert '10:00' not in livres.json()['horarios_disponiveis']
+
+    client.delete(f'/cancelar-agendamento/{criado["id"]}', headers=headers)
+    livres = client.get('/horarios-disponiveis/2029-11-01', headers=headers)
+    assert '10:00' in livres.json()['horarios_disponiveis']
+
+
+def test_indice_disponibilidade_carrega_do_banco_e_respeita_lru(session, user):
+    session.add(
+        Agendamento(id_usuario=user.id, data=date(2029, 11, 1), hora=time(8, 0))
+    )
+    session.commit()
+    indice = IndiceDisponibilidade(capacidade=3, janela=2)
+
+    assert '08:00' not in indice.livres(session, date(2029, 11, 1))
+    indice.ocupados(session, date(2029, 12, 1))
+    assert len(indice._ocupados) == 3  # noqa: PLR2004
+    assert date(2029, 11, 1) not in indice._ocupados
+
+
+def test_subida_com_get_session_trocado_nao_usa_o_banco_configurado(client):
+    # Sem pré-carga do índice nem varredura sobre DATABASE_URL
+    assert not indice_disponibilidade._ocupados
+    assert varredor._thread is None
+
+
+def test_varredor_usa_a_fabrica_de_sessoes(session, user):
+    pagamento = Pagamento(
+        id_usuario=user.id, data_vencimento=date(2020, 2, 10), status='Em dia'
+    )
+    session.add(pagamento)
+    session.commit()
+
+    varredor_teste = VarredorPagamentos(
+        3600, fabrica_sessao=lambda: Session(session.get_bind())
+    )
+    varredor_teste.iniciar()
+    varredor_teste.parar()
+
+    session.refresh(pagamento)
+    assert pagamento.status == 'Atrasado'
+
+
+def test_indice_disponibilidade_com_ttl_rele_do_banco(session, user):
+    dia = date(2029, 11, 1)
+    sem_ttl = IndiceDisponibilidade(janela=1)
+    com_ttl = IndiceDisponibilidade(janela=1, ttl=0)
+    assert sem_ttl.ocupados(session, dia) == com_ttl.ocupados(session, dia) == 0
+
+    # Reserva feita por outro worker: não passa por marcar()
+    session.add(Agendamento(id_usuario=user.id, data=dia, hora=time(8, 0)))
+    session.commit()
+
+    assert sem_ttl.ocupados(session, dia) == 0
+    assert com_ttl.ocupados(session, dia) == 1
+    assert com_ttl.ocupados_intervalo(session, dia, dia) == {dia: 1}
+
+
+def test_horarios_disponiveis_periodo(client, token, session, user):
+    session.add(
+        Agendamento(id_usuario=user.id, data=date(2029, 11, 2), hora=time(9, 0))
+    )
+    session.commit()
+    headers = {'Authorization': f'Bearer {token}'}
+    url = '/horarios-disponiveis?inicio=2029-11-01&fim=2029-11-07'
+
+    response = client.get(url, headers=headers)
+    assert response.status_code == HTTPStatus.OK
+    dias = {d['data']: d['horarios_disponiveis'] for d in response.json()}
+    assert len(dias) == 7  # noqa: PLR2004
+    assert '09:00' in dias['2029-11-01']
+    assert '09:00' not in dias['2029-11-02']
+
+    etag = response.headers['etag']
+    response = client.get(url, headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+
+def test_horarios_disponiveis_periodo_limite(client, token):
+    response = client.get(
+        '/horarios-disponiveis?inicio=2029-01-01&fim=2029-12-31',
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    assert response.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_enviar_comprovante_grava_no_armazem_sem_duplicar(
+    client, token, session, user, armazem
+):
+    pagamentos = [
+        Pagamento(
+            id_usuario=user.id,
+            data_vencimento=date(2029, 1, 10),
+            status='Atrasado',
+        ),
+    ]
+    session.add_all(pagamentos)
+    session.commit()
+    corrigir_pagamento_atual(session)
+    conteudo = b'%PDF-1.4 comprovante' * 10_000
+
+    for _ in range(2):
+        response = client.post(
+            '/pagamento/comprovante',
+            files={'arquivo': ('comprovante.pdf', conteudo, 'application/pdf')},
+            headers={'Authorization': f'Bearer {token}'},
+        )
+        assert response.status_code == HTTPStatus.OK
+
+    sha256 = hashlib.sha256(conteudo).hexdigest()
+    assert armazem.caminho(sha256).read_bytes() == conteudo
+    assert len(list(armazem.raiz.rglob('*'))) == 2  # noqa: PLR2004
+    comprovante = session.get(Comprovante, sha256)
+    assert comprovante.tamanho == len(conteudo)
+    assert comprovante.mime == 'application/pdf'
+    assert pagamentos[0].comprovante_sha256 == sha256
+
+
+def test_comprovante_ja_gravado_sem_on_conflict(
+    client, token, session, user, monkeypatch
+):
+    # Sem ON CONFLICT, o INSERT repetido cai no savepoint em vez de dar 500
+    monkeypatch.setattr(services, '_INSERT_COM_CONFLITO', frozenset())
+    session.add(
+        Pagamento(
+            id_usuario=user.id,
+            data_vencimento=date(2029, 1, 10),
+            status='Atrasado',
+        )
+    )
+    session.commit()
+    corrigir_pagamento_atual(session)
+    conteudo = b'%PDF-1.4 comprovante'
+    sha256 = hashlib.sha256(conteudo).hexdigest()
+    session.add(Comprovante(sha256=sha256, tamanho=len(conteudo), mime='x'))
+    session.commit()
+
+    response = client.post(
+        '/pagamento/comprovante',
+        files={'arquivo': ('comprovante.pdf', conteudo, 'application/pdf')},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+
+    assert response.status_code == HTTPStatus.OK
+    assert session.scalar(select(Pagamento.comprovante_sha256)) == sha256
+
+
+def test_ver_comprovante_range_etag_e_304(
+    client, token, admin_token, session, user
+):
+    pagamento = Pagamento(
+        id_usuario=user.id,
+        data_vencimento=date(2029, 1, 10),
+        status='Atrasado',
+    )
+    session.add(pagamento)
+    session.commit()
+    corrigir_pagamento_atual(session)
+    conteudo = bytes(range(256)) * 1_000
+    client.post(
+        '/pagamento/comprovante',
+        files={'arquivo': ('comprovante.pdf', conteudo, 'application/pdf')},
+        headers={'Authorization': f'Bearer {token}'},
+    )
+    headers = {'Authorization': f'Bearer {admin_token}'}
+    url = f'/admin/pagamentos/{pagamento.id}/comprovante'
+
+    response = client.get(url, headers=headers)
+    assert response.status_code == HTTPStatus.OK
+    assert response.content == conteudo
+    etag = response.headers['etag']
+    assert etag == f'"{hashlib.sha256(conteudo).hexdigest()}"'
+    assert 'last-modified' in response.headers
+
+    parcial = client.get(url, headers={**headers, 'Range': 'bytes=100-199'})
+    assert parcial.status_code == HTTPStatus.PARTIAL_CONTENT
+    assert parcial.content == conteudo[100:200]
+
+    response = client.get(url, headers={**headers, 'If-None-Match': etag})
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert not response.content
+
+
+def test_ver_comprovante_sem_arquivo_no_armazem_retorna_404(
+    client, admin_token, session, user, caplog
+):
+    # Linha no banco, arquivo sumido do armazém (volume perdido)
+    session.add(Comprovante(sha256='ab' * 32, tamanho=3, mime='application/pdf'))
+    pagamento = Pagamento(
+        id_usuario=user.id,
+        data_vencimento=date(2029, 1, 10),
+        status='Aguardando confirmação',
+        comprovante_sha256='ab' * 32,
+    )
+    session.add(pagamento)
+    session.commit()
+
+    response = client.get(
+        f'/admin/pagamentos/{pagamento.id}/comprovante',
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert response.json() == {'detail': 'Comprovante não encontrado'}
+    assert 'ausente do armazém' in caplog.text
+
+
+def test_cache_principais_evita_consulta_e_invalida_ao_remover(
+    client, token, admin_token, user, monkeypatch
+):
+    monkeypatch.setattr(settings, 'METRICAS_TOKEN', 'segredo')
+    headers = {'Authorization': f'Bearer {token}'}
+
+    client.get('/meus-agendamentos', headers=headers)
+    client.get('/meus-agendamentos', headers=headers)
+    assert cache_principais.estatisticas()['acertos'] == 1
+    assert cache_principais.estatisticas()['falhas'] == 1
+    linhas = client.get(
+        '/metrics', headers={'Authorization': 'Bearer segredo'}
+    ).text.splitlines()
+    assert f'auth_cache_hits_total{{{PID}}} 1' in linhas
+    assert f'auth_cache_misses_total{{{PID}}} 1' in linhas
+
+    client.delete(
+        f'/admin/usuarios/{user.id}',
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+    response = client.get('/meus-agendamentos', headers=headers)
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_agendar_com_usuario_removido_ainda_no_cache_retorna_401(
+    client, token, session, user
+):
+    # Removido por outro worker: o cache deste ainda tem o usuário
+    session.execute(text('PRAGMA foreign_keys = ON'))
+    headers = {'Authorization': f'Bearer {token}'}
+    client.get('/meus-agendamentos', headers=headers)
+    session.execute(delete(User).where(User.id == user.id))
+    session.commit()
+
+    response = client.post(
+        '/agendar',
+        json={'data': '2029-11-01', 'hora': '10:00:00'},
+        headers=headers,
+    )
+
+    assert response.status_code == HTTPStatus.UNAUTHORIZED
+    assert response.json() == {'detail': 'Usuário não encontrado'}
+    assert cache_principais.obter(user.id) is None
+
+
+def test_admin_agendar_aluno_removido_no_meio_retorna_404(
+    client, token, admin_token, session, user
+):
+    session.execute(text('PRAGMA foreign_keys = ON'))
+    headers = {'Authorization': f'Bearer {admin_token}'}
+    # Admin e aluno no cache de usuários
+    client.get('/admin/usuarios', headers=headers)
+    client.get('/meus-agendamentos', headers={'Authorization': f'Bearer {token}'})
+
+    @event.listens_for(session, 'do_orm_execute', once=True)
+    def remover_depois_da_consulta(estado):
+        # Outra requisição remove o aluno logo depois da rota lê-lo
+        resultado = estado.invoke_statement().freeze()
+        estado.session.connection().execute(
+            text('DELETE FROM users WHERE id = :id'), {'id': user.id}
+        )
+        return resultado()
+
+    response = client.post(
+        '/admin/agendar',
+        json={'id_usuario': user.id, 'data': '2029-11-01', 'hora': '10:00:00'},
+        headers=headers,
+    )
+
+    assert response.status_code == HTTPStatus.NOT_FOUND
+    assert response.json() == {'detail': 'Usuário não encontrado'}
+    assert cache_principais.obter(user.id) is not None
+
+
+def test_cache_principais_com_varios_workers_encurta_o_ttl(client, monkeypatch):
+    monkeypatch.setattr(database.settings, 'WORKERS', 2)
+    monkeypatch.setattr(cache_principais, 'ttl', 60)
+    monkeypatch.setattr(indice_disponibilidade, 'ttl', None)
+
+    with TestClient(app):
+        assert cache_principais.ttl == (
+            database.settings.AUTH_CACHE_TTL_WORKERS_SEGUNDOS
+        )
+
+
+def test_rotas_leitura_confiam_nas_claims(client, monkeypatch):
+    monkeypatch.setattr(security.settings, 'AUTH_CONFIAR_CLAIMS', True)
+    token = criar_token({
+        'user_id': 99,
+        'nome': 'Sem Cadastro',
+        'email': 'fantasma@example.com',
+        'is_admin': False,
+    })
+
+    response = client.get(
+        '/meus-agendamentos', headers={'Authorization': f'Bearer {token}'}
+    )
+    assert response.status_code == HTTPStatus.OK
+    assert cache_principais.estatisticas()['falhas'] == 0
+
+
+def test_criar_agendamento_horario_ocupado_retorna_409(client, token):
+    headers = {'Authorization': f'Bearer {token}'}
+    corpo = {'data': '2029-11-01', 'hora': '10:00:00'}
+
+    assert client.post('/agendar', json=corpo, headers=headers).status_code == (
+        HTTPStatus.CREATED
+    )
+    response = client.post('/agendar', json=corpo, headers=headers)
+    assert response.status_code == HTTPStatus.CONFLICT
+    assert response.json() == {'detail': 'Horário indisponível'}
+
+
+def test_reservar_horario_concorrente_tem_um_vencedor(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "disputa.db"}')
+    table_registry.metadata.create_all(engine)
+    with Session(engine) as session:
+        aluno = User(nome='Aluno', email='aluno@example.com', senha='x')
+        session.add(aluno)
+        session.commit()
+        id_usuario = aluno.id
+
+    concorrentes = 16
+    largada = threading.Barrier(concorrentes)
+
+    def tentar(_):
+        with Session(engine) as session:
+            largada.wait()
+            novo_id = reservar_horario(
+                session, id_usuario, date(2029, 11, 1), time(10, 0)
+            )
+            session.commit()
+            return novo_id
+
+    with ThreadPoolExecutor(max_workers=concorrentes) as executor:
+        resultados = list(executor.map(tentar, range(concorrentes)))
+
+    vencedores = [r for r in resultados if r is not None]
+    assert len(vencedores) == 1
+    with Session(engine) as session:
+        assert session.scalar(select(func.count(Agendamento.id))) == 1
+    engine.dispose()
+
+
+def test_reservar_horarios_sem_on_conflict_perde_so_o_horario_disputado(
+    session, user, monkeypatch
+):
+    monkeypatch.setattr(services, '_INSERT_COM_CONFLITO', frozenset())
+    disputado, livre = (date(2029, 11, 1), time(10, 0)), (date(2029, 11, 2), time(10, 0))
+
+    @event.listens_for(session, 'do_orm_execute', once=True)
+    def ocupar_depois_da_consulta(estado):
+        # Outra transação ocupa um dos horários entre a consulta e o INSERT
+        resultado = estado.invoke_statement().freeze()
+        estado.session.connection().execute(
+            insert(Agendamento).values(
+                id_usuario=user.id, data=disputado[0], hora=disputado[1]
+            )
+        )
+        return resultado()
+
+    criados = reservar_horarios(session, user.id, [disputado, livre])
+    session.commit()
+
+    assert list(criados) == [livre]
+    assert session.scalar(select(func.count(Agendamento.id))) == 2  # noqa: PLR2004
+
+
+def test_reservar_horarios_sem_on_conflict_nao_disfarca_erro_de_chave(
+    session, monkeypatch
+):
+    monkeypatch.setattr(services, '_INSERT_COM_CONFLITO', frozenset())
+    session.execute(text('PRAGMA foreign_keys = ON'))
+
+    # Usuário inexistente não é disputa de horário: o erro sobe
+    with pytest.raises(sqlalchemy_exc.IntegrityError):
+        reservar_horarios(session, 999, [(date(2029, 11, 1), time(10, 0))])
+    assert session.scalar(select(func.count(Agendamento.id))) == 0
+
+
+def test_agendar_lote_regra_semanal_com_conflito(
+    client, admin_token, session, user
+):
+    # 2029-11-06 é uma terça-feira
+    session.add(
+        Agendamento(id_usuario=user.id, data=date(2029, 11, 13), hora=time(10, 0))
+    )
+    session.commit()
+
+    response = client.post(
+        '/admin/agendar/lote',
+        json={
+            'id_usuario': user.id,
+            'hora': '10:00:00',
+            'dia_semana': 1,
+            'inicio': '2029-11-01',
+            'fim': '2029-11-30',
+        },
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+    assert response.status_code == HTTPStatus.CREATED
+    data = response.json()
+    assert [a['data'] for a in data['criados']] == [
+        '2029-11-06',
+        '2029-11-20',
+        '2029-11-27',
+    ]
+    assert data['conflitos'] == [
+        {
+            'data': '2029-11-13',
+            'hora': '10:00:00',
+            'motivo': 'Horário indisponível',
+        }
+    ]
+    assert session.scalar(select(func.count(Agendamento.id))) == 4  # noqa: PLR2004
+
+
+def test_agendar_lote_exige_regra_ou_datas(client, admin_token, user):
+    response = client.post(
+        '/admin/agendar/lote',
+        json={'id_usuario': user.id, 'hora': '10:00:00', 'dia_semana': 1},
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_registrar_cria_primeiro_pagamento_num_unico_commit(client, session):
+    commits = []
+    event.listen(session, 'after_commit', commits.append)
+
+    response = client.post(
+        '/registrar',
+        json={'nome': 'bob', 'email': 'bob@example.com', 'senha': 'secret'},
+    )
+    assert response.status_code == HTTPStatus.CREATED
+    assert len(commits) == 1
+    pagamento = session.scalar(
+        select(Pagamento).where(Pagamento.id_usuario == response.json()['id'])
+    )
+    assert pagamento.status == 'Atrasado'
+
+
+def test_importar_usuarios_csv_com_relatorio_de_erros(
+    client, admin_token, session, user
+):
+    linhas = ['nome,email,senha']
+    linhas.extend(
+        f'Aluno {i},aluno{i}@example.com,senha{i}' for i in range(1_200)
+    )
+    linhas.extend([
+        f'Repetido,{user.email},x',
+        'Duplicado,aluno0@example.com,x',
+        'Sem email,,x',
+    ])
+    arquivo = '\n'.join(linhas).encode()
+
+    response = client.post(
+        '/admin/usuarios/importar',
+        files={'arquivo': ('alunos.csv', arquivo, 'text/csv')},
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+    assert response.status_code == HTTPStatus.OK
+    data = response.json()
+    assert data['criados'] == 1_200  # noqa: PLR2004
+    assert [(e['linha'], e['erro']) for e in data['erros']] == [
+        (1202, 'Email já cadastrado'),
+        (1203, 'Email já cadastrado'),
+        (1204, 'Dados inválidos: email'),
+    ]
+    assert session.scalar(
+        select(func.count(Pagamento.id)).where(Pagamento.id_usuario != user.id)
+    ) == 1_200  # noqa: PLR2004
+
+
+def test_importar_usuarios_arquivo_quebrado_grava_as_linhas_anteriores(
+    client, admin_token, session
+):
+    linhas = ['nome,email,senha']
+    linhas.extend(f'Aluno {i},aluno{i}@example.com,x' for i in range(3))
+    # Campo acima do limite do módulo csv na linha 5
+    linhas.append(f'Grande,{"x" * 200_000},x')
+    linhas.append('Depois,depois@example.com,x')
+
+    response = client.post(
+        '/admin/usuarios/importar',
+        files={'arquivo': ('alunos.csv', '\n'.join(linhas).encode(), 'text/csv')},
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+
+    data = response.json()
+    assert data['criados'] == 3  # noqa: PLR2004
+    assert [e['linha'] for e in data['erros']] == [5]
+    assert data['erros'][0]['erro'].startswith('Arquivo inválido: field larger')
+    assert session.scalar(
+        select(User.id).where(User.email == 'aluno2@example.com')
+    )
+
+
+def test_lote_de_importacao_refeito_um_a_um_relata_os_emails_ja_cadastrados(
+    session, user, monkeypatch
+):
+    consultar = session.scalars
+
+    def corrida(*args, **kwargs):
+        # A consulta pelos existentes não vê o email cadastrado em paralelo:
+        # o lote falha inteiro e é refeito linha a linha
+        monkeypatch.setattr(session, 'scalars', consultar)
+        return []
+
+    monkeypatch.setattr(session, 'scalars', corrida)
+    linhas = [
+        (2, {'nome': 'Ana', 'email': 'ana@example.com', 'senha': 'x'}),
+        (3, {'nome': 'Repetido', 'email': user.email, 'senha': 'x'}),
+    ]
+
+    resultado = importar_usuarios(session, linhas)
+
+    assert resultado.criados == 1
+    assert [(e.linha, e.email, e.erro) for e in resultado.erros] == [
+        (3, user.email, 'Email já cadastrado'),
+    ]
+
+
+def test_importar_usuarios_ndjson(client, admin_token, session):
+    arquivo = b'\n'.join([
+        b'{"nome": "Ana", "email": "ana@example.com", "senha": "x"}',
+        b'{"nome": "Ana", "email": "ana@example.com", "senha": "y"}',
+        b'nao e json',
+    ])
+
+    response = client.post(
+        '/admin/usuarios/importar',
+        files={'arquivo': ('alunos.ndjson', arquivo, 'application/x-ndjson')},
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+    data = response.json()
+    assert data['criados'] == 1
+    assert [(e['linha'], e['erro']) for e in data['erros']] == [
+        (2, 'Email repetido no arquivo'),
+        (3, 'Dados inválidos: linha'),
+    ]
+
+
+def test_varredura_e_listagem_de_atrasados(client, admin_token, session, user):
+    session.add_all([
+        Pagamento(
+            id_usuario=user.id,
+            data_vencimento=date(2020, 1, 10),
+            status='Em dia',
+        ),
+        Pagamento(
+            id_usuario=user.id,
+            data_vencimento=date(2020, 2, 10),
+            status='Em dia',
+        ),
+        Pagamento(
+            id_usuario=user.id,
+            data_vencimento=date(2099, 1, 10),
+            status='Em dia',
+        ),
+    ])
+    session.commit()
+    corrigir_pagamento_atual(session)
+
+    assert varrer_pagamentos_atrasados(session) == 2  # noqa: PLR2004
+    headers = {'Authorization': f'Bearer {admin_token}'}
+
+    primeira = client.get(
+        '/admin/pagamentos/atrasados?limit=1', headers=headers
+    ).json()
+    assert [p['data_vencimento'] for p in primeira['pagamentos']] == [
+        '2020-01-10'
+    ]
+    segunda = client.get(
+        '/admin/pagamentos/atrasados?limit=1&cursor='
+        + primeira['proximo_cursor'],
+        headers=headers,
+    ).json()
+    assert [p['data_vencimento'] for p in segunda['pagamentos']] == [
+        '2020-02-10'
+    ]
+    assert segunda['proximo_cursor'] is None
+
+
+def _plano(session, consulta):
+    sql = consulta.compile(
+        dialect=session.get_bind().dialect,
+        compile_kwargs={'literal_binds': True},
+    )
+    linhas = session.execute(text(f'EXPLAIN QUERY PLAN {sql}')).all()
+    return ' | '.join(linha[-1] for linha in linhas)
+
+
+def test_consultas_frequentes_usam_indices(session):
+    ultimo_pagamento = (
+        select(Pagamento)
+        .where(Pagamento.id_usuario == 1)
+        .order_by(Pagamento.data_vencimento.desc())
+        .limit(1)
+    )
+    assert 'ix_pagamentos_id_usuario_data_vencimento' in _plano(
+        session, ultimo_pagamento
+    )
+
+    meus_agendamentos = (
+        select(Agendamento)
+        .where(Agendamento.id_usuario == 1)
+        .order_by(Agendamento.data, Agendamento.hora)
+    )
+    plano = _plano(session, meus_agendamentos)
+    assert 'ix_agendamentos_id_usuario_data_hora' in plano
+    assert 'TEMP B-TREE' not in plano
+
+    atrasados = (
+        select(Pagamento)
+        .where(Pagamento.status == 'Atrasado')
+        .order_by(Pagamento.data_vencimento)
+    )
+    assert 'ix_pagamentos_status_data_vencimento' in _plano(session, atrasados)
+
+
+def test_pagamento_atual_acompanha_aprovacao(client, admin_token, session):
+    novo = client.post(
+        '/registrar',
+        json={'nome': 'carol', 'email': 'carol@example.com', 'senha': 'x'},
+    ).json()
+    usuario = session.get(User, novo['id'])
+    primeiro_id = usuario.pagamento_atual_id
+    assert usuario.pagamento_status == 'Atrasado'
+
+    client.patch(
+        f'/admin/pagamentos/{primeiro_id}/aprovar',
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+    session.refresh(usuario)
+    assert usuario.pagamento_atual_id != primeiro_id
+    assert usuario.pagamento_status == 'Em dia'
+    assert verificar_pagamento_atual(session) == []
+
+    # Meses em atraso: o próximo vencimento também já passou
+    session.get(Pagamento, primeiro_id).data_vencimento = date(2019, 12, 10)
+    atual = session.get(Pagamento, usuario.pagamento_atual_id)
+    atual.data_vencimento = usuario.pagamento_vencimento = date(2020, 1, 10)
+    session.commit()
+    client.patch(
+        f'/admin/pagamentos/{atual.id}/aprovar',
+        headers={'Authorization': f'Bearer {admin_token}'},
+    )
+    session.refresh(usuario)
+    proximo = session.get(Pagamento, usuario.pagamento_atual_id)
+    assert proximo.data_vencimento == date(2020, 2, 10)
+    assert proximo.status == usuario.pagamento_status == 'Atrasado'
+    assert verificar_pagamento_atual(session) == []
+
+
+def test_verificar_e_corrigir_pagamento_atual(session, user):
+    session.add(
+        Pagamento(
+            id_usuario=user.id,
+            data_vencimento=date(2029, 1, 10),
+            status='Em dia',
+        )
+    )
+    session.commit()
+    assert verificar_pagamento_atual(session) == [user.id]
+
+    corrigir_pagamento_atual(session, [user.id])
+    assert verificar_pagamento_atual(session) == []
+    assert user.pagamento_vencimento == date(2029, 1, 10)
+
+
+def test_meus_agendamentos_e_status_com_etag_por_usuario(client, token):
+    cabecalho = {'Authorization': f'Bearer {token}'}
+    primeira = client.get('/meus-agendamentos', headers=cabecalho)
+    etag = primeira.headers['etag']
+
+    repetida = client.get(
+        '/meus-agendamentos', headers={**cabecalho, 'If-None-Match': etag}
+    )
+    assert repetida.status_code == HTTPStatus.NOT_MODIFIED
+    assert not repetida.content
+
+    # A mesma versão vale para o status, que também depende dos pagamentos
+    status_304 = client.get(
+        '/pagamento/status', headers={**cabecalho, 'If-None-Match': etag}
+    )
+    assert status_304.status_code == HTTPStatus.NOT_MODIFIED
+
+    criado = client.post(
+        '/agendar',
+        headers=cabecalho,
+        json={'data': '2030-03-01', 'hora': '10:00'},
+    ).json()
+    depois = client.get(
+        '/meus-agendamentos', headers={**cabecalho, 'If-None-Match': etag}
+    )
+    assert depois.status_code == HTTPStatus.OK
+    assert depois.headers['etag'] != etag
+    assert [a['id'] for a in depois.json()] == [criado['id']]
+
+    etag = depois.headers['etag']
+    client.delete(f'/cancelar-agendamento/{criado["id"]}', headers=cabecalho)
+    cancelado = client.get(
+        '/meus-agendamentos', headers={**cabecalho, 'If-None-Match': etag}
+    )
+    assert cancelado.status_code == HTTPStatus.OK
+    assert cancelado.json() == []
+
+
+def test_listagens_admin_com_etag_global(client, admin_token, session, user):
+    cabecalho = {'Authorization': f'Bearer {admin_token}'}
+    etag = client.get('/admin/usuarios', headers=cabecalho).headers['etag']
+    assert (
+        client.get(
+            '/admin/usuarios', headers={**cabecalho, 'If-None-Match': etag}
+        ).status_code
+        == HTTPStatus.NOT_MODIFIED
+    )
+
+    # Qualquer escrita em pagamentos muda a versão global
+    session.add(
+        Pagamento(
+            id_usuario=user.id,
+            data_vencimento=date(2020, 1, 1),
+            status='Em dia',
+        )
+    )
+    session.commit()
+    varrer_pagamentos_atrasados(session, hoje=date(2020, 2, 1))
+    assert session.get(User, user.id).versao == 1
+
+    resposta = client.get(
+        '/admin/pagamentos/atrasados',
+        headers={**cabecalho, 'If-None-Match': etag},
+    )
+    assert resposta.status_code == HTTPStatus.OK
+    assert resposta.headers['etag'] != etag
+
+
+def _nextval_emulado(conexao):
+    # Mesma regra do nextval do Postgres, numa tabela com as colunas da
+    # sequência; no SQLite o UPDATE precisa do commit, o nextval não
+    conexao.execute(
+        text(
+            'UPDATE versao_global'
+            ' SET last_value = last_value + is_called, is_called = 1'
+        )
+    )
+    conexao.commit()
+
+
+def test_versao_global_pela_sequencia_sem_segunda_conexao(
+    tmp_path, monkeypatch, caplog
+):
+    # Pool de uma conexão: o nextval não pode pedir outra ao pool
+    engine = create_engine(
+        f'sqlite:///{tmp_path / "sequencia.db"}',
+        poolclass=QueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.1,
+    )
+    table_registry.metadata.create_all(engine)
+    with engine.begin() as conexao:
+        conexao.execute(
+            text('CREATE TABLE versao_global (last_value INTEGER, is_called BOOLEAN)')
+        )
+        conexao.execute(text('INSERT INTO versao_global VALUES (1, 0)'))
+    monkeypatch.setattr(engine.dialect, 'supports_sequences', True)
+    monkeypatch.setattr(services, '_avancar_sequencia', _nextval_emulado)
+
+    def escrever(session, indice):
+        session.add(User(nome='Aluno', email=f'aluno{indice}@example.com', senha='x'))
+        registrar_alteracao(session)
+        session.commit()
+
+    with Session(engine) as session:
+        # Sequência recém-criada: nenhum nextval ainda
+        assert versao_global(session) == 0
+        for indice in (1, 2):
+            escrever(session, indice)
+            assert versao_global(session) == indice
+        assert session.scalar(select(Versao.valor)) == 0
+
+    def falha(conexao):
+        raise sqlalchemy_exc.OperationalError('nextval', {}, Exception('fora'))
+
+    monkeypatch.setattr(services, '_avancar_sequencia', falha)
+    with Session(engine) as session:
+        # A escrita fica gravada; só a versão deixa de avançar
+        escrever(session, 3)
+        assert session.scalar(select(func.count(User.id))) == 3  # noqa: PLR2004
+        assert versao_global(session) == 2  # noqa: PLR2004
+    assert 'Falha ao avançar a versão global' in caplog.text
+    engine.dispose()
+
+
+def test_listagem_serializada_das_linhas_igual_ao_schema(
+    client, admin_token, session, user
+):
+    resposta = client.get(
+        '/admin/usuarios', headers={'Authorization': f'Bearer {admin_token}'}
+    )
+    assert resposta.headers['content-type'] == 'application/json'
+
+    linhas = session.execute(
+        select(
+            User.id,
+            User.nome,
+            User.email,
+            User.is_admin,
+            User.pagamento_status.label('status_pagamento'),
+            User.pagamento_vencimento.label('data_proximo_vencimento'),
+        ).order_by(User.id)
+    ).all()
+    esperado = UserList(users=linhas, proximo_after_id=None)
+    assert resposta.json() == esperado.model_dump(mode='json')
+    assert adaptador(UserList) is adaptador(UserList)
+    assert linhas_como_dicts(linhas)[0]['email'] == 'admin@example.com'
+
+
+def test_benchmark_de_endpoints_cobre_todas_as_rotas(tmp_path):
+    relatorio = executar(
+        f'sqlite:///{tmp_path / "benchmark.db"}',
+        volume=30,
+        requisicoes=2,
+        aquecimento=0,
+    )
+
+    assert relatorio['rotas_sem_cenario'] == []
+    for rota, medidas in relatorio['rotas'].items():
+        codigos = [int(codigo) for codigo in medidas['status']]
+        assert max(codigos) < HTTPStatus.BAD_REQUEST, rota
+        assert medidas['p50_ms'] <= medidas['p99_ms']
+    assert comparar(relatorio, relatorio) == []
+
+
+def test_caminho_assincrono_atende_todas_as_rotas(tmp_path):
+    # DB_ASYNC vale na importação do app: roda o benchmark noutro processo
+    saida = tmp_path / 'async.json'
+    subprocess.run(
+        [
+            sys.executable, '-m', 'benchmarks.endpoints',
+            '--database-url', f'sqlite:///{tmp_path / "async.db"}',
+            '--volume', '30', '--requisicoes', '2', '--saida', str(saida),
+        ],
+        env=os.environ | {'DB_ASYNC': 'true'},
+        check=True,
+        capture_output=True,
+    )
+
+    relatorio = json.loads(saida.read_text(encoding='utf-8'))
+    assert relatorio['meta']['async'] is True
+    assert relatorio['rotas_sem_cenario'] == []
+    for rota, medidas in relatorio['rotas'].items():
+        codigos = [int(codigo) for codigo in medidas['status']]
+        assert max(codigos) < HTTPStatus.BAD_REQUEST, rota
+
+
+def test_conversao_das_dependencias_para_o_caminho_assincrono():
+    assert assincrona(get_session) is get_session_async
+    assert assincrona(get_current_user) is get_current_user_async
+    # Sem banco na árvore, fica como está (e dependency_overrides vale)
+    assert assincrona(get_armazem_comprovantes) is get_armazem_comprovantes
+
+    condicional = assincrona(condicional_usuario)
+    assert inspect.iscoroutinefunction(condicional)
+    assert condicional is assincrona(condicional_usuario)
+    dependencias = {
+        parametro.default.dependency
+        for parametro in inspect.signature(condicional).parameters.values()
+        if parametro.default is not inspect.Parameter.empty
+    }
+    assert dependencias == {get_session_async, get_current_user_leitura_async}
+
+    # A importação fica no limitador de threads, com a sessão síncrona
+    rota = RotaAssincrona('/admin/usuarios/importar', importar_usuarios_admin)
+    assert rota.endpoint is importar_usuarios_admin
+    assert get_session in {d.call for d in rota.dependant.dependencies}
+
+
+def test_metrics_por_rota_com_consultas_ao_banco(
+    client, token, session, monkeypatch
+):
+    monkeypatch.setattr(settings, 'METRICAS_TOKEN', 'segredo')
+    instrumentar_engine(session.get_bind())
+    cabecalho = {'Authorization': f'Bearer {token}'}
+    requisicoes = 2
+    for _ in range(requisicoes):
+        client.get('/meus-agendamentos', headers=cabecalho)
+    client.get('/rota-inexistente')
+
+    resposta = client.get(
+        '/metrics', headers={'Authorization': 'Bearer segredo'}
+    )
+    assert resposta.headers['content-type'].startswith('text/plain; version=0.0.4')
+    linhas = resposta.text.splitlines()
+    rotulos = f'{PID},method="GET",route="/meus-agendamentos"'
+    assert f'http_requests_total{{{rotulos},status="200"}} {requisicoes}' in linhas
+    assert (
+        f'http_requests_total{{{PID},method="GET",route="(nenhuma)",status="404"}} 1'
+        in linhas
+    )
+    assert (
+        f'http_request_duration_seconds_bucket{{{rotulos},le="+Inf"}} {requisicoes}'
+        in linhas
+    )
+    consultas = next(
+        linha for linha in linhas
+        if linha.startswith(f'db_queries_total{{{rotulos}}}')
+    )
+    # Ao menos a versão do usuário e a listagem, em cada requisição
+    assert int(consultas.split()[-1]) >= 2 * requisicoes
+
+    assert client.get('/metrics').status_code == HTTPStatus.UNAUTHORIZED
+    errado = client.get('/metrics', headers={'Authorization': 'Bearer x'})
+    assert errado.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_metrics_sem_token_configurado_fica_fechada(client, monkeypatch):
+    monkeypatch.setattr(settings, 'METRICAS_TOKEN', None)
+
+    assert client.get('/metrics').status_code == HTTPStatus.UNAUTHORIZED
+    resposta = client.get('/metrics', headers={'Authorization': 'Bearer None'})
+    assert resposta.status_code == HTTPStatus.UNAUTHORIZED
+
+
+def test_threads_acompanham_o_pool(client, caplog, monkeypatch):
+    monkeypatch.setattr(settings, 'METRICAS_TOKEN', 'segredo')
+    capacidade = settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    assert threads_para_pool(10, 5) == 15  # noqa: PLR2004
+    assert threads_para_pool(10, 5, 8) == 8  # noqa: PLR2004
+    assert threads_para_pool(10, 5, 40) == 15  # noqa: PLR2004
+    assert 'excede o pool' in caplog.text
+
+    # O lifespan do client já aplicou o valor ao limitador do AnyIO
+    linhas = client.get(
+        '/metrics', headers={'Authorization': 'Bearer segredo'}
+    ).text.splitlines()
+    assert f'threadpool_tokens_total{{{PID}}} {capacidade}' in linhas
+
+
+def test_admissao_no_banco_evita_travar_threads_e_conexoes(
+    tmp_path, monkeypatch, user, token
+):
+    # Uma conexão e uma thread: a requisição que pegou a conexão na
+    # condicional de ETag precisa de outra thread para a rota
+    monkeypatch.setattr(settings, 'DB_POOL_SIZE', 1)
+    monkeypatch.setattr(settings, 'DB_MAX_OVERFLOW', 0)
+    monkeypatch.setattr(settings, 'THREADPOOL_TOKENS', None)
+    engine = create_engine(
+        f'sqlite:///{tmp_path / "admissao.db"}',
+        connect_args={'check_same_thread': False},
+        poolclass=QueuePool,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.5,
+    )
+    table_registry.metadata.create_all(engine)
+    with engine.begin() as conexao:
+        conexao.execute(
+            insert(User).values(
+                id=user.id, nome='Aluno', email='a@example.com', senha='x'
+            )
+        )
+
+    # Como get_session, mas sobre o engine de uma conexão
+    def get_session_pequena(_vaga: None = Depends(admitir_no_banco)):
+        with Session(engine) as session:
+            yield session
+
+    app.dependency_overrides[get_session] = get_session_pequena
+    headers = {'Authorization': f'Bearer {token}'}
+    try:
+        with TestClient(app) as client, ThreadPoolExecutor(4) as executor:
+            respostas = list(
+                executor.map(
+                    lambda _: client.get('/meus-agendamentos', headers=headers),
+                    range(8),
+                )
+            )
+    finally:
+        app.dependency_overrides.clear()
+        engine.dispose()
+
+    assert {r.status_code for r in respostas} == {HTTPStatus.OK}
+
+
+def test_metricas_do_pool_com_espera_e_esgotamento(tmp_path):
+    engine = create_engine(
+        f'sqlite:///{tmp_path / "pool.db"}',
+        poolclass=PoolMedido,
+        pool_size=1,
+        max_overflow=0,
+        pool_timeout=0.05,
+    )
+    pools = {'principal': engine}
+    with engine.connect():
+        assert 'db_pool_connections_in_use{pool="principal"} 1' in list(
+            linhas_pool(pools)
+        )
+        with pytest.raises(sqlalchemy_exc.TimeoutError):
+            engine.connect()
+
+    linhas = list(linhas_pool(pools))
+    assert 'db_pool_connections_in_use{pool="principal"} 0' in linhas
+    assert 'db_pool_connections_max{pool="principal"} 1' in linhas
+    assert 'db_pool_checkout_timeouts_total{pool="principal"} 1' in linhas
+    assert 'db_pool_checkout_wait_seconds_count{pool="principal"} 2' in linhas
+    # O checkout que esgotou esperou o pool_timeout inteiro
+    assert (
+        'db_pool_checkout_wait_seconds_bucket{pool="principal",le="0.025"} 1'
+        in linhas
+    )
+    engine.dispose()
+
+
+def test_perfil_sqlite_aplica_pragmas_e_escritor_unico(tmp_path):
+    leitura, escrita = criar_engines(f'sqlite:///{tmp_path / "perfil.db"}')
+    for engine in (leitura, escrita):
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+            # 1 = NORMAL
+            assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1
+            assert (
+                conn.exec_driver_sql('PRAGMA busy_timeout').scalar()
+                == settings.SQLITE_BUSY_TIMEOUT_MS
+            )
+    assert escrita.pool.size() == 1
+    assert leitura.pool.size() == settings.DB_POOL_SIZE
+
+    # Fora do SQLite em arquivo não há engine separada de escrita
+    memoria, mesma = criar_engines('sqlite://')
+    assert memoria is mesma
+    for engine in (leitura, escrita, memoria):
+        engine.dispose()
+
+
+def test_sessao_sqlite_le_pelo_pool_e_escreve_pela_conexao_unica(tmp_path):
+    leitura, escrita = criar_engines(f'sqlite:///{tmp_path / "rotas.db"}')
+    table_registry.metadata.create_all(escrita)
+
+    with SessaoSQLite(leitura, escrita) as session:
+        assert session.get_bind() is leitura
+        session.add(User(nome='Ana', email='ana@example.com', senha='x'))
+        session.flush()
+        assert session.get_bind() is escrita
+        # A leitura seguinte enxerga o que a transação ainda não confirmou
+        assert session.scalar(select(func.count(User.id))) == 1
+        session.commit()
+        assert session.get_bind() is leitura
+        assert escrita.pool.checkedout() == 0
+
+    # Reservas simultâneas: todas entram, sem "database is locked"
+    def reservar(indice):
+        with SessaoSQLite(leitura, escrita) as session:
+            for dia in range(10):
+                data = date(2030, 1, 1) + timedelta(days=indice * 10 + dia)
+                reservar_horario(session, 1, data, time(10))
+                session.commit()
+
+    threads = 8
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(reservar, range(threads)))
+    with SessaoSQLite(leitura, escrita) as session:
+        assert session.scalar(select(func.count(Agendamento.id))) == threads * 10
+    leitura.dispose()
+    escrita.dispose()
+
+
+def test_gunicorn_usa_workers_das_settings_e_preload(monkeypatch):
+    monkeypatch.setattr(settings, 'WORKERS', 3)
+    config = runpy.run_path('gunicorn.conf.py')
+
+    assert config['workers'] == 3  # noqa: PLR2004
+    assert config['preload_app'] is True
+    assert config['worker_class'] == 'uvicorn_worker.UvicornWorker'
+
+
+def test_worker_descarta_as_conexoes_herdadas(tmp_path, monkeypatch):
+    leitura, _ = criar_engines(f'sqlite:///{tmp_path / "fork.db"}')
+    monkeypatch.setitem(database.pools, 'teste', leitura)
+    with leitura.connect() as conn:
+        herdada = conn.connection.dbapi_connection
+    pool_herdado = leitura.pool
+
+    descartar_conexoes_herdadas()
+
+    assert leitura.pool is not pool_herdado
+    with leitura.connect() as conn:
+        assert conn.connection.dbapi_connection is not herdada
+    # A conexão continua aberta: ela pertence ao processo pai
+    assert herdada.execute('SELECT 1').fetchone() == (1,)
+    herdada.close()
+    leitura.dispose()
+
+
+# Consultas por requisição de cada rota de leitura, com caches frios; o
+# número não pode depender da quantidade de linhas no banco
+ORCAMENTO_CONSULTAS = [
+    ('aluno', '/meus-agendamentos', 3),
+    ('aluno', '/pagamento/status', 3),
+    ('aluno', '/horarios-disponiveis?inicio={hoje}&fim={fim}', 2),
+    ('aluno', '/horarios-disponiveis/{hoje}', 2),
+    ('admin', '/admin/usuarios', 3),
+    ('admin', '/admin/usuarios?status_pagamento=Atrasado', 3),
+    ('admin', '/admin/agendamentos?inicio={hoje}&fim={fim}', 3),
+    ('admin', '/admin/usuarios/{id_aluno}/pagamentos', 3),
+    ('admin', '/admin/pagamentos/atrasados', 3),
+]
+
+
+def _popular(session, quantidade: int, id_aluno: int, deslocamento: int):
+    """Insere ``quantidade`` usuários, pagamentos e agendamentos."""
+    hoje = date.today()
+    ids = session.scalars(
+        insert(User).returning(User.id),
+        [
+            {
+                'nome': f'Usuário {deslocamento + i}',
+                'email': f'usuario{deslocamento + i}@example.com',
+                'senha': 'x',
+            }
+            for i in range(quantidade)
+        ],
+    ).all()
+    session.execute(
+        insert(Pagamento),
+        [
+            {
+                'id_usuario': id_usuario,
+                'data_vencimento': hoje - timedelta(days=i % 30),
+                'status': ('Atrasado', 'Em dia')[i % 2],
+            }
+            for i, id_usuario in enumerate([*ids, *[id_aluno] * quantidade])
+        ],
+    )
+    session.execute(
+        insert(Agendamento),
+        [
+            {
+                'id_usuario': id_aluno if i % 2 else ids[i],
+                'data': hoje + timedelta(days=(deslocamento + i) // 10),
+                'hora': time(8 + (deslocamento + i) % 10),
+            }
+            for i in range(quantidade)
+        ],
+    )
+    session.commit()
+    corrigir_pagamento_atual(session)
+
+
+@pytest.fixture
+def perfis(user, token, admin_token):
+    return {
+        'aluno': {'Authorization': f'Bearer {token}'},
+        'admin': {'Authorization': f'Bearer {admin_token}'},
+        'id_aluno': user.id,
+    }
+
+
+@pytest.mark.parametrize('caso', ORCAMENTO_CONSULTAS, ids=lambda caso: caso[1])
+def test_orcamento_de_consultas_nao_depende_do_volume(
+    client, session, consultas, perfis, caso
+):
+    perfil, rota, orcamento = caso
+    hoje = date.today()
+    url = rota.format(
+        hoje=hoje, fim=hoje + timedelta(days=30), id_aluno=perfis['id_aluno']
+    )
+    medidas = []
+    for quantidade, deslocamento in ((10, 0), (990, 10)):
+        _popular(session, quantidade, perfis['id_aluno'], deslocamento)
+        indice_disponibilidade.limpar()
+        cache_principais.limpar()
+        with consultas.orcamento(orcamento) as comandos:
+            resposta = client.get(url, headers=perfis[perfil])
+        assert resposta.status_code == HTTPStatus.OK
+        medidas.append(len(comandos))
+    assert medidas[0] == medidas[1]
+
+
+def _agendar(session, perfis, passo):
+    data = date.today() + timedelta(days=200 + passo)
+    return {'json': {'data': str(data), 'hora': '20:00'}}
+
+
+def _cadastrar(session, perfis, passo):
+    return {
+        'json': {
+            'nome': f'Novo {passo}',
+            'email': f'novo{passo}@example.com',
+            'senha': 'senha',
+        }
+    }
+
+
+def _importar(session, perfis, passo):
+    linhas = ['nome,email,senha']
+    linhas.extend(
+        f'Importado {i},importado{passo}_{i}@example.com,x' for i in range(5)
+    )
+    linhas.append(f'Repetido,novo{passo}@example.com,x')
+    session.add(User(nome='Novo', email=f'novo{passo}@example.com', senha='x'))
+    session.commit()
+    arquivo = '\n'.join(linhas).encode()
+    return {'files': {'arquivo': ('alunos.csv', arquivo, 'text/csv')}}
+
+
+def _enviar_comprovante(session, perfis, passo):
+    conteudo = f'%PDF-1.4 comprovante {passo}'.encode()
+    return {'files': {'arquivo': ('c.pdf', conteudo, 'application/pdf')}}
+
+
+def _aprovar(session, perfis, passo):
+    return {}
+
+
+def _pagamento_atual(session, perfis):
+    return session.scalar(
+        select(User.pagamento_atual_id).where(User.id == perfis['id_aluno'])
+    )
+
+
+# Consultas das rotas de escrita: (perfil, método, rota, corpo da
+# requisição no passo, orçamento); também não dependem do volume
+ORCAMENTO_ESCRITAS = [
+    ('aluno', 'POST', '/agendar', _agendar, 4),
+    ('admin', 'POST', '/admin/usuarios', _cadastrar, 5),
+    ('admin', 'POST', '/admin/usuarios/importar', _importar, 6),
+    ('aluno', 'POST', '/pagamento/comprovante', _enviar_comprovante, 7),
+    ('admin', 'PATCH', '/admin/pagamentos/{id_pagamento}/aprovar', _aprovar, 11),
+]
+
+
+@pytest.mark.parametrize('caso', ORCAMENTO_ESCRITAS, ids=lambda caso: caso[2])
+def test_orcamento_de_consultas_das_escritas(
+    client, session, consultas, perfis, caso
+):
+    perfil, metodo, rota, corpo, orcamento = caso
+    medidas = []
+    for passo, (quantidade, deslocamento) in enumerate(((10, 0), (990, 10))):
+        _popular(session, quantidade, perfis['id_aluno'], deslocamento)
+        url = rota.format(id_pagamento=_pagamento_atual(session, perfis))
+        requisicao = corpo(session, perfis, passo)
+        indice_disponibilidade.limpar()
+        cache_principais.limpar()
+        with consultas.orcamento(orcamento) as comandos:
+            resposta = client.request(
+                metodo, url, headers=perfis[perfil], **requisicao
+            )
+        assert resposta.status_code < HTTPStatus.BAD_REQUEST
+        medidas.append(len(comandos))
+    assert medidas[0] == medidas[1]
+
+
+def test_orcamento_de_consultas_lista_os_comandos(session, consultas):
+    def duas_consultas():
+        with consultas.orcamento(1):
+            session.execute(select(User.id))
+            session.execute(select(Pagamento.id))
+
+    with pytest.raises(pytest.fail.Exception) as erro:
+        duas_consultas()
+
+    assert '2 consultas, orçamento de 1' in str(erro.value)
+    assert 'FROM pagamentos' in str(erro.value)
+
+
+def test_normalizar_agrupa_a_mesma_forma_de_consulta():
+    assert normalizar(
+        "SELECT * FROM users WHERE id IN (?, ?, ?) AND nome = 'Ana'  LIMIT 10"
+    ) == normalizar('SELECT * FROM users WHERE id IN (%(id_1)s) AND nome = $1 LIMIT 5')
+    assert normalizar(
+        'INSERT INTO t (a, b) VALUES (?, ?), (?, ?)'
+    ) == 'INSERT INTO t (a, b) VALUES (...)'
+    assert normalizar('SELECT x::date FROM t') == 'SELECT x::date FROM t'
+
+
+def test_diagnostico_de_consultas_lentas(
+    client, admin_token, session, monkeypatch, caplog
+):
+    monkeypatch.setattr(registro_consultas, 'limite_ms', 0)
+    monkeypatch.setattr(registro_consultas, 'ativo', False)
+    registro_consultas.instrumentar(session.get_bind())
+    instrumentar_engine(session.get_bind())
+    cabecalho = {'Authorization': f'Bearer {admin_token}'}
+
+    with caplog.at_level('WARNING', logger='agendamento.query_log'):
+        client.get('/admin/pagamentos/atrasados', headers=cabecalho)
+    assert any(
+        'em /admin/pagamentos/atrasados' in registro.getMessage()
+        for registro in caplog.records
+    )
+
+    resposta = client.get(
+        '/admin/diagnostics/queries?limite=1', headers=cabecalho
+    ).json()
+    assert resposta['ativo'] is True
+    [consulta] = resposta['consultas']
+    assert consulta['contagem'] >= 1
+    assert consulta['max_ms'] >= consulta['p95_ms'] > 0
+    assert '?' in consulta['sql']
+
+
+# Módulos que importar a aplicação não pode carregar: dialetos e drivers
+# vêm com a primeira engine, no lifespan
+MODULOS_PREGUICOSOS = (
+    'sqlalchemy.dialects.postgresql',
+    'sqlalchemy.dialects.sqlite',
+    'psycopg2',
+    'sqlite3',
+    'asyncpg',
+    'aiosqlite',
+)
+IMPORTAR_APLICACAO = f"""
+import json, sys
+import agendamento.app
+from agendamento import database, settings
+print(json.dumps({{
+    'carregados': [m for m in {MODULOS_PREGUICOSOS!r} if m in sys.modules],
+    'engines': database.engines.cache_info().currsize,
+    'pools': len(database.pools),
+    'settings': settings.get_settings.cache_info().misses,
+}}))
+"""
+
+
+def test_importacao_da_aplicacao_fica_preguicosa():
+    resultado = subprocess.run(
+        [sys.executable, '-c', IMPORTAR_APLICACAO],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # Nenhum driver nem engine, e o .env lido uma vez só
+    assert json.loads(resultado.stdout) == {
+        'carregados': [],
+        'engines': 0,
+        'pools': 0,
+        'settings': 1,
+    }